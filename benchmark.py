@@ -0,0 +1,207 @@
+import argparse
+import csv
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from fakejenkins import FakeJenkins
+
+'''
+    Throughput benchmark for the Jenkins deployment scripts, run against fakejenkins.py.
+
+    Every scenario (row count x engine configuration) gets a freshly generated input file and
+    a fresh fake Jenkins (three for the multi-master configuration). The script runs as a
+    subprocess pointed at the fakes through JENKINS_URL(S) / GITLAB_URL. The benchmark reports wall-clock time, the requests the fake
+    served, and the script's peak thread count and peak RSS. Run it before and after a
+    scheduling or polling change and compare the tables, or append them to a file with --output.
+
+    Usage: python benchmark.py --rows 100 1000 --configs deployment-threads deployment-async
+           python benchmark.py --rows 1000 --build-duration 20 --latency 0.05 --error-rate 0.02
+'''
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_INTERVAL = 0.1  # Seconds between thread-count samples of the running script
+NOTIFY_TOKEN = 'benchmark'  # Shared secret between the fakes' callbacks and the --listen port
+
+DEPLOYMENT_COLUMNS = ['AppName', 'JobName', 'Branch', 'ITReleaseVersion', 'ChangeNumberPROD', 'CTaskPROD', 'OBC', 'CBC']
+GROUP_COLUMNS = ['AppName', 'JobName', 'Env', 'ChangeRequest', 'ChangeTask', 'ITReleaseVersion', 'OBC', 'CBC', 'BranchName']
+GITLAB_COLUMNS = DEPLOYMENT_COLUMNS + ['Stage', 'DependsOn']
+
+# name -> (script, arguments, input columns, receives pushed notifications, fake masters)
+CONFIGS = {
+    'deployment-threads': ('jenkinsdeployment.py', ['BENCH', '--engine', 'threads', '--input', '{input}'], DEPLOYMENT_COLUMNS, False, 1),
+    'deployment-async': ('jenkinsdeployment.py', ['BENCH', '--engine', 'async', '--input', '{input}'], DEPLOYMENT_COLUMNS, False, 1),
+    'deployment-async-push': ('jenkinsdeployment.py', ['BENCH', '--engine', 'async', '--input', '{input}'], DEPLOYMENT_COLUMNS, True, 1),
+    'deployment-async-3-masters': ('jenkinsdeployment.py', ['BENCH', '--engine', 'async', '--input', '{input}'], DEPLOYMENT_COLUMNS, False, 3),
+    'group': ('jenkinsgroup.py', ['--input', '{input}'], GROUP_COLUMNS, False, 1),
+    'gitlab-dag': ('gitlab-jenkins.py', ['BENCH', '--excel-file', '{input}'], GITLAB_COLUMNS, False, 1),
+}
+
+# Request kinds counted by the fake that were sent by the script (notifications go the other way)
+REQUEST_KINDS = ['trigger', 'queue', 'queue_item', 'job', 'build', 'computer', 'gitlab', 'other']
+
+
+def column_value(column, index, args):
+    # Every row gets its own change number, so no two rows coalesce into one build
+    values = {
+        'AppName': f"app-{index}",
+        'JobName': f"job-{index % args.jobs}",
+        'Branch': "main",
+        'BranchName': "main",
+        'Env': "BENCH",
+        'ITReleaseVersion': "1.0",
+        'ChangeNumberPROD': f"CHG{index:06d}",
+        'ChangeRequest': f"CHG{index:06d}",
+        'CTaskPROD': f"CTASK{index:06d}",
+        'ChangeTask': f"CTASK{index:06d}",
+        'OBC': "no",
+        'CBC': "no",
+        'Stage': str(index * args.stages // args.row_count + 1),
+        'DependsOn': "",
+    }
+    return values[column]
+
+
+def write_input(path, columns, args):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for index in range(args.row_count):
+            writer.writerow([column_value(column, index, args) for column in columns])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def thread_count(pid):
+    # Linux only; elsewhere peak threads are reported as 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def run_script(command, cwd, env, log_path, timeout):
+    """Run one script to completion; returns (seconds, exit code, peak threads, peak RSS in MB)."""
+    started = time.monotonic()
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        peak_threads = 0
+        while True:
+            peak_threads = max(peak_threads, thread_count(process.pid))
+            # wait4 hands back the child's own resource usage, so RSS is per run, not the running maximum
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.monotonic() - started > timeout:
+                print(f"Timed out after {timeout}s, killing {command[1]}")
+                process.kill()
+            time.sleep(SAMPLE_INTERVAL)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return time.monotonic() - started, process.returncode, peak_threads, rss
+
+
+def run_scenario(name, args):
+    script, script_args, columns, push, master_count = CONFIGS[name]
+    with tempfile.TemporaryDirectory(prefix='jenkins-benchmark-') as work_dir:
+        input_path = os.path.join(work_dir, 'jobs.csv')
+        write_input(input_path, columns, args)
+
+        listen_port = free_port() if push else None
+        fakes = [FakeJenkins(port=0, queue_delay=args.queue_delay, build_duration=args.build_duration,
+                             notify_url=f"http://127.0.0.1:{listen_port}/?token={NOTIFY_TOKEN}" if push else None,
+                             latency=args.latency, error_rate=args.error_rate, executors=args.executors).start()
+                 for _ in range(master_count)]
+        env = dict(os.environ, JENKINS_URL=fakes[0].url, JENKINS_URLS=",".join(fake.url for fake in fakes),
+                   GITLAB_URL=f"{fakes[0].url}/gitlab/api/v4", JENKINS_TRIGGER_RATE=str(args.trigger_rate),
+                   JENKINS_NOTIFY_TOKEN=NOTIFY_TOKEN)
+        command = [sys.executable, os.path.join(REPO_DIR, script)] + [arg.format(input=input_path) for arg in script_args]
+        if push:
+            command += ['--listen', str(listen_port)]
+
+        log_path = os.path.join(work_dir, 'output.log')
+        try:
+            seconds, exit_code, peak_threads, rss = run_script(command, work_dir, env, log_path, args.timeout)
+        finally:
+            for fake in fakes:
+                fake.stop()
+        if exit_code != 0:
+            with open(log_path) as f:
+                print(f"{name} exited with {exit_code}; last output:\n{''.join(f.readlines()[-20:])}")
+
+    stats = {}
+    for fake in fakes:
+        for kind, count in fake.stats().items():
+            stats[kind] = stats.get(kind, 0) + count
+    return {
+        'config': name,
+        'rows': args.row_count,
+        'seconds': round(seconds, 2),
+        'rows_per_second': round(args.row_count / seconds, 2),
+        'requests': sum(stats.get(kind, 0) for kind in REQUEST_KINDS),
+        'status_requests': sum(stats.get(kind, 0) for kind in ('queue', 'queue_item', 'job', 'build')),
+        'errors': stats.get('errors', 0),
+        'builds': stats.get('builds', 0),
+        'peak_threads': peak_threads,
+        'rss_mb': round(rss, 1),
+        'exit_code': exit_code,
+    }
+
+
+def print_table(results):
+    headers = ['config', 'rows', 'seconds', 'rows_per_second', 'requests', 'status_requests', 'errors',
+               'builds', 'peak_threads', 'rss_mb', 'exit_code']
+    widths = [max(len(header), *(len(str(result[header])) for result in results)) for header in headers]
+    print('  '.join(header.ljust(width) for header, width in zip(headers, widths)))
+    for result in results:
+        print('  '.join(str(result[header]).ljust(width) for header, width in zip(headers, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Jenkins deployment scripts against a local fake Jenkins')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 5000], help='Row counts to run each configuration with')
+    parser.add_argument('--configs', nargs='+', choices=sorted(CONFIGS), default=list(CONFIGS), help='Engine configurations to run')
+    parser.add_argument('--jobs', type=int, default=20, help='Distinct Jenkins job names the rows are spread over')
+    parser.add_argument('--stages', type=int, default=3, help='Stages the gitlab-dag rows are split into')
+    parser.add_argument('--queue-delay', type=float, default=1.0, help='Seconds each fake build waits in the queue')
+    parser.add_argument('--build-duration', type=float, default=5.0, help='Seconds each fake build runs')
+    parser.add_argument('--executors', type=int, default=0, help='Builds each fake master runs at once (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the fake adds to every answer')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests the fake answers with a 503')
+    parser.add_argument('--trigger-rate', type=float, default=50, help='Triggers per second the scripts may send (JENKINS_TRIGGER_RATE)')
+    parser.add_argument('--timeout', type=float, default=3600, help='Seconds before a run is killed')
+    parser.add_argument('--output', help='Append every result to this JSON-lines file')
+    args = parser.parse_args()
+
+    results = []
+    for row_count in args.rows:
+        for name in args.configs:
+            args.row_count = row_count
+            print(f"Running {name} with {row_count} rows...")
+            result = run_scenario(name, args)
+            print(f"{name}: {result['seconds']}s, {result['requests']} requests, "
+                  f"{result['peak_threads']} threads, {result['rss_mb']} MB")
+            results.append(result)
+            if args.output:
+                with open(args.output, 'a') as f:
+                    f.write(json.dumps(dict(result, queue_delay=args.queue_delay, build_duration=args.build_duration,
+                                            executors=args.executors, latency=args.latency, error_rate=args.error_rate,
+                                            trigger_rate=args.trigger_rate, timestamp=time.time())) + '\n')
+
+    print()
+    print_table(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+import hmac
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from buildpoller import BuildWaiter
+from projectindex import ProjectIndex
+
+'''
+    Long-running "latest branch" service for the pipelines that used to run latestbranch.py.
+
+    It keeps the project index and the newest matching branch of every project asked about
+    in memory, and answers
+        GET  /latest?app=<name>  -> {"project": ..., "match": ..., "branch": ..., "committed_date": ...}
+        GET  /health             -> counters
+        POST /hook               -> GitLab system hook (or project webhook) events
+    Push events move a project's latest branch forward from the pushed commit's timestamp.
+    A deleted branch, a rewound branch or a new branch without commits cannot be decided from
+    the event alone; the project is then re-read from the API in the background. Project
+    create/rename/transfer/destroy events keep the index current, and the whole index is
+    re-crawled every REINDEX_INTERVAL for anything the hooks missed.
+
+    The state is written to a JSON file every SAVE_INTERVAL (and on stop), so a restart
+    answers at once from disk. Entries older than MAX_AGE are still answered but re-read
+    in the background, which covers events lost while the service was down.
+'''
+
+REINDEX_INTERVAL = 6 * 3600  # Seconds between full project crawls
+MAX_AGE = 24 * 3600  # Seconds before a stored latest branch is re-read from the API
+SAVE_INTERVAL = 30  # Seconds between writes of the state file while something changed
+REFRESH_WORKERS = 4  # Projects re-read from the API at the same time
+NO_COMMIT = "0" * 40
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        if url.path == "/health":
+            return self._send(200, service.stats())
+        if url.path != "/latest":
+            return self._send(404, {"error": "unknown path"})
+        app = parse_qs(url.query).get("app", [""])[0]
+        if not app:
+            return self._send(400, {"error": "app is required"})
+        answer = service.latest(app)
+        self._send(200 if answer else 404, answer or {"app": app, "error": "no matching project"})
+
+    def do_POST(self):
+        service = self.server.service
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        token = self.headers.get("X-Gitlab-Token") or ""
+        if service.hook_token and not hmac.compare_digest(token.encode("utf-8"), service.hook_token.encode("utf-8")):
+            return self._send(401, {"error": "bad token"})
+        try:
+            payload = json.loads(body)
+        except (ValueError, UnicodeDecodeError):
+            return self._send(400, {"error": "bad payload"})
+        self._send(200, {})
+        service.handle_event(payload)
+
+
+class LatestBranchService:
+    def __init__(self, crawl_projects, fetch_latest_branch, branch_prefixes, state_path,
+                 host="127.0.0.1", port=8080, hook_token=None):
+        self.crawl_projects = crawl_projects  # () -> every project to index
+        self.fetch_latest_branch = fetch_latest_branch  # project id -> branch dict or None
+        self.branch_prefixes = tuple(branch_prefixes)
+        self.state_path = state_path
+        self.host = host
+        self.port = port
+        self.hook_token = hook_token
+        self.index = ProjectIndex()
+        self.indexed_at = 0
+        self.branches = {}  # project id -> {"branch": branch dict or None, "checked_at": epoch seconds}
+        self.requests_answered = 0
+        self.events_received = 0
+        self.api_reads = 0
+        self.maintenance_errors = 0  # Failed reindex/save rounds of the maintenance thread
+        self._fetching = {}  # project id -> BuildWaiter of the API read in flight
+        self._changed = set()  # Projects that got an event while their API read was in flight
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # The maintenance thread and stop() may both save
+        self._stop = threading.Event()
+        self._refresher = ThreadPoolExecutor(REFRESH_WORKERS)
+        self._server = None
+
+    def start(self):
+        self.load()
+        if not len(self.index) or time.time() - self.indexed_at > REINDEX_INTERVAL:
+            self.reindex()
+        self._server = ThreadingHTTPServer((self.host, self.port), _ServiceHandler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="latest-branch-http", daemon=True).start()
+        threading.Thread(target=self._run, name="latest-branch-maintenance", daemon=True).start()
+        print(f"Serving latest branches of {len(self.index)} projects on http://{self.host}:{self.port}/latest?app=")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self._refresher.shutdown(wait=True)
+        self.save()
+
+    def _run(self):
+        while not self._stop.wait(SAVE_INTERVAL):
+            try:
+                if time.time() - self.indexed_at > REINDEX_INTERVAL:
+                    self.reindex()
+                if self._dirty:
+                    self.save()
+            except Exception as e:
+                # Keep the thread alive: the next round retries, and /health shows the failures
+                print(f"Exception during service maintenance: {e}")
+                with self._lock:
+                    self.maintenance_errors += 1
+
+    def load(self):
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable state file {self.state_path}: {e}")
+            return
+        for project in state.get("projects", []):
+            self.index.add(project)
+        self.branches = {int(project_id): entry for project_id, entry in state.get("latest", {}).items()}
+        self.indexed_at = state.get("indexed_at", 0)
+        print(f"Loaded {len(self.index)} projects and {len(self.branches)} latest branches from {self.state_path}")
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                self._dirty = False
+                state = {"indexed_at": self.indexed_at, "latest": dict(self.branches),
+                         "projects": self.index.projects()}
+            with open(self.state_path + ".tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(self.state_path + ".tmp", self.state_path)
+
+    def reindex(self):
+        projects = self.crawl_projects()
+        if not projects:
+            print("Project crawl returned nothing; keeping the current index")
+            return
+        index = ProjectIndex(projects)
+        with self._lock:
+            self.index = index
+            self.indexed_at = time.time()
+            for project_id in set(self.branches) - {project["id"] for project in projects}:
+                del self.branches[project_id]
+            self._dirty = True
+        print(f"Indexed {len(index)} projects")
+
+    def latest(self, app):
+        project, how = self.index.lookup(app)
+        if project is None:
+            return None
+        with self._lock:
+            self.requests_answered += 1
+            entry = self.branches.get(project["id"])
+        if entry is None:
+            branch = self._read(project["id"])  # First request for this project waits for the API
+        else:
+            branch = entry["branch"]
+            if time.time() - entry["checked_at"] > MAX_AGE:
+                self._refresh(project["id"])
+        return {"app": app, "project": project["path_with_namespace"], "project_id": project["id"], "match": how,
+                "branch": branch["name"] if branch else None,
+                "committed_date": branch["commit"]["committed_date"] if branch else None}
+
+    def _read(self, project_id):
+        # One API read per project at a time; concurrent requests wait for the same answer
+        with self._lock:
+            waiter = self._fetching.get(project_id)
+            first = waiter is None
+            if first:
+                waiter = self._fetching[project_id] = BuildWaiter()
+                self._changed.discard(project_id)
+        if not first:
+            return waiter.wait()
+        branch = None
+        try:
+            branch = self.fetch_latest_branch(project_id)
+            with self._lock:
+                self.api_reads += 1
+                self.branches[project_id] = {"branch": branch, "checked_at": time.time()}
+                self._dirty = True
+        except Exception as e:
+            print(f"Exception during reading branches of project {project_id}: {e}")
+        finally:
+            with self._lock:
+                del self._fetching[project_id]
+                again = project_id in self._changed
+            waiter.resolve(branch)
+        if again:
+            self._refresh(project_id)  # An event arrived mid-read; the answer may predate it
+        return branch
+
+    def _refresh(self, project_id):
+        if not self._stop.is_set():
+            self._refresher.submit(self._read, project_id)
+
+    def _stale(self, project_id):
+        with self._lock:
+            if project_id in self._fetching:
+                self._changed.add(project_id)
+                return
+            known = project_id in self.branches
+        if known:
+            self._refresh(project_id)
+
+    def handle_event(self, payload):
+        with self._lock:
+            self.events_received += 1
+        event = payload.get("event_name") or payload.get("object_kind")
+        project_id = payload.get("project_id") or (payload.get("project") or {}).get("id")
+        if event == "push" and project_id:
+            self._handle_push(project_id, payload)
+        elif event == "repository_update" and project_id:
+            # Only refs, no commit dates: re-read if a tracked branch changed
+            if any(self._tracked(change.get("ref", "")) for change in payload.get("changes", [])):
+                self._stale(project_id)
+        elif event in ("project_create", "project_rename", "project_transfer") and project_id and payload.get("path"):
+            self.index.add({"id": project_id, "name": payload.get("name") or payload["path"], "path": payload["path"],
+                            "path_with_namespace": payload.get("path_with_namespace") or payload["path"]})
+            with self._lock:
+                self._dirty = True
+        elif event == "project_destroy" and project_id:
+            self.index.remove(project_id)
+            with self._lock:
+                self.branches.pop(project_id, None)
+                self._dirty = True
+
+    def _tracked(self, ref):
+        return ref.startswith("refs/heads/") and ref[len("refs/heads/"):].startswith(self.branch_prefixes)
+
+    def _handle_push(self, project_id, payload):
+        ref = payload.get("ref", "")
+        if not self._tracked(ref):
+            return
+        name = ref[len("refs/heads/"):]
+        head = next((commit for commit in payload.get("commits", []) if commit.get("id") == payload.get("after")), None)
+        with self._lock:
+            entry = self.branches.get(project_id)
+            if project_id in self._fetching:
+                self._changed.add(project_id)
+                return
+        if entry is None:
+            return  # Not asked about yet; the first request reads it from the API
+        current = entry["branch"]
+        if payload.get("after") == NO_COMMIT or head is None or not head.get("timestamp"):
+            # Deleted, or created/rewound without a commit to date it: only the API can tell
+            if payload.get("after") != NO_COMMIT or (current and current["name"] == name):
+                self._stale(project_id)
+            return
+        pushed = {"name": name, "commit": {"committed_date": head["timestamp"]}}
+        if current is None or parse_time(head["timestamp"]) >= parse_time(current["commit"]["committed_date"]):
+            with self._lock:
+                self.branches[project_id] = {"branch": pushed, "checked_at": entry["checked_at"]}
+                self._dirty = True
+        elif current["name"] == name:
+            self._stale(project_id)  # The latest branch went back in time; another may be newer now
+
+    def stats(self):
+        with self._lock:
+            return {"projects": len(self.index), "latest_known": len(self.branches), "indexed_at": self.indexed_at,
+                    "requests_answered": self.requests_answered, "events_received": self.events_received,
+                    "api_reads": self.api_reads, "maintenance_errors": self.maintenance_errors}
@@ -0,0 +1,296 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+import requests
+
+'''
+    Shared build-status poller for the Jenkins deployment scripts.
+
+    Instead of every in-flight build asking Jenkins "done yet?" on its own, rows register
+    what they are waiting for (a queue item or a build) and one background thread sweeps:
+        - one /queue/api/json call for all pending queue items
+        - one {job}/api/json?tree=builds[...] call per distinct job for all running builds
+    and hands the answers out to the waiting rows. The request rate depends on the number
+    of distinct jobs, not the number of builds.
+
+    Checks are scheduled adaptively rather than every poll_interval:
+        - a running build is next checked halfway to its expected finish (timestamp +
+          estimatedDuration), so long builds are left alone and short ones are caught quickly
+        - a queue item backs off exponentially while Jenkins reports it blocked or stuck
+'''
+
+BUILDS_PER_JOB_REQUEST = 100  # Newest builds returned per job sweep; older watched builds are fetched one by one
+EARLY_NOTIFICATIONS = 10000  # Pushed results kept for builds nobody is watching yet
+
+
+class BuildWaiter:
+    """Result slot shared by everything waiting on the same queue item or build."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.result = None
+        self.watched_at = time.time()
+        self.resolved_at = None
+        self.next_check = self.watched_at  # When the poller should next ask about this item
+        self.delay = None  # Current queue backoff in seconds
+        self.checks = 0  # Status requests that asked about this item (one batched request counts for every item in it)
+        self.info = None  # Last build JSON seen (timestamp, duration, ...), for builds
+
+    def done(self):
+        return self._event.is_set()
+
+    def resolve(self, result):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.result = result
+            self.resolved_at = time.time()
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(result)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self.result)
+
+    def wait(self):
+        self._event.wait()
+        return self.result
+
+    async def wait_async(self):
+        # Bridge to asyncio: the poller thread wakes the awaiting task through the loop
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake(result):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(result))
+
+        self.add_done_callback(wake)
+        return await future
+
+
+class BuildStatusPoller:
+    def __init__(self, jenkins_url, client, job_url=None, poll_interval=10, min_interval=2, max_interval=120, governor=None):
+        self.jenkins_url = jenkins_url
+        self.client = client  # httpclient.HttpClient carrying the Jenkins credentials
+        # Maps a job name to its URL; the scripts differ on whether jobs live under /job/
+        self.job_url = job_url or (lambda job_name: f"{jenkins_url}/{job_name}")
+        self.poll_interval = poll_interval  # Fixed interval the scripts used to poll at; still the default step
+        self.min_interval = min_interval  # Never check the same item more often than this
+        self.max_interval = max_interval  # Never leave an item unchecked longer than this
+        self.governor = governor  # Optional TriggerGovernor fed with the master's queue length
+        self.requests_made = 0
+        self._queue_waiters = {}  # queue_id -> BuildWaiter resolving to a build number (None if cancelled)
+        self._build_waiters = {}  # job_name -> {build_number: BuildWaiter resolving to the build result}
+        self._build_paths = {}  # URL path of a watched build -> (job_name, build_number), for pushed notifications
+        self._early = OrderedDict()  # Pushed results that arrived before anyone watched the item
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch_queue(self, queue_id):
+        queue_id = str(queue_id)
+        with self._lock:
+            waiter = self._queue_waiters.setdefault(queue_id, self._new_waiter())
+            early = self._early.pop(("queue", queue_id), None)
+        if early is not None:
+            waiter.resolve(early)
+        return waiter
+
+    def watch_build(self, job_name, build_number):
+        path = self._build_path(f"{self.job_url(job_name)}/{build_number}")
+        with self._lock:
+            waiter = self._build_waiters.setdefault(job_name, {}).setdefault(int(build_number), self._new_waiter())
+            self._build_paths[path] = (job_name, int(build_number))
+            early = self._early.pop(("build", path), None)
+        if early is not None:
+            waiter.resolve(early)
+        return waiter
+
+    def _build_path(self, build_url):
+        # Notifications carry either the full build URL or one relative to the Jenkins root
+        parsed = urlparse(build_url)
+        path = parsed.path.strip("/")
+        if not parsed.netloc:
+            path = f"{urlparse(self.jenkins_url).path.strip('/')}/{path}".strip("/")
+        return path
+
+    def _remember_early(self, key, value):
+        self._early[key] = value
+        while len(self._early) > EARLY_NOTIFICATIONS:
+            self._early.popitem(last=False)
+
+    def notify_started(self, queue_id, build_number):
+        """Pushed by a notification listener: the queue item became this build."""
+        queue_id = str(queue_id)
+        with self._lock:
+            waiter = self._queue_waiters.get(queue_id)
+            if waiter is None:
+                self._remember_early(("queue", queue_id), int(build_number))
+                return False
+        waiter.resolve(int(build_number))
+        return True
+
+    def notify_finished(self, build_url, result):
+        """Pushed by a notification listener: the build at build_url finished with result."""
+        path = self._build_path(build_url)
+        with self._lock:
+            watched = self._build_paths.get(path)
+            if watched is None:
+                self._remember_early(("build", path), result)
+                return False
+            job_name, build_number = watched
+            waiter = self._build_waiters[job_name][build_number]
+        waiter.resolve(result)
+        return True
+
+    def _new_waiter(self):
+        waiter = BuildWaiter()
+        waiter.next_check = waiter.watched_at + self.min_interval
+        return waiter
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="build-status-poller", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        # Wake often but cheaply; poll_once only issues requests for items that are due
+        while not self._stop.wait(self.min_interval):
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Exception in build status poller: {e}")
+
+    def _get_json(self, url, params=None, missing=None):
+        # Returns None on errors (try again later) and `missing` when Jenkins answers 404
+        self.requests_made += 1
+        try:
+            response = self.client.get(url, params=params)
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code == 404 and missing is not None:
+                return missing
+            print(f"Failed to fetch {url}: {response.status_code}")
+        except requests.RequestException as e:
+            print(f"Exception during fetching {url}: {e}")
+        return None
+
+    def poll_once(self):
+        now = time.time()
+        with self._lock:
+            queued = {queue_id: waiter for queue_id, waiter in self._queue_waiters.items() if not waiter.done()}
+            running = {job_name: {number: waiter for number, waiter in builds.items() if not waiter.done()}
+                       for job_name, builds in self._build_waiters.items()}
+        running = {job_name: builds for job_name, builds in running.items() if builds}
+        due_jobs = [job_name for job_name, builds in running.items()
+                    if any(waiter.next_check <= now for waiter in builds.values())]
+        queue_due = any(waiter.next_check <= now for waiter in queued.values())
+        if not queue_due and not due_jobs:
+            return
+        print(f"Waiting on {len(queued)} queued and {sum(map(len, running.values()))} running builds "
+              f"across {len(running)} jobs...")
+        if queue_due:
+            self._sweep_queue(queued)
+        for job_name in due_jobs:
+            self._sweep_job(job_name, running[job_name])
+
+    def _sweep_queue(self, queued):
+        # Items still listed in the queue have not started; only the ones that left need a lookup
+        queue_info = self._get_json(f"{self.jenkins_url}/queue/api/json", {"tree": "items[id,blocked,stuck]"})
+        if queue_info is None:
+            return
+        still_queued = {str(item.get("id")): item for item in queue_info.get("items", [])}
+        if self.governor:
+            self.governor.observe_queue(len(still_queued))
+        now = time.time()
+        for queue_id, waiter in queued.items():
+            waiter.checks += 1
+            if queue_id in still_queued:
+                self._schedule_queue_item(waiter, still_queued[queue_id], now)
+                continue
+            waiter.checks += 1
+            item = self._get_json(f"{self.jenkins_url}/queue/item/{queue_id}/api/json", missing={})
+            if item is None:
+                continue
+            if item.get("executable"):
+                waiter.resolve(item["executable"]["number"])
+            elif item.get("cancelled"):
+                print(f"Build with queueId {queue_id} was cancelled.")
+                waiter.resolve(None)
+            elif not item:
+                # Jenkins forgets left queue items after a few minutes, e.g. when resuming a long-dead run
+                print(f"Queue item {queue_id} no longer exists in Jenkins.")
+                waiter.resolve(None)
+
+    def _schedule_queue_item(self, waiter, item, now):
+        if item.get("blocked") or item.get("stuck"):
+            # Blocked (e.g. waiting on another build) or stuck (no executor can take it): back off hard
+            waiter.delay = min(max(waiter.delay or self.poll_interval, self.poll_interval) * 2, self.max_interval)
+        else:
+            # Quiet period or waiting for a free executor: start quick, relax towards poll_interval
+            waiter.delay = min((waiter.delay or self.min_interval / 2) * 2, self.poll_interval)
+        waiter.next_check = now + waiter.delay
+
+    def _sweep_job(self, job_name, waiters):
+        tree = f"builds[number,result,duration,estimatedDuration,timestamp]{{0,{BUILDS_PER_JOB_REQUEST}}}"
+        job_info = self._get_json(f"{self.job_url(job_name)}/api/json", {"tree": tree})
+        if job_info is None:
+            return
+        builds = {build["number"]: build for build in job_info.get("builds", [])}
+        oldest_listed = min(builds) if builds else None
+        now = time.time()
+        for build_number, waiter in waiters.items():
+            waiter.checks += 1
+            build = builds.get(build_number)
+            if build is None and (oldest_listed is None or build_number < oldest_listed):
+                # Fell off the end of the batched listing, ask for this one build directly
+                waiter.checks += 1
+                build = self._get_json(f"{self.job_url(job_name)}/{build_number}/api/json",
+                                       {"tree": "number,result,duration,estimatedDuration,timestamp"})
+            if build:
+                waiter.info = build
+            if build and build.get("result"):
+                waiter.resolve(build["result"])
+            else:
+                waiter.next_check = now + self._build_delay(build, now)
+
+    def _build_delay(self, build, now):
+        estimated = (build or {}).get("estimatedDuration") or -1
+        started = (build or {}).get("timestamp") or 0
+        if estimated <= 0 or not started:
+            return self.poll_interval  # No history for this job, fall back to the fixed step
+        remaining = (started + estimated) / 1000 - now
+        if remaining <= 0:
+            return self.poll_interval  # Running over its estimate, check at the normal pace
+        # Halve the remaining time each check so polls tighten as the expected finish approaches
+        return min(max(remaining / 2, self.min_interval), self.max_interval)
+
+    def fixed_interval_requests(self):
+        # What per-build polling every poll_interval would have cost for the same waits
+        now = time.time()
+        with self._lock:
+            waiters = list(self._queue_waiters.values())
+            waiters += [waiter for builds in self._build_waiters.values() for waiter in builds.values()]
+        return sum(max(1, math.ceil(((waiter.resolved_at or now) - waiter.watched_at) / self.poll_interval))
+                   for waiter in waiters)
+
+    def summary(self):
+        fixed = self.fixed_interval_requests()
+        return (f"{self.requests_made} status requests vs ~{fixed} with fixed {self.poll_interval}s per-build polling "
+                f"({max(fixed - self.requests_made, 0)} saved)")
@@ -0,0 +1,165 @@
+import csv
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+'''
+    Per-row timings for the Jenkins deployment scripts.
+
+    Every finished row gets one timeline record built from its queue and build waiters:
+        trigger_latency   - the buildWithParameters call (empty for rows sharing another row's build)
+        queue_wait        - trigger until the queue item had a build number
+        runtime           - the build's own duration as Jenkins reports it
+        polling_overhead  - how long after Jenkins started/finished the build we noticed, i.e.
+                            time lost to the status-check schedule rather than to Jenkins
+        requests          - the trigger plus every status request that covered the row; one
+                            batched poll counts once for each row it answered
+    The records export as CSV or JSON (by file extension, with the JSON carrying the
+    p50/p95/p99 summary), and serve() exposes the live numbers in Prometheus text format
+    at /metrics while the run goes on. Together they show whether a slow release was
+    spent in this tool, in the Jenkins queue or in the builds themselves.
+'''
+
+TIMELINE_FIELDS = ['row', 'job_name', 'master', 'queue_id', 'build_number', 'result', 'triggered_at', 'started_at',
+                   'finished_at', 'trigger_latency', 'queue_wait', 'runtime', 'polling_overhead', 'requests']
+METRICS = ['trigger_latency', 'queue_wait', 'runtime', 'polling_overhead']
+PERCENTILES = [50, 95, 99]
+
+
+def percentile(samples, p):
+    # Nearest rank on an already sorted list, as in httpclient.HttpClient
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+def _seconds(value):
+    return None if value is None else round(max(value, 0.0), 3)
+
+
+class BuildTimeline:
+    def __init__(self):
+        self.rows = []
+        self._trigger_latency = {}  # row key -> seconds, until the row finishes
+        self._lock = threading.Lock()
+        self._server = None
+
+    def triggered(self, key, seconds):
+        with self._lock:
+            self._trigger_latency[key] = seconds
+
+    def finished(self, key, job_name, master_url, queue_id, build_number, queue_waiter, build_waiter, result):
+        """Record a finished row from the waiters it used (either may be None, e.g. on resume)."""
+        with self._lock:
+            trigger_latency = self._trigger_latency.pop(key, None)
+        triggered_at = queue_waiter.watched_at if queue_waiter else None
+        started_at = queue_waiter.resolved_at if queue_waiter else None
+        finished_at = build_waiter.resolved_at if build_waiter else None
+        queue_wait = started_at - triggered_at if started_at and triggered_at else None
+
+        info = build_waiter.info if build_waiter else None
+        runtime = polling_overhead = None
+        if info and info.get("timestamp") and info.get("result"):
+            # Jenkins' own start/end times; our notice lags them by however long the next check took
+            jenkins_started = info["timestamp"] / 1000
+            jenkins_finished = jenkins_started + (info.get("duration") or 0) / 1000
+            runtime = jenkins_finished - jenkins_started
+            polling_overhead = max(finished_at - jenkins_finished, 0)
+            if started_at:
+                polling_overhead += max(started_at - jenkins_started, 0)
+        elif started_at and finished_at:
+            runtime = finished_at - started_at
+
+        checks = (queue_waiter.checks if queue_waiter else 0) + (build_waiter.checks if build_waiter else 0)
+        record = {
+            'row': key, 'job_name': job_name, 'master': master_url, 'queue_id': queue_id,
+            'build_number': build_number, 'result': result,
+            'triggered_at': triggered_at, 'started_at': started_at, 'finished_at': finished_at,
+            'trigger_latency': _seconds(trigger_latency), 'queue_wait': _seconds(queue_wait),
+            'runtime': _seconds(runtime), 'polling_overhead': _seconds(polling_overhead),
+            'requests': checks + (1 if trigger_latency is not None else 0),
+        }
+        with self._lock:
+            self.rows.append(record)
+        return record
+
+    def percentiles(self):
+        """metric -> {'count', 'p50', 'p95', 'p99'} over the rows that have it."""
+        with self._lock:
+            rows = list(self.rows)
+        result = {}
+        for metric in METRICS:
+            samples = sorted(row[metric] for row in rows if row[metric] is not None)
+            result[metric] = dict({'count': len(samples)}, **{f"p{p}": percentile(samples, p) for p in PERCENTILES})
+        return result
+
+    def summary(self):
+        lines = []
+        for metric, stats in self.percentiles().items():
+            if stats['count']:
+                lines.append(f"{metric.replace('_', ' ')}: " +
+                             ", ".join(f"p{p} {stats[f'p{p}']:.2f}s" for p in PERCENTILES))
+        return "; ".join(lines) or "no finished builds"
+
+    def export(self, path):
+        with self._lock:
+            rows = list(self.rows)
+        if path.lower().endswith(".json"):
+            with open(path, "w") as f:
+                json.dump({'rows': rows, 'percentiles': self.percentiles()}, f, indent=2)
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=TIMELINE_FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+        print(f"Build timeline written to {path}")
+
+    def prometheus(self):
+        with self._lock:
+            rows = list(self.rows)
+        lines = ["# HELP jenkins_rows_finished Deployment rows finished, by build result",
+                 "# TYPE jenkins_rows_finished counter"]
+        results = {}
+        for row in rows:
+            results[row['result']] = results.get(row['result'], 0) + 1
+        lines += [f'jenkins_rows_finished{{result="{result}"}} {count}' for result, count in sorted(results.items())]
+        for metric in METRICS:
+            samples = sorted(row[metric] for row in rows if row[metric] is not None)
+            name = f"jenkins_build_{metric}_seconds"
+            lines += [f"# HELP {name} Per-row {metric.replace('_', ' ')}", f"# TYPE {name} summary"]
+            lines += [f'{name}{{quantile="{p / 100}"}} {percentile(samples, p)}' for p in PERCENTILES if samples]
+            lines += [f"{name}_sum {sum(samples)}", f"{name}_count {len(samples)}"]
+        lines += ["# HELP jenkins_row_requests_total Trigger and status requests attributed to finished rows",
+                  "# TYPE jenkins_row_requests_total counter",
+                  f"jenkins_row_requests_total {sum(row['requests'] for row in rows)}"]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="0.0.0.0"):
+        self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.timeline = self
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Serving Prometheus metrics on http://{host}:{self._server.server_address[1]}/metrics")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.server.timeline.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
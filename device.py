@@ -2,8 +2,10 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import os
 import json
 import re
+import shlex
 import subprocess
 import random
 import time
@@ -15,15 +17,25 @@ __version__ = "0.0.9"
 # Tuple types
 DeviceCategory = namedtuple('Category', ['platform', 'version', 'raw_input'])
 CategoryItem = namedtuple("CategoryItem", "category count")
+DeviceKey = namedtuple("DeviceKey", ['platform', 'version', 'family', 'state'])
 
 # only get a device belonging to this platform type
 DEVICE_CATEGORY_PLATFORM = "iOS"
 
+# model families a device name can start with; anything else is keyed by its first word
+MODEL_FAMILIES = ('iPhone', 'iPad', 'iPod', 'Apple Watch', 'Apple TV', 'Apple Vision')
+
+# simctl command line; a fake executable can stand in for it (see fakesimctl.py)
+SIMCTL = os.environ.get("SIMCTL", "xcrun simctl")
+LEASE_WAIT = 720  # 12 minutes, as --wait without the allocator
+
+args = None  # Parsed in __main__; None when imported (e.g. by deviceallocator.py)
+
 # simple debug print helper
 def dprint(name, item):
-    if not args.debug:
+    if args is None or not args.debug:
         return
-    if isinstance(item, namedtuple):
+    if isinstance(item, tuple) and hasattr(item, '_fields'):
         print(f'\n{name}\n----------\n{prettyprint_namedtuple(item)}')
     else:
         print(f'\n{name}\n----------\n{item}')
@@ -42,9 +54,20 @@ parser.add_argument("-v", "--version", help="show program version", action="stor
 parser.add_argument("--debug", help="enable debug output", action="store_true")
 parser.add_argument("--highest", help="show highest device version found", action="store_true")
 parser.add_argument("--wait", help="wait for device to become available", action="store_true")
+parser.add_argument("--simctl", help="simctl command to run (default: $SIMCTL or 'xcrun simctl')")
+parser.add_argument("--allocator", metavar="SOCKET", default=os.environ.get("DEVICE_ALLOCATOR"),
+                    help="lease the device from the allocator on this Unix socket (default: $DEVICE_ALLOCATOR)")
+parser.add_argument("--serve-allocator", metavar="SOCKET", help="run the device allocator on this Unix socket")
+parser.add_argument("--lease-ttl", type=int, default=3600, help="seconds the allocator keeps the device leased")
+parser.add_argument("--release", metavar="UDID", nargs="+", help="give leased devices back to the allocator")
+parser.add_argument("--count", type=int, help="return this many distinct devices, one UDID per line")
+parser.add_argument("--runtime", type=float, help="runtime version the devices must have, e.g. 17.5 (default: highest)")
+parser.add_argument("--family", default="iPhone", help="model family the devices must belong to (default: iPhone)")
+parser.add_argument("--model", help="device name prefix, e.g. 'iPhone 15 Pro'")
+parser.add_argument("--json", help="print the --count devices as a JSON array", action="store_true")
 
-def find_devices() -> dict:
-    cmd = ['xcrun', 'simctl', 'list', '--json', 'devices', 'available']
+def find_devices(simctl=None) -> dict:
+    cmd = shlex.split(simctl or SIMCTL) + ['list', '--json', 'devices', 'available']
     result = subprocess.run(cmd, stdout=subprocess.PIPE)
     devices = result.stdout.decode('utf-8')
     try:
@@ -103,6 +126,45 @@ def get_devices_by_category(data: dict, device_category: DeviceCategory) -> list
                 valid_devices_list.append(item)
     return valid_devices_list
 
+def model_family(name: str) -> str:
+    return next((family for family in MODEL_FAMILIES if name.startswith(family)), name.split(' ')[0])
+
+def index_devices(data: dict) -> dict:
+    # parse the listing once: (platform, runtime version, model family, state) -> devices
+    index = {}
+    for category, devices in data['devices'].items():
+        dev_category = get_family_version_from_category(category)
+        if dev_category is None:
+            continue
+        for item in devices:
+            key = DeviceKey(dev_category.platform, dev_category.version, model_family(item['name']), item['state'])
+            index.setdefault(key, []).append(dict(item, runtime=category))
+    dprint("Device index", {key: len(devices) for key, devices in index.items()})
+    return index
+
+def matching_devices(index: dict, platform=DEVICE_CATEGORY_PLATFORM, version=None, family='iPhone',
+                     model=None, states=('Shutdown',)) -> list:
+    # version None means the highest runtime that has the family/model at all, whatever its state
+    keys = [key for key in index if key.platform == platform and key.family == family
+            and (version is None or key.version == version)]
+    if model:
+        keys = [key for key in keys if any(item['name'].startswith(model) for item in index[key])]
+    if version is None and keys:
+        highest = max(key.version for key in keys)
+        keys = [key for key in keys if key.version == highest]
+    return [item for key in keys if states is None or key.state in states
+            for item in index[key] if not model or item['name'].startswith(model)]
+
+def device_constraints() -> dict:
+    return {'platform': DEVICE_CATEGORY_PLATFORM, 'version': args.runtime, 'family': args.family, 'model': args.model}
+
+def print_devices(devices: list):
+    if args.json:
+        print(json.dumps([{'udid': item['udid'], 'name': item['name'], 'runtime': item.get('runtime'),
+                           'state': item.get('state')} for item in devices]))
+    else:
+        print("\n".join(item['udid'] for item in devices), end='')
+
 def get_random_shutdown_device(data: dict) -> str:
     filter_dlist = [d for d in data if d['name'].startswith('iPhone') and d['state'] == 'Shutdown']
     return random.choice(filter_dlist) if filter_dlist else None
@@ -123,6 +185,49 @@ def output_one_random_device(data: dict):
         time.sleep(30)  # Wait a bit before trying again
         data = find_devices()  # Refresh the device list
 
+def output_random_devices(data: dict, count: int):
+    # N distinct devices from one listing, for sharding a suite across simulators
+    start_time = time.time()
+    while True:
+        devices = matching_devices(index_devices(data), **device_constraints())
+        if len(devices) >= count:
+            print_devices(random.sample(devices, count))
+            exit(0)
+        if not args.wait or time.time() - start_time > LEASE_WAIT:
+            print(f"Only {len(devices)} of {count} matching shutdown devices found")
+            exit(1)
+        print(f"Only {len(devices)} of {count} matching shutdown devices found, waiting for more devices...")
+        time.sleep(30)
+        data = find_devices() or data
+
+def output_leased_device(socket_path: str):
+    # The allocator picks the devices and guarantees no other job holds them
+    from deviceallocator import request
+    wait = LEASE_WAIT if args.wait else 0
+    holder = os.environ.get("CI_JOB_ID") or f"{os.uname().nodename}:{os.getpid()}"
+    message = {"op": "lease", "holder": holder, "ttl": args.lease_ttl, "wait": wait}
+    if args.count:
+        message.update(count=args.count, constraints=device_constraints())
+    answer = request(socket_path, message, timeout=wait + 30)
+    if "udid" not in answer and "leases" not in answer:
+        print(f"No device leased: {answer.get('error')}")
+        exit(1)
+    if args.count:
+        print_devices(answer['leases'])
+    else:
+        print(f"{answer['udid']}", end='')
+    exit(0)
+
+def run_allocator(socket_path: str):
+    from deviceallocator import DeviceAllocator
+    allocator = DeviceAllocator(socket_path, SIMCTL, default_ttl=args.lease_ttl).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        allocator.stop()
+        print(f"Allocator: {allocator.status()}")
+
 def output_all_devices(data: dict):
     highest_category = highest_category_in_platform(data, DEVICE_CATEGORY_PLATFORM)
     filtered_devices = get_devices_by_category(data, highest_category)
@@ -141,6 +246,20 @@ if __name__ == "__main__":
             exit(0)
     except argparse.ArgumentError:
         print('Catching an argumentError')
+    if args.release and not args.allocator:
+        parser.error("--release needs --allocator SOCKET (or DEVICE_ALLOCATOR)")
+    if args.simctl:
+        SIMCTL = args.simctl
+
+    if args.serve_allocator:
+        run_allocator(args.serve_allocator)
+        exit(0)
+    if args.release:
+        from deviceallocator import request
+        released = request(args.allocator, {"op": "release", "udids": args.release}).get("released")
+        exit(0 if released else 1)
+    if args.allocator and not (args.highest or args.list):
+        output_leased_device(args.allocator)
 
     # Check for devices initially
     jdata = find_devices()
@@ -158,6 +277,8 @@ if __name__ == "__main__":
             print(highest_category)
         elif args.list:
             output_all_devices(jdata)
+        elif args.count:
+            output_random_devices(jdata, args.count)
         else:
             output_one_random_device(jdata)
     else:
@@ -0,0 +1,262 @@
+import json
+import os
+import random
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+import device
+
+'''
+    Simulator lease allocator shared by every CI job on a host.
+
+    One long-lived process (device.py --serve-allocator SOCKET) owns the device inventory
+    and hands out exclusive, time-limited leases over a Unix socket, so concurrent jobs
+    can no longer pick the same UDID. Requests and answers are one JSON line each:
+        {"op": "lease", "holder": "job-123", "ttl": 3600, "wait": 720}
+            -> {"udid": ..., "expires_at": ...} or {"error": "no device available"}
+        {"op": "lease", ..., "count": 8, "constraints": {"version": 17.5, "family": "iPhone", "model": "iPhone 15"}}
+            -> {"leases": [8 distinct devices]}, all or nothing
+        {"op": "renew", "udid": ..., "ttl": 3600}   -> {"udid": ..., "expires_at": ...}
+        {"op": "release", "udids": [...]}           -> {"released": true}
+        {"op": "status"}                            -> inventory, leases and waiters
+    Waiters are served oldest first, the moment a device is released or a lease expires. A
+    waiter that has to wait holds back the devices it could use from later requests, so it
+    isn't starved by smaller ones; other requests, and every request while the waiter asks for
+    more devices than match at all, are served at once.
+
+    simctl is only run again when the CoreSimulator device set changes on disk (devices
+    created, deleted or moved to another runtime); DEVICE_SET_PATH's mtime is checked on
+    every lease and every few seconds while jobs are waiting. Devices the allocator has
+    leased out are its own from then on and their simctl state is not consulted again,
+    so a job should shut its device down before releasing it.
+'''
+
+DEVICE_SET_PATH = os.environ.get("SIMCTL_DEVICE_SET", os.path.expanduser("~/Library/Developer/CoreSimulator/Devices"))
+DEFAULT_TTL = 3600  # Seconds a lease lasts unless renewed
+INVENTORY_CHECK_INTERVAL = 5  # Seconds between device set checks while jobs are waiting
+# What a lease gets without constraints: an iPhone on the platform's highest runtime
+DEFAULT_CONSTRAINTS = {"platform": device.DEVICE_CATEGORY_PLATFORM, "version": None, "family": "iPhone", "model": None}
+
+
+class _Waiter:
+    def __init__(self, holder, ttl, count, constraints):
+        self.holder = holder
+        self.ttl = ttl
+        self.count = count
+        self.constraints = constraints
+        self.leases = None
+        self.event = threading.Event()
+
+
+class _AllocatorHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        message = {}
+        try:
+            received = json.loads(self.rfile.readline())
+            if not isinstance(received, dict):
+                raise ValueError("a request is a JSON object")
+            message = received
+            answer = self.server.allocator.handle(message)
+        except (ValueError, UnicodeDecodeError):
+            answer = {"error": "bad request"}
+        try:
+            self.wfile.write((json.dumps(answer) + "\n").encode("utf-8"))
+        except OSError:
+            # The client gave up waiting; don't keep a device leased to nobody
+            if message.get("op") == "lease":
+                leases = answer.get("leases", [answer])
+                self.server.allocator.release(*[lease["udid"] for lease in leases if "udid" in lease])
+
+
+class _AllocatorServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # Jobs often start together; past the default backlog of 5, a Unix socket refuses connects with EAGAIN
+    request_queue_size = 128
+
+
+class DeviceAllocator:
+    def __init__(self, socket_path, simctl=None, device_set_path=DEVICE_SET_PATH, default_ttl=DEFAULT_TTL):
+        self.socket_path = socket_path
+        self.simctl = simctl  # None for device.SIMCTL
+        self.device_set_path = device_set_path
+        self.default_ttl = default_ttl
+        self.index = {}  # device.DeviceKey -> devices, from the last simctl listing
+        self.leases = {}  # udid -> {"holder", "expires_at"}
+        self.inventory_refreshes = 0
+        self.leases_granted = 0
+        self._managed = set()  # udids leased out at least once
+        self._device_set_mtime = None
+        self._waiters = deque()
+        self._lock = threading.Condition()
+        self._stop = threading.Event()
+        self._server = None
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # Left behind by a previous allocator
+        with self._lock:
+            self._refresh_inventory(force=True)
+        self._server = _AllocatorServer(self.socket_path, _AllocatorHandler)
+        self._server.allocator = self
+        threading.Thread(target=self._server.serve_forever, name="device-allocator", daemon=True).start()
+        threading.Thread(target=self._run, name="device-lease-expiry", daemon=True).start()
+        print(f"Allocating {sum(len(devices) for devices in self.index.values())} devices on {self.socket_path}")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            self._lock.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def _device_set_changed(self):
+        try:
+            mtime = os.stat(self.device_set_path).st_mtime
+        except OSError:
+            mtime = None
+        changed = mtime != self._device_set_mtime
+        self._device_set_mtime = mtime
+        return changed
+
+    def _refresh_inventory(self, force=False):
+        # Called with the lock held; simctl only runs when the device set changed on disk
+        if not self._device_set_changed() and not force:
+            return
+        data = device.find_devices(self.simctl)
+        if not data:
+            print("simctl returned no devices; keeping the current inventory")
+            return
+        self.inventory_refreshes += 1
+        self.index = device.index_devices(data)
+
+    def _candidates(self, constraints):
+        # Every device the allocator may hand out for these constraints, leased or not
+        devices = device.matching_devices(self.index, states=None, **dict(DEFAULT_CONSTRAINTS, **constraints))
+        return [item for item in devices if item['state'] == 'Shutdown' or item['udid'] in self._managed]
+
+    def _free_devices(self, constraints, reserved=()):
+        return [item for item in self._candidates(constraints)
+                if item['udid'] not in self.leases and item['udid'] not in reserved]
+
+    def _grant(self, holder, ttl, free, count):
+        leases = []
+        for item in random.sample(free, count):
+            lease = {"udid": item['udid'], "name": item['name'], "runtime": item['runtime'], "state": item['state'],
+                     "holder": holder, "expires_at": time.time() + ttl}
+            self.leases[item['udid']] = lease
+            self._managed.add(item['udid'])
+            leases.append(dict(lease))
+        self.leases_granted += count
+        self._lock.notify_all()  # The expiry thread may need to wake earlier
+        return leases
+
+    def _hand_out(self):
+        """Serve waiters oldest first; returns the udids reserved for those still waiting."""
+        reserved = set()
+        for waiter in list(self._waiters):
+            free = self._free_devices(waiter.constraints, reserved)
+            if len(free) >= waiter.count:
+                self._waiters.remove(waiter)
+                waiter.leases = self._grant(waiter.holder, waiter.ttl, free, waiter.count)
+                waiter.event.set()
+                continue
+            candidates = self._candidates(waiter.constraints)
+            if len(candidates) >= waiter.count:
+                reserved.update(item['udid'] for item in candidates)  # Can be met once enough are released
+        return reserved
+
+    def _expire(self):
+        now = time.time()
+        for udid in [udid for udid, lease in self.leases.items() if lease["expires_at"] <= now]:
+            print(f"Lease of {udid} held by {self.leases[udid]['holder']} expired")
+            del self.leases[udid]
+
+    def lease(self, holder=None, ttl=None, wait=0, count=1, constraints=None):
+        """count distinct leased devices, or None when they didn't free up within wait seconds."""
+        ttl = ttl or self.default_ttl
+        constraints = constraints or {}
+        with self._lock:
+            self._expire()
+            self._refresh_inventory()
+            free = self._free_devices(constraints, self._hand_out())
+            if len(free) >= count:
+                return self._grant(holder, ttl, free, count)
+            if wait <= 0:
+                return None
+            waiter = _Waiter(holder, ttl, count, constraints)
+            self._waiters.append(waiter)
+            self._lock.notify_all()  # The expiry thread starts watching the device set
+        if waiter.event.wait(wait):
+            return waiter.leases
+        with self._lock:
+            if waiter.leases is None:
+                self._waiters.remove(waiter)
+            return waiter.leases  # Granted at the last moment, or None
+
+    def renew(self, udid, ttl=None):
+        with self._lock:
+            lease = self.leases.get(udid)
+            if lease is None:
+                return None
+            lease["expires_at"] = time.time() + (ttl or self.default_ttl)
+            return dict(lease)
+
+    def release(self, *udids):
+        with self._lock:
+            released = [self.leases.pop(udid, None) is not None for udid in udids]
+            self._hand_out()
+        return bool(released) and all(released)
+
+    def _run(self):
+        # Expires leases on time, and looks for new devices while jobs are waiting
+        with self._lock:
+            while not self._stop.is_set():
+                timeouts = [max(lease["expires_at"] - time.time(), 0) for lease in self.leases.values()]
+                if self._waiters:
+                    timeouts.append(INVENTORY_CHECK_INTERVAL)
+                self._lock.wait(min(timeouts) if timeouts else None)
+                self._expire()
+                if self._waiters:
+                    self._refresh_inventory()
+                self._hand_out()
+
+    def status(self):
+        with self._lock:
+            devices = [item['udid'] for devices in self.index.values() for item in devices]
+            return {"devices": devices, "leases": list(self.leases.values()),
+                    "waiting": len(self._waiters), "leases_granted": self.leases_granted,
+                    "inventory_refreshes": self.inventory_refreshes}
+
+    def handle(self, message):
+        op = message.get("op")
+        if op == "lease":
+            count = message.get("count") or 1
+            leases = self.lease(message.get("holder"), message.get("ttl"), message.get("wait") or 0, count,
+                                message.get("constraints"))
+            if not leases:
+                return {"error": f"no {count} matching devices available" if count > 1 else "no device available"}
+            return {"leases": leases} if "count" in message else leases[0]
+        if op == "renew":
+            return self.renew(message.get("udid"), message.get("ttl")) or {"error": "no such lease"}
+        if op == "release":
+            return {"released": self.release(*(message.get("udids") or [message.get("udid")]))}
+        if op == "status":
+            return self.status()
+        return {"error": f"unknown op {op!r}"}
+
+
+def request(socket_path, message, timeout=None):
+    """Send one request to the allocator and return its answer."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        with sock.makefile("rb") as answer:
+            return json.loads(answer.readline())
@@ -0,0 +1,251 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+import requests
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+'''
+    Local fake GitLab for exercising latestbranch.py and its service mode without a real instance.
+
+    Implements the endpoints latestbranch.py uses, paginated with X-Total-Pages / X-Next-Page:
+        GET /api/v4/groups?top_level_only=true
+        GET /api/v4/groups/<id>/projects?include_subgroups=true
+        GET /api/v4/projects/<id>/repository/branches?search=^prefix
+    push(), delete_branch() and create_project() change the fake's state and post the matching
+    system hook event (push / project_create) to --hook-url, the way GitLab would. --replay
+    reads a JSON-lines file of system hook payloads, applies each to the fake and posts it,
+    so a recorded day of hooks can be played against the service and its answers compared
+    with what the API says afterwards (latest()).
+
+    Usage: python fakegitlab.py --port 8090 --projects 200 --hook-url http://127.0.0.1:8080/hook --replay hooks.jsonl
+'''
+
+NO_COMMIT = "0" * 40
+
+
+class FakeGitLab:
+    def __init__(self, host="127.0.0.1", port=8090, projects=50, branches=30, hook_url=None, hook_token=None, seed=1):
+        self.host = host
+        self.port = port
+        self.hook_url = hook_url
+        self.hook_token = hook_token
+        self.requests = Counter()  # Request kind -> count, plus "hooks" for events posted
+        self.groups = {1: {"id": 1, "name": "Apps", "path": "apps", "full_path": "apps", "parent_id": None}}
+        self.projects = {}  # project id -> project dict as the simple listing returns it
+        self.branches = {}  # project id -> {branch name: committed_date}
+        self._next_sha = 1
+        self._lock = threading.Lock()
+        self._server = None
+        generator = random.Random(seed)
+        for group_id in range(2, 6):
+            self.groups[group_id] = {"id": group_id, "name": f"Team {group_id}", "path": f"team{group_id}",
+                                     "full_path": f"apps/team{group_id}", "parent_id": 1}
+        for project_id in range(1, projects + 1):
+            group = self.groups[generator.randint(1, 5)]
+            self._add_project(project_id, f"app-{project_id}", group)
+            names = ["main", "develop"] + [f"release/{number}.0" for number in range(generator.randint(0, branches))]
+            names += [f"feature/f{number}" for number in range(generator.randint(0, branches))]
+            self.branches[project_id] = {name: self._date(generator.randint(0, 300 * 24 * 3600) / 3600) for name in names}
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/api/v4"
+
+    @staticmethod
+    def _date(hours_ago):
+        return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(time.time() - hours_ago * 3600))
+
+    def _add_project(self, project_id, path, group):
+        self.projects[project_id] = {"id": project_id, "name": path, "path": path,
+                                     "path_with_namespace": f"{group['full_path']}/{path}",
+                                     "namespace": {"id": group["id"], "full_path": group["full_path"]}}
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _FakeGitLabHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="fake-gitlab", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.requests)
+
+    def latest(self, project_id, branch_prefixes):
+        """The true latest matching branch name, to compare the service's answers with."""
+        with self._lock:
+            matching = [(datetime.fromisoformat(date.replace("Z", "+00:00")), name)
+                        for name, date in self.branches.get(project_id, {}).items() if name.startswith(tuple(branch_prefixes))]
+        return max(matching)[1] if matching else None
+
+    def push(self, project_id, branch, committed_date=None):
+        committed_date = committed_date or self._date(0)
+        with self._lock:
+            before = NO_COMMIT if branch not in self.branches[project_id] else self._sha()
+            after = self._sha()
+            self.branches[project_id][branch] = committed_date
+        self.post_hook(self._push_payload(project_id, branch, before, after,
+                                          [{"id": after, "timestamp": committed_date, "message": "fake"}]))
+
+    def delete_branch(self, project_id, branch):
+        with self._lock:
+            self.branches[project_id].pop(branch, None)
+            before = self._sha()
+        self.post_hook(self._push_payload(project_id, branch, before, NO_COMMIT, []))
+
+    def create_project(self, path, group_id=1):
+        with self._lock:
+            project_id = max(self.projects) + 1
+            self._add_project(project_id, path, self.groups[group_id])
+            self.branches[project_id] = {"main": self._date(0)}
+            project = self.projects[project_id]
+        self.post_hook({"event_name": "project_create", "project_id": project_id, "name": project["name"],
+                        "path": project["path"], "path_with_namespace": project["path_with_namespace"]})
+        return project_id
+
+    def _sha(self):
+        self._next_sha += 1
+        return f"{self._next_sha:040x}"
+
+    def _push_payload(self, project_id, branch, before, after, commits):
+        return {"event_name": "push", "project_id": project_id, "ref": f"refs/heads/{branch}", "before": before,
+                "after": after, "commits": commits, "total_commits_count": len(commits),
+                "project": {"id": project_id, "path_with_namespace": self.projects[project_id]["path_with_namespace"]}}
+
+    def apply(self, payload):
+        # A replayed event changes the fake the way the real change would have
+        event = payload.get("event_name") or payload.get("object_kind")
+        project_id = payload.get("project_id")
+        with self._lock:
+            if event == "push" and project_id in self.branches:
+                branch = payload["ref"][len("refs/heads/"):]
+                head = next((commit for commit in payload.get("commits", []) if commit.get("id") == payload["after"]), None)
+                if payload["after"] == NO_COMMIT:
+                    self.branches[project_id].pop(branch, None)
+                elif head:
+                    self.branches[project_id][branch] = head["timestamp"]
+            elif event == "project_create":
+                self._add_project(project_id, payload["path"], self.groups[1])
+                self.branches[project_id] = {}
+            elif event == "project_destroy":
+                self.projects.pop(project_id, None)
+                self.branches.pop(project_id, None)
+
+    def replay(self, path, delay=0.0):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    payload = json.loads(line)
+                    self.apply(payload)
+                    self.post_hook(payload)
+                    time.sleep(delay)
+
+    def post_hook(self, payload):
+        if not self.hook_url:
+            return
+        with self._lock:
+            self.requests["hooks"] += 1
+        headers = {"X-Gitlab-Event": "System Hook"}
+        if self.hook_token:
+            headers["X-Gitlab-Token"] = self.hook_token
+        try:
+            requests.post(self.hook_url, json=payload, headers=headers, timeout=5)
+        except requests.RequestException as e:
+            print(f"Fake GitLab could not deliver {payload.get('event_name')} hook: {e}")
+
+
+class _FakeGitLabHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body, headers=()):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _page(self, items, query):
+        per_page = int(query.get("per_page", ["20"])[0])
+        page = int(query.get("page", ["1"])[0])
+        total_pages = max(1, -(-len(items) // per_page))
+        headers = [("X-Total-Pages", str(total_pages)), ("X-Total", str(len(items)))]
+        if page < total_pages:
+            headers.append(("X-Next-Page", str(page + 1)))
+        self._send(200, items[(page - 1) * per_page:page * per_page], headers)
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")[2:]  # Drop api/v4
+        with fake._lock:
+            fake.requests["/".join("N" if part.isdigit() else part for part in parts)] += 1
+            if parts == ["groups"]:
+                groups = [group for group in fake.groups.values()
+                          if query.get("top_level_only") != ["true"] or group["parent_id"] is None]
+                return self._page(groups, query)
+            if len(parts) == 3 and parts[0] == "groups" and parts[2] == "projects":
+                group = fake.groups.get(int(parts[1]))
+                if group is None:
+                    return self._send(404, {})
+                projects = [project for project in fake.projects.values()
+                            if project["namespace"]["full_path"] == group["full_path"]
+                            or (query.get("include_subgroups") == ["true"]
+                                and project["namespace"]["full_path"].startswith(group["full_path"] + "/"))]
+                return self._page(sorted(projects, key=lambda project: project["id"]), query)
+            if len(parts) == 4 and parts[0] == "projects" and parts[2:] == ["repository", "branches"]:
+                branches = fake.branches.get(int(parts[1]))
+                if branches is None:
+                    return self._send(404, {})
+                # Like GitLab: case-insensitive, ^ anchors the term at the start
+                search = query.get("search", [""])[0].lower()
+                if search.startswith("^"):
+                    names = sorted(name for name in branches if name.lower().startswith(search[1:]))
+                else:
+                    names = sorted(name for name in branches if search in name.lower())
+                return self._page([{"name": name, "commit": {"committed_date": branches[name]}} for name in names], query)
+        self._send(404, {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake GitLab for latestbranch.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--projects", type=int, default=50, help="Projects to generate")
+    parser.add_argument("--branches", type=int, default=30, help="Most release (and feature) branches per project")
+    parser.add_argument("--hook-url", help="Post system hook events here (e.g. http://127.0.0.1:<--serve port>/hook)")
+    parser.add_argument("--hook-token", help="Sent as X-Gitlab-Token with every hook")
+    parser.add_argument("--replay", help="JSON-lines file of system hook payloads to apply and post once started")
+    parser.add_argument("--replay-delay", type=float, default=0.0, help="Seconds between replayed events")
+    args = parser.parse_args()
+
+    fake = FakeGitLab(args.host, args.port, args.projects, args.branches, args.hook_url, args.hook_token).start()
+    print(f"Fake GitLab running at {fake.url}")
+    if args.replay:
+        fake.replay(args.replay, args.replay_delay)
+        print(f"Replayed {args.replay}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+        print(f"Requests served: {fake.stats()}")
+
+
+if __name__ == "__main__":
+    main()
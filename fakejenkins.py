@@ -0,0 +1,293 @@
+import argparse
+import heapq
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+import requests
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+'''
+    Local fake Jenkins for exercising the deployment scripts without a real master.
+
+    Implements the endpoints the scripts use:
+        POST {job}/buildWithParameters   -> 201 with Location: .../queue/item/<id>/
+        GET  queue/api/json              -> items still waiting
+        GET  queue/item/<id>/api/json    -> executable / cancelled once the item left the queue
+        GET  {job}/api/json              -> builds[number,result,duration,estimatedDuration,timestamp]
+        GET  {job}/<number>/api/json     -> one build
+        GET  computer/api/json           -> busyExecutors / totalExecutors
+    Jobs live at whatever path the script posts to, so both "{url}/{job}" and "{url}/job/{job}"
+    layouts work. With --notify-url it also posts Notification-plugin callbacks (QUEUED,
+    STARTED, COMPLETED) so the push listener can be tried end to end.
+
+    For gitlab-jenkins.py it also answers the two GitLab calls under {url}/gitlab/api/v4:
+    the paginated pipeline job list (one job per Jenkins job triggered so far) and job play.
+
+    --executors caps how many builds run at once; the rest wait in the queue (0 = unlimited).
+    Several fakes on different ports stand in for a pool of masters.
+
+    --latency delays every answer and --error-rate answers that fraction of requests with a
+    503, to see how the scripts behave against a slow or flaky master. Every request is
+    counted by kind; stats() returns the counts (benchmark.py reads them).
+
+    Usage: python fakejenkins.py --port 8080 --queue-delay 2 --build-duration 20 --notify-url http://127.0.0.1:8765/
+'''
+
+
+class FakeJenkins:
+    def __init__(self, host="127.0.0.1", port=8080, queue_delay=1.0, build_duration=5.0, notify_url=None,
+                 latency=0.0, error_rate=0.0, executors=0):
+        self.host = host
+        self.port = port
+        self.queue_delay = queue_delay  # Seconds a triggered build waits in the queue
+        self.build_duration = build_duration  # Seconds a build runs
+        self.notify_url = notify_url
+        self.latency = latency  # Seconds added to every answer
+        self.error_rate = error_rate  # Fraction of requests answered with a 503
+        self.executors = executors  # Builds that may run at once; 0 for no limit
+        self.running = 0
+        self._waiting = deque()  # queue ids past their queue delay, waiting for a free executor
+        self.requests = Counter()  # Request kind -> count, plus "errors" for injected 503s
+        self.queue = {}  # queue_id -> queue item dict
+        self.builds = {}  # job path -> {number: build dict}
+        self._next_queue_id = 1
+        self._next_number = {}
+        self._events = []  # heap of (due, sequence, action, queue_id)
+        self._sequence = 0
+        self._lock = threading.Condition()
+        self._server = None
+        self._stopping = False
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _FakeJenkinsHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="fake-jenkins", daemon=True).start()
+        threading.Thread(target=self._run_events, name="fake-jenkins-events", daemon=True).start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            self._lock.notify()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def count(self, kind):
+        """Counts one request and returns True when it should fail with an injected error."""
+        failed = random.random() < self.error_rate
+        with self._lock:
+            self.requests[kind] += 1
+            if failed:
+                self.requests["errors"] += 1
+        return failed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.requests)
+            stats["builds"] = sum(len(builds) for builds in self.builds.values())
+        return stats
+
+    def _schedule(self, delay, action, queue_id):
+        self._sequence += 1
+        heapq.heappush(self._events, (time.time() + delay, self._sequence, action, queue_id))
+        self._lock.notify()
+
+    def _run_events(self):
+        # One thread moves every build through queue -> running -> finished
+        while True:
+            with self._lock:
+                while not self._stopping and (not self._events or self._events[0][0] > time.time()):
+                    self._lock.wait(self._events[0][0] - time.time() if self._events else None)
+                if self._stopping:
+                    return
+                _, _, action, queue_id = heapq.heappop(self._events)
+                notifications = getattr(self, f"_{action}")(queue_id)
+            for notification in notifications:
+                self._notify(*notification)
+
+    def _build_result(self, job, number):
+        return "SUCCESS"
+
+    def _start(self, queue_id):
+        if self.executors and self.running >= self.executors:
+            self._waiting.append(queue_id)
+            return []
+        self.running += 1
+        item = self.queue[queue_id]
+        job = item["job"]
+        number = self._next_number.get(job, 0) + 1
+        self._next_number[job] = number
+        now = time.time()
+        item["executable"] = {"number": number, "url": f"{self.url}{job}/{number}/"}
+        item["left"] = True
+        self.builds.setdefault(job, {})[number] = {
+            "number": number, "result": None, "building": True, "duration": 0,
+            "estimatedDuration": int(self.build_duration * 1000), "timestamp": int(now * 1000),
+            "queueId": queue_id,
+        }
+        self._schedule(self.build_duration, "finish", queue_id)
+        return [(job, queue_id, number, "STARTED", None)]
+
+    def _finish(self, queue_id):
+        job = self.queue[queue_id]["job"]
+        number = self.queue[queue_id]["executable"]["number"]
+        build = self.builds[job][number]
+        build["result"] = self._build_result(job, number)
+        build["building"] = False
+        build["duration"] = int(time.time() * 1000) - build["timestamp"]
+        self.running -= 1
+        notifications = [(job, queue_id, number, "COMPLETED", build["result"])]
+        if self._waiting:
+            notifications += self._start(self._waiting.popleft())
+        return notifications
+
+    def _notify(self, job, queue_id, number, phase, status):
+        if not self.notify_url:
+            return
+        payload = {"name": job.strip("/").split("/")[-1], "url": job.strip("/") + "/",
+                   "build": {"phase": phase, "queue_id": queue_id, "number": number, "status": status,
+                             "full_url": f"{self.url}{job}/{number}/", "url": f"{job.strip('/')}/{number}/"}}
+        with self._lock:
+            self.requests["notifications"] += 1
+        try:
+            requests.post(self.notify_url, json=payload, timeout=5)
+        except requests.RequestException as e:
+            print(f"Fake Jenkins could not deliver {phase} notification: {e}")
+
+    def trigger(self, job):
+        with self._lock:
+            queue_id = self._next_queue_id
+            self._next_queue_id += 1
+            self.queue[queue_id] = {"id": queue_id, "job": job, "blocked": False, "stuck": False,
+                                    "inQueueSince": int(time.time() * 1000), "left": False}
+            self._schedule(self.queue_delay, "start", queue_id)
+        if self.notify_url:
+            threading.Thread(target=self._notify, args=(job, queue_id, None, "QUEUED", None), daemon=True).start()
+        return queue_id
+
+
+class _FakeJenkinsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body=None, headers=()):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _fail(self, kind):
+        fake = self.server.fake
+        failed = fake.count(kind)
+        if fake.latency:
+            time.sleep(fake.latency)
+        if failed:
+            self._send(503, {})
+        return failed
+
+    def do_POST(self):
+        fake = self.server.fake
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        path = urlparse(self.path).path
+        if path.startswith("/gitlab/"):
+            if not self._fail("gitlab"):
+                self._send(200 if path.endswith("/play") else 404, {})
+            return
+        match = re.match(r"^(.*)/buildWithParameters$", path)
+        if self._fail("trigger" if match else "other"):
+            return
+        if not match:
+            return self._send(404, {})
+        queue_id = fake.trigger(match.group(1))
+        self._send(201, None, [("Location", f"{fake.url}/queue/item/{queue_id}/")])
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        if url.path.startswith("/gitlab/"):
+            if not self._fail("gitlab"):
+                self._gitlab_jobs(fake, url)
+            return
+        with fake._lock:
+            kind, code, body, headers = self._lookup(fake, url.path)
+        if not self._fail(kind):
+            self._send(code, body, headers)
+
+    def _gitlab_jobs(self, fake, url):
+        if not url.path.endswith("/jobs"):
+            return self._send(404, {})
+        query = parse_qs(url.query)
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["20"])[0])
+        with fake._lock:
+            names = [job.strip("/").split("/")[-1] for job in fake.builds]
+        jobs = [{"id": index, "name": name} for index, name in enumerate(names, start=1)]
+        headers = [("X-Next-Page", str(page + 1))] if page * per_page < len(jobs) else []
+        self._send(200, jobs[(page - 1) * per_page:page * per_page], headers)
+
+    def _lookup(self, fake, path):
+        # Runs under the fake's lock; returns a snapshot so the socket write happens outside it
+        if path.endswith("/computer/api/json"):
+            return "computer", 200, {"busyExecutors": fake.running, "totalExecutors": fake.executors}, ()
+        if path.endswith("/queue/api/json"):
+            return "queue", 200, {"items": [_public(item) for item in fake.queue.values() if not item["left"]]}, ()
+        match = re.match(r"^.*/queue/item/(\d+)/api/json$", path)
+        if match:
+            item = fake.queue.get(int(match.group(1)))
+            return ("queue_item", 200, _public(item), ()) if item else ("queue_item", 404, {}, ())
+        match = re.match(r"^(.*)/(\d+)/api/json$", path)
+        if match:
+            build = fake.builds.get(match.group(1), {}).get(int(match.group(2)))
+            return ("build", 200, dict(build), ()) if build else ("build", 404, {}, ())
+        match = re.match(r"^(.*)/api/json$", path)
+        if match:
+            builds = sorted(fake.builds.get(match.group(1), {}).values(), key=lambda b: -b["number"])
+            body = {"name": match.group(1).strip("/").split("/")[-1], "builds": [dict(b) for b in builds[:100]]}
+            return "job", 200, body, ()
+        return "other", 404, {}, ()
+
+
+def _public(item):
+    return {name: value for name, value in item.items() if name != "left"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake Jenkins for the deployment scripts")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--queue-delay", type=float, default=1.0, help="Seconds each build waits in the queue")
+    parser.add_argument("--build-duration", type=float, default=5.0, help="Seconds each build runs")
+    parser.add_argument("--notify-url", help="Post Notification-plugin callbacks here (e.g. the --listen port)")
+    parser.add_argument("--executors", type=int, default=0, help="Builds that may run at once (0 = unlimited)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 503")
+    args = parser.parse_args()
+
+    fake = FakeJenkins(args.host, args.port, args.queue_delay, args.build_duration, args.notify_url,
+                       args.latency, args.error_rate, args.executors).start()
+    print(f"Fake Jenkins running at {fake.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+        print(f"Requests served: {fake.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import uuid
+
+'''
+    Stand-in for `xcrun simctl` so device.py and its allocator run on Linux.
+
+    The device set lives in the JSON file named by FAKE_SIMCTL_DEVICES, in the shape
+    `simctl list --json devices` prints; it is generated on first use (FAKE_SIMCTL_COUNT
+    iPhones and iPads on two iOS runtimes, plus a watchOS one). Supported commands:
+        list --json devices [available]
+        boot <udid> / shutdown <udid>     change a device's state
+        create <name> <device type> <runtime>
+    Every change also touches the file's directory, which stands in for the CoreSimulator
+    device set, so point SIMCTL_DEVICE_SET at it to see the allocator refresh on change.
+
+    Usage: SIMCTL="python3 fakesimctl.py" FAKE_SIMCTL_DEVICES=/tmp/sim/devices.json \\
+           SIMCTL_DEVICE_SET=/tmp/sim python3 device.py --serve-allocator /tmp/sim/allocator.sock
+'''
+
+RUNTIME_PREFIX = "com.apple.CoreSimulator.SimRuntime."
+DEVICE_TYPE_PREFIX = "com.apple.CoreSimulator.SimDeviceType."
+
+
+def generate(count):
+    devices = {}
+    models = ["iPhone 15", "iPhone 15 Pro", "iPhone SE (3rd generation)", "iPad Air (5th generation)"]
+    for runtime in ("iOS-17-2", "iOS-17-5"):
+        devices[RUNTIME_PREFIX + runtime] = [
+            {"udid": str(uuid.uuid4()).upper(), "name": models[index % len(models)], "state": "Shutdown",
+             "isAvailable": True, "deviceTypeIdentifier": DEVICE_TYPE_PREFIX + models[index % len(models)].split(" (")[0].replace(" ", "-")}
+            for index in range(count)]
+    devices[RUNTIME_PREFIX + "watchOS-10-2"] = [
+        {"udid": str(uuid.uuid4()).upper(), "name": "Apple Watch Series 9 (45mm)", "state": "Shutdown",
+         "isAvailable": True, "deviceTypeIdentifier": DEVICE_TYPE_PREFIX + "Apple-Watch-Series-9-45mm"}]
+    return {"devices": devices}
+
+
+def load(path):
+    if not os.path.exists(path):
+        save(path, generate(int(os.environ.get("FAKE_SIMCTL_COUNT", "8"))))
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(path, data):
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + ".tmp", path)
+    os.utime(os.path.dirname(os.path.abspath(path)))
+
+
+def set_state(data, udid, state):
+    for devices in data["devices"].values():
+        for item in devices:
+            if item["udid"] == udid:
+                item["state"] = state
+                return True
+    return False
+
+
+def main(argv):
+    path = os.environ.get("FAKE_SIMCTL_DEVICES", "fakesimctl_devices.json")
+    data = load(path)
+    command = argv[0] if argv else ""
+    if command == "list":
+        if "available" in argv:
+            data = {"devices": {runtime: [item for item in devices if item.get("isAvailable", True)]
+                                for runtime, devices in data["devices"].items()}}
+        print(json.dumps(data, indent=2))
+        return 0
+    if command in ("boot", "shutdown") and len(argv) == 2:
+        if not set_state(data, argv[1], "Booted" if command == "boot" else "Shutdown"):
+            print(f"Invalid device: {argv[1]}", file=sys.stderr)
+            return 1
+        save(path, data)
+        return 0
+    if command == "create" and len(argv) == 4:
+        udid = str(uuid.uuid4()).upper()
+        runtime = argv[3] if argv[3].startswith(RUNTIME_PREFIX) else RUNTIME_PREFIX + argv[3]
+        data["devices"].setdefault(runtime, []).append(
+            {"udid": udid, "name": argv[1], "state": "Shutdown", "isAvailable": True, "deviceTypeIdentifier": argv[2]})
+        save(path, data)
+        print(udid)
+        return 0
+    print(f"fakesimctl: unsupported command {' '.join(argv)!r}", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,9 +1,16 @@
-import requests
 import csv
+import os
+import requests
 import urllib3
 import re
 import sys
+import time
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import quote
+from gitlabpager import GitLabPager
+from httpclient import HttpClient
+from projectstate import ProjectStateStore, CHECK_FAILED
 # import yaml
 
 
@@ -11,11 +18,23 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 '''
     This script accepts the root id of the project
-    fetches all subrgroups and subprojects
+    fetches all subrgroups and subprojects (one include_subgroups listing, pages fetched in parallel)
     updates project ids of all projects into csv file
     uses project id to check if main branch exists or not for a particular project
         if main exists, script checks for sonar-project.properties file
             if sonar-project.properties exists, the sonar project key is updated into the CSV
+    With USE_GRAPHQL the main-branch check and the root sonar-project.properties read are done
+    for a whole batch of projects per GraphQL query. Projects with a main branch but no root file
+    then look for nested sonar files over REST. A project with a root file is only searched for
+    nested ones when blob search is on, when an earlier run found it to be a monorepo, or with
+    GRAPHQL_NESTED_FOLLOW_UP; otherwise a repo that adds nested files beside its root file keeps
+    reporting the root key alone until one of those applies.
+    Reruns are incremental (see projectstate.py): only projects active since the last run are
+    listed and checked, unchanged pages come back as 304s, and every other project keeps the
+    result stored in STATE_DB. A full crawl still runs every FULL_CRAWL_INTERVAL.
+    Several roots are crawled in parallel, and a root that sits below another listed root is
+    cut out of that root's crawl instead of being listed again. Every project is checked once
+    and its row goes to the CSV of each root it belongs to.
 '''
 
 TOKEN = "" # 
@@ -23,73 +42,153 @@ GITLAB_URL = ""
 # IDC_UI_DIGITAL_GROUP_ID =  3691
 ROOT_GROUP_ID = sys.argv[1] #3691 #| GROUPID , change it accroding to root group need
 HEADERS = {'Private-Token': TOKEN}
+PAGE_WORKERS = 8  # Pages of one listing downloaded at the same time
+CHECK_WORKERS = 16  # Projects checked for main branch / sonar key at the same time
+ROOT_WORKERS = 4  # Root groups crawled at the same time
+CSV_HEADER = ["Parent Group ID", "Project ID", "Project Name", "Project URL", "Path Names", "Is Main Branch Exists", "Sonar Project Key"]
 OUTPUT_CSV = f"gitlab_repo_{ROOT_GROUP_ID}_main_branch_check.csv"
-# SONAR_FILE = "sonar-project.properties"
+SONAR_FILE = "sonar-project.properties"
+MAX_TREE_PAGES = 50  # Recursive tree pages (100 entries each) walked per project when blob search is unavailable
+FILE_WORKERS = 4  # sonar-project.properties files of one monorepo read at the same time
+# Blob search with only a filename: filter needs advanced (Elasticsearch/Zoekt) search; basic
+# search answers [] for it, so leave this off unless the instance has advanced search enabled
+USE_BLOB_SEARCH = False
+blob_search_available = USE_BLOB_SEARCH  # Switched off once GitLab refuses or misses in project blob search
+SONAR_KEY_PATTERN = r"sonar\.projectKey\s*=\s*(\S+)"
 
-def get_paginated_data(url, headers, params=None):
-    results = []
-    page = 1
-    params = params or {}
-    params["per_page"] = 100
+USE_GRAPHQL = True  # Batch the per-project checks into GraphQL queries
+GRAPHQL_URL = f"{GITLAB_URL.rsplit('/api/v4', 1)[0]}/api/graphql"
+GRAPHQL_FIRST_BATCH = 10  # Projects in the first query, which measures what one project costs
+GRAPHQL_COMPLEXITY_SHARE = 0.8  # Share of GitLab's query complexity limit a batch may use
+GRAPHQL_MAX_QUERY_SIZE = 10000  # GitLab rejects longer query strings
+GRAPHQL_PROJECT_FIELDS = ('p{index}: project(fullPath: $p{index}) {{ repository {{ '
+                          'branchNames(searchPattern: "main", offset: 0, limit: 1) '
+                          'blobs(ref: "main", paths: ["' + SONAR_FILE + '"]) {{ nodes {{ rawTextBlob }} }} }} }}')
+GRAPHQL_NESTED_FOLLOW_UP = False  # Walk the tree of every project with a root sonar file too (REST-identical CSV, but about half the savings)
+graphql_available = True  # Switched off when the instance has no GraphQL endpoint
+graphql_batch_size = GRAPHQL_FIRST_BATCH  # Resized from the complexity score of every answer
 
-    while True:
-        params["page"] = page
-        response = requests.get(url, headers=headers, params=params, verify=False)
+STATE_DB = "gitgroupm_state.sqlite"  # Delete it to force a full run
+FULL_CRAWL_INTERVAL = 7 * 24 * 3600  # Seconds between full crawls, which drop deleted and moved projects
+ACTIVITY_OVERLAP = 3600  # GitLab updates last_activity_at at most hourly, so look back that far
+state_store = ProjectStateStore(STATE_DB)
 
-        if response.status_code == 200:
-            data = response.json()
-            if not data:
-                break
-            results.extend(data)
-            page += 1
-        else:
-            print(f"Failed to fetch data from {url}: {response.status_code}")
-            break
-    return results
+# One connection per request in flight: roots crawled at once each page their listings, then
+# every project check may page a repository tree or read several sonar files at once
+gitlab_client = HttpClient(pool_size=max(ROOT_WORKERS * PAGE_WORKERS, CHECK_WORKERS * max(PAGE_WORKERS, FILE_WORKERS)),
+                           headers=HEADERS, verify=False)
+# Unchanged pages come back as 304s and are answered from the state store
+gitlab_pages = GitLabPager(gitlab_client, PAGE_WORKERS, cache=state_store)
 
-def get_group_name(group_id):
-    # Fetching the name of the group
+def get_group(group_id):
     group_url = f"{GITLAB_URL}/groups/{group_id}"
-    response = requests.get(group_url, headers=HEADERS, verify=False)
+    response = gitlab_client.get(group_url)
 
     if response.status_code == 200:
-        return response.json().get("name", "")
-    return ""
+        return response.json()
+    print(f"Failed to fetch group {group_id}: {response.status_code}")
+    return None
 
-def get_subgroups_and_projects(group_id, path="", path_names=""):
-    # Fetching all subgroups and projects under the specified group ID
+def get_subgroups_and_projects(group_id, changed_after=None, known_projects=(), root=None):
+    # One listing of every project below the group (include_subgroups) and one of every
+    # descendant group for the names, instead of a walk with three calls per group.
+    # With changed_after only projects active since then are listed; known_projects fill in the rest.
+    # Both listings are strict: a page that can't be read raises instead of leaving projects out.
     print(f"Fetching all subgroups and projects under {group_id}")
 
-    subgroups = []
-    projects = []
-    current_path = f"{path}/{group_id}" if path else str(group_id)
-    current_group_name = get_group_name(group_id)
-    current_path_name = f"{path_names}/{current_group_name}" if path_names else current_group_name
-
-    # Getting subgroups
-    subgroup_url = f"{GITLAB_URL}/groups/{group_id}/subgroups"
-    subgroups = get_paginated_data(subgroup_url, HEADERS)
-    
-    # Getting Projects
-    project_url = f"{GITLAB_URL}/groups/{group_id}/projects"
-    project_data = get_paginated_data(project_url, HEADERS)
+    root = root or get_group(group_id)
+    if root is None:
+        raise requests.HTTPError(f"Group {group_id} could not be read")
+    subgroups = gitlab_pages.get_paginated_data(f"{GITLAB_URL}/groups/{group_id}/descendant_groups", {"order_by": "id"},
+                                                strict=True)
+    params = {"include_subgroups": "true", "simple": "true", "order_by": "id", "sort": "asc"}
+    if changed_after:
+        params["last_activity_after"] = changed_after
+    project_data = gitlab_pages.get_paginated_data(f"{GITLAB_URL}/groups/{group_id}/projects", params, strict=True)
+    if changed_after:
+        print(f"{len(project_data)} projects under {group_id} active since {changed_after}")
+    project_data = project_data + list(known_projects)
 
+    projects = []
+    seen = set()
     for project in project_data:
-        project["path_names"] = f"{current_path_name}/{project['name']}"
-        project["url"] = project["web_url"]
+        if project["id"] in seen:
+            continue  # A project can move between pages while they are fetched
+        seen.add(project["id"])
         projects.append(project)
 
-    # Recursively fetching subgroups
-    for subgroup in subgroups:
-        sg_projects, sg_subgroups = get_subgroups_and_projects(subgroup["id"], current_path)
-        projects.extend(sg_projects)
-        subgroups.extend(sg_subgroups)
-    
+    return with_path_names(root, subgroups, projects), subgroups
+
+def with_path_names(root, subgroups, projects):
+    # Copies, since a project below two listed roots gets a different path under each
+    group_names = {root["full_path"]: root["name"]}  # full_path -> group name, from the root group down
+    group_names.update((group["full_path"], group["name"]) for group in subgroups)
+    root_depth = root["full_path"].count("/")
+    named = []
+    for project in projects:
+        parts = project["namespace"]["full_path"].split("/")
+        names = [group_names.get("/".join(parts[:depth + 1]), parts[depth]) for depth in range(root_depth, len(parts))]
+        named.append(dict(project, path_names="/".join(names + [project["name"]]), url=project["web_url"]))
+    return named
+
+def is_below(full_path, ancestor_path):
+    return full_path.startswith(ancestor_path + "/")
+
+def load_roots(group_ids):
+    """root group id -> its projects, for every root that could be read.
+
+    Roots are crawled ROOT_WORKERS at a time. A root below another listed root is not crawled:
+    its projects and subgroups are taken from the outer root's crawl.
+    """
+    with ThreadPoolExecutor(ROOT_WORKERS) as executor:
+        groups = dict(zip(group_ids, executor.map(get_group, group_ids)))
+    groups = {group_id: group for group_id, group in groups.items() if group is not None}
+    outer = {}  # nested root id -> id of the outermost listed root containing it
+    for group_id, group in groups.items():
+        containing = [other_id for other_id, other in groups.items() if is_below(group["full_path"], other["full_path"])]
+        if containing:
+            outer[group_id] = min(containing, key=lambda other_id: groups[other_id]["full_path"].count("/"))
+            print(f"Root {group_id} is inside root {outer[group_id]}; reusing its crawl")
+
+    crawled = [group_id for group_id in groups if group_id not in outer]
+    with ThreadPoolExecutor(ROOT_WORKERS) as executor:
+        crawls = dict(zip(crawled, executor.map(lambda group_id: load_projects(group_id, groups[group_id]), crawled)))
+
+    roots = {}
+    for group_id, group in groups.items():
+        if group_id in crawls:
+            roots[group_id] = crawls[group_id][0]
+            continue
+        projects, subgroups = crawls[outer[group_id]]
+        subgroups = [subgroup for subgroup in subgroups if is_below(subgroup["full_path"], group["full_path"])]
+        projects = [project for project in projects if project["namespace"]["full_path"] == group["full_path"]
+                    or is_below(project["namespace"]["full_path"], group["full_path"])]
+        roots[group_id] = with_path_names(group, subgroups, projects)
+    return roots
+
+def load_projects(group_id, root=None):
+    # Full crawl for a new root or once FULL_CRAWL_INTERVAL has passed; otherwise only what changed.
+    # A crawl that fails part way is not saved: the stored membership and watermark stay as they
+    # were, this run uses the stored projects, and the next run lists the same span again.
+    crawled_at, full_crawl_at = state_store.last_crawl(group_id)
+    started = datetime.now(timezone.utc)
+    full = crawled_at is None or time.time() - full_crawl_at > FULL_CRAWL_INTERVAL
+    try:
+        if full:
+            projects, subgroups = get_subgroups_and_projects(group_id, root=root)
+        else:
+            changed_after = (datetime.fromisoformat(crawled_at) - timedelta(seconds=ACTIVITY_OVERLAP)).isoformat()
+            projects, subgroups = get_subgroups_and_projects(group_id, changed_after, state_store.root_projects(group_id), root)
+    except requests.RequestException as e:
+        projects = state_store.root_projects(group_id)
+        print(f"Crawl of root {group_id} failed ({e}); using the {len(projects)} projects stored from the last crawl")
+        return projects, []
+    state_store.save_crawl(group_id, projects, started.isoformat(), full)
     return projects, subgroups
 
 def check_main_branch(project_id):
     branch_url = f"{GITLAB_URL}/projects/{project_id}/repository/branches/main"
-    branch_response = requests.get(branch_url, headers=HEADERS, verify=False)
+    branch_response = gitlab_client.get(branch_url)
     if branch_response.status_code == 200:
         return True  # main branch exists
     elif branch_response.status_code == 404:
@@ -97,73 +196,254 @@ def check_main_branch(project_id):
     else:
         print(f"Error fetching 'main' branch for {project_id}: {branch_response.status_code}")
 
-def fetch_sonar_project_key(project_id, branch="main"):
-    if is_monorepo(project_id, branch):
-        print(f"Project {project_id} is a monorepo, searching for sonar-project.properties...")
-        sonar_keys = search_sonar_project_properties(project_id, branch)
-        return sonar_keys if sonar_keys else None
+def fetch_sonar_project_key(project_id, branch="main", root_key=None):
+    # root_key: the root file's key when a GraphQL batch already read it
+    paths = find_sonar_project_properties(project_id, branch)
+    if root_key:
+        paths = sorted(set(paths) | {SONAR_FILE})
+    def read(path):
+        return root_key if root_key and path == SONAR_FILE else read_sonar_project_key(project_id, path, branch)
+    if len(paths) > 1:
+        print(f"Project {project_id} is a monorepo, reading {len(paths)} {SONAR_FILE} files...")
+        with ThreadPoolExecutor(FILE_WORKERS) as executor:
+            keys = [key for key in executor.map(read, paths) if key]
     else:
-        file_path = "sonar-project.properties"
-        file_url = f"{GITLAB_URL}/projects/{project_id}/repository/files/{file_path}/raw?ref={branch}"
-        response = requests.get(file_url, headers=HEADERS, verify=False)
+        keys = [key for key in map(read, paths) if key]
+    if not keys:
+        print(f"No sonar.projectKey found for project {project_id}")
+        return None
+    # A single file at the root is the plain case; anything else is reported as a monorepo key list
+    return keys[0] if paths == [SONAR_FILE] else keys
 
-        if response.status_code == 200:
-            match = re.search(r"sonar\.projectKey\s*=\s*(\S+)", response.text)
-            if match:
-                return match.group(1)
-    print(f"No sonar.projectKey found for project {project_id}")
+def read_sonar_project_key(project_id, file_path, branch):
+    encoded_file_path = quote(file_path, safe="")
+    file_url = f"{GITLAB_URL}/projects/{project_id}/repository/files/{encoded_file_path}/raw"
+    response = gitlab_client.get(file_url, params={"ref": branch})
+    if response.status_code == 200:
+        match = re.search(SONAR_KEY_PATTERN, response.text)
+        if match:
+            return match.group(1)
+    elif response.status_code != 404:
+        raise requests.HTTPError(f"Failed to read {file_path} of project {project_id}: {response.status_code}")
     return None
 
+def find_sonar_project_properties(project_id, branch="main"):
+    # One blob search finds every sonar-project.properties in the repo, however deep
+    global blob_search_available
+    if blob_search_available:
+        search_url = f"{GITLAB_URL}/projects/{project_id}/search"
+        params = {"scope": "blobs", "search": f"filename:{SONAR_FILE}", "ref": branch, "per_page": 100}
+        response = gitlab_client.get(search_url, params=params)
+        if response.status_code == 200:
+            results = response.json()
+            next_page = response.headers.get("X-Next-Page")
+            while next_page:
+                data, page_headers = gitlab_pages.get_page(search_url, params, int(next_page))
+                if data is None:
+                    raise requests.HTTPError(f"Page {next_page} of the {SONAR_FILE} search in project {project_id} failed")
+                if not data:
+                    break
+                results.extend(data)
+                next_page = page_headers.get("X-Next-Page")
+            # filename: also matches by pattern, so keep exact names only
+            paths = sorted({item["path"] for item in results if item["path"].split("/")[-1] == SONAR_FILE})
+            if paths:
+                return paths
+            # Nothing found may only mean the search isn't indexing this; the tree walk decides
+            paths = search_sonar_project_properties(project_id, branch)
+            if paths and blob_search_available:
+                print(f"Blob search missed {SONAR_FILE} in project {project_id}; walking repository trees instead")
+                blob_search_available = False
+            return paths
+        if response.status_code in (400, 403, 404):
+            print(f"Blob search unavailable ({response.status_code}); walking repository trees instead")
+            blob_search_available = False
+        else:
+            print(f"Blob search failed for project {project_id}: {response.status_code}; walking its tree instead")
+    return search_sonar_project_properties(project_id, branch)
+
 def search_sonar_project_properties(project_id, branch="main"):
-    file_keys = []
+    # Fallback: recursive tree listing, pages fetched in parallel and capped at MAX_TREE_PAGES
     tree_url = f"{GITLAB_URL}/projects/{project_id}/repository/tree"
-    params = {"ref": branch, "recursive": True, "per_page": 100}
-    page = 1
+    tree = gitlab_pages.get_paginated_data(tree_url, {"ref": branch, "recursive": "true"},
+                                           max_pages=MAX_TREE_PAGES, strict=True)
+    return sorted(item["path"] for item in tree if item["type"] == "blob" and item["name"] == SONAR_FILE)
 
-    while True:
-        params["page"] = page
-        response = requests.get(tree_url, headers=HEADERS, params=params, verify=False)
-        if response.status_code == 200:
-            tree = response.json()
-            if not tree:
-                break
-            for item in tree:
-                if item["type"] == "blob" and item["name"] == "sonar-project.properties":
-                    file_path = item["path"]
-                    encoded_file_path = quote(file_path, safe="")
-                    file_url = f"{GITLAB_URL}/projects/{project_id}/repository/files/{encoded_file_path}/raw?ref={branch}"
-                    file_response = requests.get(file_url, headers=HEADERS, verify=False)
-                    if file_response.status_code == 200:
-                        match = re.search(r"sonar\.projectKey\s*=\s*(\S+)", file_response.text)
-                        if match:
-                            file_keys.append(match.group(1))
-        page += 1
-    return file_keys
+def project_row(group_id, project, has_main_branch, sonar_project_key):
+    return [group_id, project["id"], project["name"], project.get("url"), project.get("path_names"), has_main_branch, sonar_project_key]
+
+def check_project(project, has_main_branch=None, root_key=None):
+    # REST checks for one project; has_main_branch and root_key are passed in when a GraphQL batch already knows them
+    project_id = project["id"]
+    sonar_project_key = None
+    try:
+        if has_main_branch is None:
+            has_main_branch = check_main_branch(project_id)
+        sonar_project_key = fetch_sonar_project_key(project_id, root_key=root_key) if has_main_branch else None
+    except Exception as e:
+        print(f"Exception during checking project {project_id}: {e}")
+        if has_main_branch:
+            sonar_project_key = CHECK_FAILED  # Not "no key": the next run checks it again
+    return project, has_main_branch, sonar_project_key
+
+def graphql_query(batch):
+    variables = {f"p{index}": project["path_with_namespace"] for index, project in enumerate(batch)}
+    declarations = ", ".join(f"${name}: ID!" for name in variables)
+    fields = " ".join(GRAPHQL_PROJECT_FIELDS.format(index=index) for index in range(len(batch)))
+    return f"query({declarations}) {{ queryComplexity {{ score limit }} {fields} }}", variables
+
+def resize_graphql_batches(complexity, batch_length):
+    global graphql_batch_size
+    if not complexity.get("score") or not complexity.get("limit"):
+        return
+    per_project = complexity["score"] / batch_length
+    by_size = GRAPHQL_MAX_QUERY_SIZE // (len(GRAPHQL_PROJECT_FIELDS) + 30)
+    graphql_batch_size = max(1, min(int(complexity["limit"] * GRAPHQL_COMPLEXITY_SHARE / per_project), by_size))
+
+def check_project_batch(batch):
+    """One GraphQL query for a batch of projects.
+
+    Returns (results, follow_ups): the (project, has_main_branch, sonar_project_key) results it could
+    answer, and (project, has_main_branch, root sonar key) for the projects that still need REST calls:
+    the nested sonar file lookup, or everything when GraphQL told us nothing (has_main_branch None).
+    A root key settles the project unless nested_follow_up() says to look further.
+    """
+    global graphql_available, graphql_batch_size
+    if not graphql_available or any("path_with_namespace" not in project for project in batch):
+        return [], [(project, None, None) for project in batch]
+    query, variables = graphql_query(batch)
+    try:
+        response = gitlab_client.post(GRAPHQL_URL, json={"query": query, "variables": variables})
+        answer = response.json() if response.status_code == 200 else {}
+    except (requests.RequestException, ValueError) as e:
+        print(f"Exception during GraphQL batch: {e}")
+        return [], [(project, None, None) for project in batch]
+    if response.status_code == 404:
+        print("No GraphQL endpoint; checking projects over REST")
+        graphql_available = False
+
+    data = answer.get("data")
+    if not data:
+        message = str((answer.get("errors") or [{}])[0].get("message") or response.status_code)
+        if "complexity" in message.lower() and len(batch) > 1:
+            # Over the limit after all: halve the batches from here on and split this one
+            graphql_batch_size = max(1, len(batch) // 2)
+            first_results, first_follow_ups = check_project_batch(batch[:len(batch) // 2])
+            results, follow_ups = check_project_batch(batch[len(batch) // 2:])
+            return first_results + results, first_follow_ups + follow_ups
+        print(f"GraphQL batch of {len(batch)} projects failed ({message}); checking them over REST")
+        return [], [(project, None, None) for project in batch]
+    resize_graphql_batches(data.get("queryComplexity") or {}, len(batch))
+
+    results, follow_ups = [], []
+    for index, project in enumerate(batch):
+        repository = (data.get(f"p{index}") or {}).get("repository")
+        if repository is None:
+            follow_ups.append((project, None, None))
+            continue
+        has_main_branch = "main" in (repository.get("branchNames") or [])
+        blobs = (repository.get("blobs") or {}).get("nodes") or []
+        match = next((re.search(SONAR_KEY_PATTERN, blob.get("rawTextBlob") or "") for blob in blobs), None)
+        if not has_main_branch:
+            results.append((project, False, None))
+        elif match and not nested_follow_up(project):
+            results.append((project, True, match.group(1)))
+        else:
+            follow_ups.append((project, True, match.group(1) if match else None))  # Nested files too
+    return results, follow_ups
+
+def nested_follow_up(project):
+    # A blob search is one request; a tree walk is only worth it where nested files are expected
+    return GRAPHQL_NESTED_FOLLOW_UP or blob_search_available or state_store.known_monorepo(project)
+
+def sort_output(output_csv):
+    # Rows were written in completion order; rewrite them in path order so runs compare line by line
+    with open(output_csv, newline="") as file:
+        rows = list(csv.reader(file))[1:]
+    rows.sort(key=lambda row: (row[4], int(row[1])))
+    with open(output_csv + ".tmp", mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_HEADER)
+        writer.writerows(rows)
+    os.replace(output_csv + ".tmp", output_csv)
+
+def check_projects(projects):
+    """Yields (project, has_main_branch, sonar_project_key) for every project as its check finishes.
+
+    Projects unchanged since the last run come straight from the state store; the rest are
+    checked CHECK_WORKERS at a time and their results stored for the next run.
+    """
+    to_check = []
+    for project in projects:
+        stored = state_store.stored_result(project)
+        if stored is None:
+            to_check.append(project)
+        else:
+            yield (project,) + stored
+    if len(to_check) < len(projects):
+        print(f"Reusing stored results of {len(projects) - len(to_check)}/{len(projects)} unchanged projects")
+    with ThreadPoolExecutor(CHECK_WORKERS) as executor:
+        pending = {}  # future -> True for GraphQL batches, False for single REST checks
+        if USE_GRAPHQL and graphql_available and to_check:
+            # The first query measures what a project costs; the rest are sized to the complexity limit
+            pending[executor.submit(check_project_batch, to_check[:GRAPHQL_FIRST_BATCH])] = True
+            wait(pending)
+            remaining = to_check[GRAPHQL_FIRST_BATCH:]
+            for start in range(0, len(remaining), graphql_batch_size):
+                pending[executor.submit(check_project_batch, remaining[start:start + graphql_batch_size])] = True
+        else:
+            pending = {executor.submit(check_project, project): False for project in to_check}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if pending.pop(future):
+                    results, follow_ups = future.result()
+                    for project, has_main_branch, root_key in follow_ups:
+                        pending[executor.submit(check_project, project, has_main_branch, root_key)] = False
+                else:
+                    results = [future.result()]
+                for result in results:
+                    state_store.save_result(*result)
+                    yield result
+
+def write_project_checks(roots):
+    # roots: root group id -> its projects. A project below several roots is checked once and
+    # its row written to each of their CSVs as soon as the check is done.
+    memberships = {}  # project id -> [(root group id, the project as seen from that root)]
+    for group_id, projects in roots.items():
+        for project in projects:
+            memberships.setdefault(project["id"], []).append((group_id, project))
+    unique = [entries[0][1] for entries in memberships.values()]
+    print(f"Checking {len(unique)} projects for {len(roots)} roots "
+          f"({sum(len(projects) for projects in roots.values()) - len(unique)} shared rows)")
+
+    output_csvs = {group_id: f"gitlab_repo_{group_id}_main_branch_check.csv" for group_id in roots}
+    files = {group_id: open(output_csv, mode="w", newline="") for group_id, output_csv in output_csvs.items()}
+    try:
+        writers = {group_id: csv.writer(file) for group_id, file in files.items()}
+        for writer in writers.values():
+            writer.writerow(CSV_HEADER)
+        for checked, (project, has_main_branch, sonar_project_key) in enumerate(check_projects(unique), start=1):
+            for group_id, root_project in memberships[project["id"]]:
+                writers[group_id].writerow(project_row(group_id, root_project, has_main_branch, sonar_project_key))
+                files[group_id].flush()
+            if checked % 100 == 0:
+                print(f"Checked {checked}/{len(unique)} projects")
+    finally:
+        for file in files.values():
+            file.close()
+    for group_id, output_csv in output_csvs.items():
+        sort_output(output_csv)
+        print(f"Output written to {output_csv}")
 
 if __name__ == "__main__":
     # Read group IDs from a file
     input_file = sys.argv[1]  # The path to the text file containing group IDs
     with open(input_file, "r") as file:
-        group_ids = file.read().splitlines()
-
-    for ROOT_GROUP_ID in group_ids:
-        print(f"Starting the script with root group ID as {ROOT_GROUP_ID}...")
-        projects, non_use_variable = get_subgroups_and_projects(ROOT_GROUP_ID)
-        
-        OUTPUT_CSV = f"gitlab_repo_{ROOT_GROUP_ID}_main_branch_check.csv"
-        with open(OUTPUT_CSV, mode="w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["Parent Group ID", "Project ID", "Project Name", "Project URL", "Path Names", "Is Main Branch Exists", "Sonar Project Key"])
-
-            for project in projects:
-                group_id = ROOT_GROUP_ID
-                project_id = project["id"]
-                project_name = project["name"]
-                project_url = project.get("url")
-                path_names = project.get("path_names")
-                has_main_branch = check_main_branch(project_id)
-                sonar_project_key = fetch_sonar_project_key(project_id) if has_main_branch else None
-
-                writer.writerow([group_id, project_id, project_name, project_url, path_names, has_main_branch, sonar_project_key])
-        
-        print(f"Output written to {OUTPUT_CSV}")
+        group_ids = list(dict.fromkeys(line.strip() for line in file if line.strip()))
+
+    print(f"Starting the script with root group IDs {', '.join(group_ids)}...")
+    write_project_checks(load_roots(group_ids))
+    print(f"GitLab HTTP: {gitlab_client.summary()}")
+    print(f"State: {state_store.summary()}")
+    state_store.close()
@@ -1,15 +1,21 @@
 import argparse
-import openpyxl
 import json
+import math
+import os
+import threading
+import time
 import yaml
 import requests
-import time
 from requests.auth import HTTPBasicAuth
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from buildpoller import BuildStatusPoller
+from httpclient import HttpClient
+from jobinput import read_rows
+from triggergovernor import TriggerGovernor
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # Base URL for Jenkins and GitLab
-jenkins_url = "https://jenkins/master-3"  # Base URL for Jenkins
-gitlab_url = "https://gitlab.com/api/v4"  # GitLab API URL
+jenkins_url = os.environ.get("JENKINS_URL", "https://jenkins/master-3")  # Base URL for Jenkins (JENKINS_URL overrides it)
+gitlab_url = os.environ.get("GITLAB_URL", "https://gitlab.com/api/v4")  # GitLab API URL (GITLAB_URL overrides it)
 gitlab_project_id = "your_project_id"  # GitLab project ID
 gitlab_pipeline_id = "your_pipeline_id"  # GitLab pipeline ID
 gitlab_token = "your_gitlab_token"  # GitLab Personal Access Token
@@ -18,11 +24,28 @@ username = "your_username"  # Replace with your Jenkins username
 password = "your_password"  # Replace with your Jenkins password
 poll_interval = 10  # Time in seconds to wait between status checks
 max_threads = 60  # Adjust based on your server's capability and system resources
+trigger_rate = float(os.environ.get("JENKINS_TRIGGER_RATE", 5))  # Most new triggers per second sent to the master
+
+# Stage (a number: a job waits for every job in the previous stage) and DependsOn (comma-separated
+# job names) are optional and describe the order jobs must run in; jobs with neither run right away.
+INPUT_COLUMNS = ['AppName', 'JobName', 'Branch', 'ITReleaseVersion', 'ChangeNumberPROD', 'CTaskPROD', 'OBC', 'CBC',
+                 'Stage', 'DependsOn']
+
+# Keep-alive connection pools shared by every call to Jenkins and to GitLab
+jenkins_client = HttpClient(pool_size=max_threads, auth=HTTPBasicAuth(username, password))
+gitlab_client = HttpClient(pool_size=max_threads, headers={'PRIVATE-TOKEN': gitlab_token})
+
+# Jobs of a stage are released to Jenkins no faster than the master takes them
+trigger_governor = TriggerGovernor(jenkins_url, max_limit=max_threads, rate=trigger_rate)
+jenkins_client.on_latency = trigger_governor.observe_latency
+
+# One poller resolves queue items and build results for every job in batched sweeps
+status_poller = BuildStatusPoller(jenkins_url, jenkins_client, poll_interval=poll_interval, governor=trigger_governor)
 
 def trigger_job(job_name, params):
     url = f"{jenkins_url}/{job_name}/buildWithParameters"
     try:
-        response = requests.post(url, params=params, auth=HTTPBasicAuth(username, password))
+        response = jenkins_client.post(url, params=params)
         if response.status_code == 201:
             print(f"Triggered {job_name}: {response.status_code}")
             location_header = response.headers.get('Location', '')
@@ -35,62 +58,119 @@ def trigger_job(job_name, params):
         print(f"Exception during triggering {job_name}: {e}")
     return None
 
-def get_build_number_from_queue(queue_id):
-    url = f"{jenkins_url}/queue/item/{queue_id}/api/json"
-    while True:
-        try:
-            response = requests.get(url, auth=HTTPBasicAuth(username, password))
-            if response.status_code == 200:
-                queue_info = response.json()
-                if queue_info.get('executable'):
-                    build_number = queue_info['executable']['number']
-                    return build_number
-                elif queue_info.get('cancelled'):
-                    print(f"Build with queueId {queue_id} was cancelled.")
-                    return None
-                print(f"Waiting for job {queue_id} to start...")
+def fetch_pipeline_job_ids():
+    """Index every job of the pipeline by name, following all result pages."""
+    url = f"{gitlab_url}/projects/{gitlab_project_id}/pipelines/{gitlab_pipeline_id}/jobs"
+    job_ids = {}
+    page = 1
+    while page:
+        response = gitlab_client.get(url, params={'per_page': 100, 'page': page})
+        if response.status_code != 200:
+            print(f"Failed to fetch GitLab jobs: {response.status_code}")
+            return None
+        for job in response.json():
+            # Newest first, so a retried job maps to its latest attempt
+            job_ids.setdefault(job['name'], job['id'])
+        next_page = response.headers.get('X-Next-Page')
+        page = int(next_page) if next_page else None
+    return job_ids
+
+
+class StageUpdateBatcher:
+    """Collects finished stages and pushes them to GitLab in rounds from one background thread.
+
+    The pipeline's name -> job id index is loaded once and only reloaded when a round contains a
+    stage name it has not seen, so GitLab reads stay flat however many stages finish.
+    """
+
+    def __init__(self, window=2):
+        self.window = window  # Seconds to let stages that finish close together join one round
+        self.job_ids = None
+        self.rounds = 0
+        self._unknown_names = set()  # Names still missing after a reload; don't reload for them again
+        self._pending = {}  # Stage name -> Jenkins status
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="gitlab-stage-updates", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        # Flush whatever is still pending before returning
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+
+    def submit(self, status, stage_name):
+        with self._condition:
+            self._pending[stage_name] = status
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                # The round closes window seconds after its first update, however many arrive meanwhile
+                deadline = time.monotonic() + self.window
+                while not self._stopping and time.monotonic() < deadline:
+                    self._condition.wait(deadline - time.monotonic())
+                updates, self._pending = self._pending, {}
+            retry = {}
+            try:
+                retry = self._push(updates)
+            except requests.RequestException as e:
+                print(f"Exception during updating GitLab stage status: {e}")
+            if retry:
+                with self._condition:
+                    if self._stopping:
+                        print(f"Dropping {len(retry)} GitLab stage updates: the pipeline's jobs could not be loaded")
+                    else:
+                        for stage_name, status in retry.items():
+                            self._pending.setdefault(stage_name, status)  # A newer status wins
+
+
+    def _push(self, updates):
+        """Send one round; returns the updates to retry because the job index could not be loaded."""
+        self.rounds += 1
+        missing = [name for name in updates if name not in (self.job_ids or {}) and name not in self._unknown_names]
+        retry = {}
+        if self.job_ids is None or missing:
+            try:
+                job_ids = fetch_pipeline_job_ids()
+            except requests.RequestException as e:
+                print(f"Exception during fetching GitLab jobs: {e}")
+                job_ids = None
+            if job_ids is None:
+                # Not a sign the names don't exist: send what the old index knows, retry the rest
+                retry = {name: status for name, status in updates.items() if name not in (self.job_ids or {})}
+                updates = {name: status for name, status in updates.items() if name not in retry}
+            else:
+                self.job_ids = job_ids
+                self._unknown_names.update(name for name in missing if name not in self.job_ids)
+        for stage_name, status in updates.items():
+            job_id = self.job_ids.get(stage_name)
+            if job_id is None:
+                print(f"No GitLab job named {stage_name} in pipeline {gitlab_pipeline_id}")
+                continue
+            update_url = f"{gitlab_url}/projects/{gitlab_project_id}/jobs/{job_id}/play"
+            if status == "SUCCESS":
+                gitlab_client.post(update_url, data={"status": "success"})
             else:
-                print(f"Failed to get queue info for {queue_id}: {response.status_code}")
-        except requests.RequestException as e:
-            print(f"Exception during getting queue info for {queue_id}: {e}")
-        time.sleep(poll_interval)
+                gitlab_client.post(update_url, data={"status": "failed"})
+            print(f"Updated GitLab stage {stage_name} status: {status}")
+        return retry
 
-def get_build_status(job_name, build_number):
-    url = f"{jenkins_url}/{job_name}/{build_number}/api/json"
-    try:
-        response = requests.get(url, auth=HTTPBasicAuth(username, password))
-        if response.status_code == 200:
-            build_info = response.json()
-            status = build_info.get('result', 'UNKNOWN')
-            return status
-        else:
-            print(f"Failed to get status for {job_name}: {response.status_code}")
-    except requests.RequestException as e:
-        print(f"Exception during getting build status for {job_name}: {e}")
-    return 'UNKNOWN'
+
+stage_updates = StageUpdateBatcher()
 
 def update_gitlab_stage_status(status, stage_name):
-    """Update the GitLab stage status via API."""
-    url = f"{gitlab_url}/projects/{gitlab_project_id}/pipelines/{gitlab_pipeline_id}/jobs"
-    headers = {'PRIVATE-TOKEN': gitlab_token}
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            jobs = response.json()
-            for job in jobs:
-                if job['name'] == stage_name:
-                    job_id = job['id']
-                    update_url = f"{gitlab_url}/projects/{gitlab_project_id}/jobs/{job_id}/play"
-                    if status == "SUCCESS":
-                        requests.post(update_url, headers=headers, data={"status": "success"})
-                    else:
-                        requests.post(update_url, headers=headers, data={"status": "failed"})
-                    print(f"Updated GitLab stage status: {status}")
-                    break
-        else:
-            print(f"Failed to fetch GitLab jobs: {response.status_code}")
-    except requests.RequestException as e:
-        print(f"Exception during updating GitLab stage status: {e}")
+    """Queue a GitLab stage status update; it is sent with the next batched round."""
+    stage_updates.submit(status, stage_name)
 
 def generate_gitlab_yaml(json_data):
     """Generate the GitLab CI/CD YAML from the JSON data."""
@@ -101,20 +181,30 @@ def generate_gitlab_yaml(json_data):
     }
     return yaml.dump(yaml_content, default_flow_style=False)
 
+def parse_stage(row_number, value):
+    """The Stage cell as a number, or None when it is blank."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    try:
+        stage = float(value) if not isinstance(value, bool) else math.nan
+    except (TypeError, ValueError):
+        stage = math.nan
+    if not math.isfinite(stage):
+        raise ValueError(f"row {row_number}: Stage must be a number, got {value!r}")
+    return stage
+
 def generate_json_from_excel(excel_file, env_value):
-    """Generate JSON from Excel data."""
-    input_wb = openpyxl.load_workbook(excel_file)
-    input_ws = input_wb.active
+    """Generate JSON from Excel data (or the equivalent .csv/.jsonl rows)."""
     jobs = []
-    stages = []
-    
-    # Define stages for GitLab pipeline
-    stage_names = set()
-    
-    # List to hold the rows from the input sheet
-    rows = list(input_ws.iter_rows(min_row=2, values_only=True))
-
-    for row in rows:
+    invalid = []
+
+    # Rows are parsed lazily from the input file
+    for row_number, row in read_rows(excel_file, INPUT_COLUMNS):
+        try:
+            order = parse_stage(row_number, row[8])
+        except ValueError as e:
+            invalid.append(str(e))
+            continue
         app_name = row[0]
         job_name = row[1].strip()
         branch_name = row[2].strip()
@@ -123,9 +213,7 @@ def generate_json_from_excel(excel_file, env_value):
         change_task = row[5].strip()
         obc = row[6]
         cbc = row[7]
-
-        # Add stage name for GitLab pipeline
-        stage_names.add(job_name)
+        depends_on = [name.strip() for name in str(row[9] or '').replace(';', ',').split(',') if name.strip()]
 
         job_data = {
             "app_name": app_name,
@@ -136,50 +224,195 @@ def generate_json_from_excel(excel_file, env_value):
             "change_task": change_task,
             "obc": obc,
             "cbc": cbc,
-            "env": env_value
+            "env": env_value,
+            "order": order,
+            "depends_on": depends_on
         }
         jobs.append(job_data)
+    if invalid:
+        raise ValueError(f"Invalid input in {excel_file}:\n  " + "\n  ".join(invalid))
+
+    # One GitLab stage per job name, in stage order and then sheet order
+    ordered_jobs = sorted(jobs, key=lambda job: (job["order"] is None, job["order"] or 0))
+    stage_names = list(dict.fromkeys(job["job_name"] for job in ordered_jobs))
 
     # Create JSON structure
     json_data = {
-        "stages": list(stage_names),
+        "stages": stage_names,
         "job_details": jobs
     }
     return json_data
 
+def build_job_graph(jobs):
+    """Work out which jobs each job waits for; returns (dependencies per job index, topological order)."""
+    by_name = {}
+    for index, job in enumerate(jobs):
+        by_name.setdefault(job["job_name"], []).append(index)
+
+    # A numbered stage waits for every job in the stage numbered just before it
+    stages = {}
+    for index, job in enumerate(jobs):
+        if job["order"] is not None:
+            stages.setdefault(job["order"], []).append(index)
+    previous_stage = dict(zip(sorted(stages)[1:], sorted(stages)))
+
+    depends_on = {}
+    for index, job in enumerate(jobs):
+        wanted = set()
+        for name in job["depends_on"]:
+            if name not in by_name:
+                raise ValueError(f"{job['job_name']} depends on {name}, which is not in the sheet")
+            wanted.update(by_name[name])
+        if job["order"] in previous_stage:
+            wanted.update(stages[previous_stage[job["order"]]])
+        wanted.discard(index)
+        depends_on[index] = wanted
+
+    # Kahn's algorithm, which also catches dependency cycles
+    remaining = {index: len(deps) for index, deps in depends_on.items()}
+    dependents = {index: [] for index in depends_on}
+    for index, deps in depends_on.items():
+        for dep in deps:
+            dependents[dep].append(index)
+    order = [index for index, count in remaining.items() if count == 0]
+    for index in order:
+        for dependent in dependents[index]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                order.append(dependent)
+    if len(order) != len(jobs):
+        cycle = sorted({jobs[index]["job_name"] for index, count in remaining.items() if count})
+        raise ValueError(f"Dependency cycle between jobs: {', '.join(cycle)}")
+    return depends_on, order
+
+def run_job(job):
+    """Trigger one Jenkins job, wait for its result and mirror it to its GitLab stage."""
+    job_name = job['job_name']
+    params = {
+        'BRANCH': job['branch'],
+        'ITReleasedVersion': job['it_release_version'],
+        'ChangeNumberPROD': job['change_request'],
+        'CTaskPROD': job['change_task'],
+        'obc': job['obc'],
+        'cbc': job['cbc'],
+        'ENV': job['env']
+    }
+
+    status = 'UNKNOWN'
+    # Trigger the Jenkins job; the governor slot is handed back once the build leaves the queue
+    trigger_governor.acquire()
+    queue_id = trigger_job(job_name, params)
+    if queue_id:
+        queue_waiter = status_poller.watch_queue(queue_id)
+        queue_waiter.add_done_callback(trigger_governor.release)
+        build_number = queue_waiter.wait()
+        if build_number:
+            status = status_poller.watch_build(job_name, build_number).wait()
+
+            # Update GitLab stage status based on Jenkins job status
+            update_gitlab_stage_status(status, job_name)
+    else:
+        trigger_governor.release()
+    return status
+
+def timed_run_job(job):
+    started = time.time()
+    status = run_job(job)
+    return status, started, time.time()
+
+def report_critical_path(jobs, depends_on, order, timings, wall_clock):
+    # Longest chain of dependent jobs by how long each took from trigger to result
+    finish = {}
+    via = {}
+    for index in order:
+        started, ended = timings.get(index, (0, 0))
+        via[index] = max(depends_on[index], key=lambda dep: finish[dep], default=None)
+        finish[index] = (ended - started) + (finish[via[index]] if via[index] is not None else 0)
+    if not finish:
+        return
+    path = [max(finish, key=finish.get)]
+    while via[path[-1]] is not None:
+        path.append(via[path[-1]])
+    path.reverse()
+    total = sum(ended - started for started, ended in timings.values())
+    print(f"Wall-clock {wall_clock:.0f}s for {total:.0f}s of job time; critical path {finish[path[-1]]:.0f}s:")
+    for index in path:
+        started, ended = timings.get(index, (0, 0))
+        print(f"    {jobs[index]['job_name']}: {ended - started:.0f}s")
+
 def process_jobs_and_update_gitlab(json_data):
-    """Process jobs, trigger Jenkins jobs, and update GitLab stages based on Jenkins job status."""
+    """Run the jobs as a dependency DAG: every job whose dependencies succeeded is triggered at once."""
+    jobs = json_data['job_details']
+    depends_on, order = build_job_graph(jobs)
+    dependents = {index: [] for index in depends_on}
+    for index, deps in depends_on.items():
+        for dep in deps:
+            dependents[dep].append(index)
+    waiting_on = {index: len(deps) for index, deps in depends_on.items()}
+    results = {}
+    timings = {}
+
+    def skip(index, reason):
+        # A job whose dependency did not succeed never runs, and neither does anything after it
+        if index in results:
+            return
+        results[index] = 'SKIPPED'
+        print(f"Skipping {jobs[index]['job_name']}: {reason}")
+        for dependent in dependents[index]:
+            skip(dependent, f"{jobs[index]['job_name']} was skipped")
+
+    started = time.time()
     with ThreadPoolExecutor(max_threads) as executor:
-        futures = []
-        for job in json_data['job_details']:
-            app_name = job['app_name']
-            job_name = job['job_name']
-            params = {
-                'BRANCH': job['branch'],
-                'ITReleasedVersion': job['it_release_version'],
-                'ChangeNumberPROD': job['change_request'],
-                'CTaskPROD': job['change_task'],
-                'obc': job['obc'],
-                'cbc': job['cbc'],
-                'ENV': job['env']
-            }
-
-            # Trigger the Jenkins job
-            queue_id = trigger_job(job_name, params)
-            if queue_id:
-                build_number = get_build_number_from_queue(queue_id)
-                if build_number:
-                    # Polling for build status
-                    while True:
-                        status = get_build_status(job_name, build_number)
-                        if status in ['SUCCESS', 'FAILURE', 'UNSTABLE', 'ABORTED']:
-                            break
-                        print(f"Waiting for build {build_number} of {job_name} to complete...")
-                        time.sleep(poll_interval)
-
-                    # Update GitLab stage status based on Jenkins job status
-                    update_gitlab_stage_status(status, job_name)
+        running = {executor.submit(timed_run_job, jobs[index]): index for index, count in waiting_on.items() if count == 0}
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                try:
+                    status, job_started, job_ended = future.result()
+                except Exception as e:
+                    print(f"Exception during processing {jobs[index]['job_name']}: {e}")
+                    status, job_started, job_ended = 'UNKNOWN', started, time.time()
+                results[index] = status
+                timings[index] = (job_started, job_ended)
+                print(f"{jobs[index]['job_name']} finished with {status}")
+
+                for dependent in dependents[index]:
+                    if status != 'SUCCESS':
+                        skip(dependent, f"{jobs[index]['job_name']} finished with {status}")
+                        continue
+                    waiting_on[dependent] -= 1
+                    if waiting_on[dependent] == 0 and dependent not in results:
+                        running[executor.submit(timed_run_job, jobs[dependent])] = dependent
+
+    report_critical_path(jobs, depends_on, order, timings, time.time() - started)
+    return results
 
 def main():
     parser = argparse.ArgumentParser(description="Generate GitLab pipeline YAML and trigger Jenkins jobs")
-    parser.add_argument("env_value", type=str, help="Environment value to pass to the Jenkins job
+    parser.add_argument("env_value", type=str, help="Environment value to pass to the Jenkins job")
+    parser.add_argument("--excel-file", default="jobs.xlsx", help="Jobs to run: .xlsx, .csv or .jsonl")
+    parser.add_argument("--yaml-file", default="generated-pipeline.yml", help="Where to write the generated GitLab YAML")
+    args = parser.parse_args()
+
+    try:
+        json_data = generate_json_from_excel(args.excel_file, args.env_value)
+    except ValueError as e:
+        print(e)
+        exit(1)
+    with open(args.yaml_file, "w") as f:
+        f.write(generate_gitlab_yaml(json_data))
+    print(f"GitLab pipeline YAML written to {args.yaml_file}")
+
+    status_poller.start()
+    stage_updates.start()
+    process_jobs_and_update_gitlab(json_data)
+    status_poller.stop()
+    stage_updates.stop()
+    print(f"Status poller: {status_poller.summary()}")
+    print(f"Jenkins HTTP: {jenkins_client.summary()}")
+    print(f"GitLab HTTP: {gitlab_client.summary()} in {stage_updates.rounds} stage update rounds")
+    print(f"Trigger governor: {trigger_governor.summary()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+'''
+    Paginated GitLab listings, shared by gitgroupm.py and latestbranch.py.
+
+    Page 1 tells how many pages there are (X-Total-Pages); the rest are downloaded `workers`
+    at a time over the caller's HttpClient. GitLab leaves the totals out for very large
+    result sets, which are then followed through X-Next-Page one page at a time. A failed
+    page is reported and skipped, or raised with strict=True for callers that can't use a
+    partial listing; nothing is retried beyond what the client does.
+
+    With a cache (gitgroupm.py's ProjectStateStore) every page is requested with the ETag
+    stored by the last run, and a 304 is answered from the stored body and headers.
+
+    Each listing can hold `workers` connections, so the client's pool_size has to cover
+    workers times the number of listings the caller runs at once.
+'''
+
+PAGE_WORKERS = 8  # Pages of one listing downloaded at the same time
+PER_PAGE = 100
+
+
+class GitLabPager:
+    def __init__(self, client, workers=PAGE_WORKERS, cache=None):
+        self.client = client
+        self.workers = workers
+        self.cache = cache
+
+    def get_page(self, url, params, page):
+        """(items, response headers) of one page, or (None, None) when it could not be read."""
+        params = dict(params, page=page)
+        headers = {}
+        cached = self.cache.cached_response(url, params) if self.cache else None
+        if cached:
+            headers["If-None-Match"] = cached[0]
+        response = self.client.get(url, headers=headers, params=params)
+        if response.status_code == 304 and cached:
+            self.cache.count_not_modified()
+            return cached[2], cached[1]
+        if response.status_code != 200:
+            print(f"Failed to fetch page {page} of {url}: {response.status_code}")
+            return None, None
+        data = response.json()
+        if self.cache and response.headers.get("ETag"):
+            self.cache.cache_response(url, params, response.headers["ETag"], response.headers, data)
+        return data, response.headers
+
+    def get_paginated_data(self, url, params=None, max_pages=None, strict=False, workers=None):
+        params = dict(params or {}, per_page=PER_PAGE)
+
+        def page_data(page):
+            data = self.get_page(url, params, page)
+            if data[0] is None and strict:
+                raise requests.HTTPError(f"Page {page} of {url} could not be read")
+            return data
+
+        first_page, first_headers = page_data(1)
+        if not first_page:
+            return []
+        results = list(first_page)
+        total_pages = first_headers.get("X-Total-Pages")
+        if total_pages:
+            last_page = int(total_pages) if max_pages is None else min(int(total_pages), max_pages)
+            if last_page < int(total_pages):
+                print(f"Only reading {last_page} of {total_pages} pages of {url}")
+            if last_page < 2:
+                return results
+            with ThreadPoolExecutor(min(workers or self.workers, last_page - 1)) as executor:
+                for data in executor.map(lambda page: page_data(page)[0], range(2, last_page + 1)):
+                    results.extend(data or [])
+            return results
+
+        next_page = first_headers.get("X-Next-Page")
+        while next_page and (max_pages is None or int(next_page) <= max_pages):
+            data, page_headers = page_data(int(next_page))
+            if not data:
+                break
+            results.extend(data)
+            next_page = page_headers.get("X-Next-Page")
+        return results
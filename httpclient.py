@@ -0,0 +1,106 @@
+import random
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+
+'''
+    Pooled keep-alive HTTP client shared by the Jenkins and GitLab scripts.
+
+    One requests.Session per client keeps connections to each host open between calls, so
+    polling no longer pays a TCP+TLS handshake per request. Every call gets a timeout, and
+    429/5xx answers are retried with jittered exponential backoff.
+'''
+
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) seconds; a hung server no longer hangs a worker forever
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# A POST that reached the server may have been acted on, so only retry answers that say it was refused
+NON_IDEMPOTENT_RETRY_STATUSES = {429, 503}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+MAX_BACKOFF = 30  # Upper bound in seconds for a single retry wait
+LATENCY_SAMPLES = 10000  # Recent call latencies kept for percentiles
+
+
+class HttpClient:
+    def __init__(self, pool_size=10, timeout=DEFAULT_TIMEOUT, retries=3, backoff=0.5, auth=None, headers=None, verify=True):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.verify = verify
+        if headers:
+            self.session.headers.update(headers)
+        # pool_maxsize is per host, so size it to how many calls the caller runs at once
+        self._adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_size)
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        self.requests_made = 0
+        self.retries_made = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+        self.on_latency = None  # Optional callback(seconds) for every call, e.g. a trigger governor
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_statuses = RETRY_STATUSES if idempotent else NON_IDEMPOTENT_RETRY_STATUSES
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(time.monotonic() - start)
+                # A read timeout on a POST may mean the server got it; only a failed connect is safe to resend
+                if attempt >= self.retries or (not idempotent and not isinstance(e, requests.ConnectTimeout)):
+                    raise
+                self._wait_before_retry(attempt, None)
+            else:
+                self._record(time.monotonic() - start)
+                if response.status_code not in retry_statuses or attempt >= self.retries:
+                    return response
+                self._wait_before_retry(attempt, response.headers.get("Retry-After"))
+            attempt += 1
+
+    def _record(self, elapsed):
+        with self._lock:
+            self.requests_made += 1
+            self._latencies.append(elapsed)
+        if self.on_latency:
+            self.on_latency(elapsed)
+
+    def _wait_before_retry(self, attempt, retry_after):
+        with self._lock:
+            self.retries_made += 1
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            # Full jitter so workers that failed together do not retry together
+            delay = random.uniform(0, self.backoff * (2 ** attempt))
+        time.sleep(min(delay, MAX_BACKOFF))
+
+    def connections_opened(self):
+        # urllib3 counts every new connection (and so every handshake) per host pool
+        pools = self._adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def latency_percentile(self, percentile):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def summary(self):
+        return (f"{self.requests_made} requests, {self.retries_made} retries, "
+                f"{self.connections_opened()} connections opened, "
+                f"p50 {self.latency_percentile(50) * 1000:.0f} ms, p99 {self.latency_percentile(99) * 1000:.0f} ms")
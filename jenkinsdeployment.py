@@ -1,23 +1,65 @@
-
-https://appdistribution.firebase.google.com/testerapps/1:579387171054:ios:7c10f3e3be2f3446a593ff/releases/3er1oj74apkjg?utm_source=fastlane
 import argparse
+import asyncio
+import os
+import time
 import openpyxl
 import requests
-import time
 from requests.auth import HTTPBasicAuth
+from buildpoller import BuildStatusPoller
+from buildtimeline import BuildTimeline
+from httpclient import HttpClient
+from jobinput import read_rows
+from masterpool import JenkinsMaster, MasterPool
+from notifylistener import NotificationListener
+from runjournal import RunJournal, row_key
+from triggercoalescer import TriggerCoalescer
+from triggergovernor import TriggerGovernor
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Base URL for Jenkins
-jenkins_url = "https://jenkins/master-3"  # Base URL for Jenkins
+jenkins_url = os.environ.get("JENKINS_URL", "https://jenkins/master-3")  # Base URL for Jenkins (JENKINS_URL overrides it)
+# Masters mirroring the jobs, e.g. "https://jenkins/master-1,https://jenkins/master-2,https://jenkins/master-3";
+# rows are spread across them by load. JENKINS_URLS overrides it; by default only jenkins_url is used.
+jenkins_urls = os.environ.get("JENKINS_URLS", jenkins_url).split(",")
 username = "your_username"  # Replace with your Jenkins username
 password = "your_password"  # Replace with your Jenkins password
 poll_interval = 10  # Time in seconds to wait between status checks
+safety_net_poll_interval = 60  # Status checks only this often when Jenkins pushes notifications to --listen
 max_threads = 60  # Adjust based on your server's capability and system resources
+async_io_threads = 16  # Threads used only for the short HTTP calls in async mode
+trigger_rate = float(os.environ.get("JENKINS_TRIGGER_RATE", 5))  # Most new triggers per second sent to the master
+
+def connect_master(url):
+    # Keep-alive connection pool shared by every call to the master, sized to the busiest engine
+    client = HttpClient(pool_size=max(max_threads, async_io_threads), auth=HTTPBasicAuth(username, password))
+
+    # Caps triggered-but-not-started builds on the master, sized AIMD-style from its queue length and API latency
+    governor = TriggerGovernor(url, max_limit=1000, rate=trigger_rate)
+    client.on_latency = governor.observe_latency
+
+    # One poller resolves queue items and build results for every row on the master in batched sweeps
+    poller = BuildStatusPoller(url, client, poll_interval=poll_interval, governor=governor)
+    return JenkinsMaster(url, client, governor, poller)
+
+# Each row is triggered on the least loaded master that has its job
+master_pool = MasterPool([connect_master(url.strip().rstrip('/')) for url in jenkins_urls if url.strip()])
+
+# Rows sending a job identical parameters share one build; AppName is only an alias and doesn't count
+trigger_coalescer = TriggerCoalescer(ignored_params=['AppName'])
 
-def trigger_job(job_name, params):
-    url = f"{jenkins_url}/{job_name}/buildWithParameters"
+# Input columns in sheet order; also the keys accepted for JSON-lines rows
+INPUT_COLUMNS = ['AppName', 'JobName', 'Branch', 'ITReleaseVersion', 'ChangeNumberPROD', 'CTaskPROD', 'OBC', 'CBC']
+
+# Journal of every trigger/queue id/build number/result, opened in main()
+run_journal = None
+
+# Per-row trigger latency, queue wait, runtime and polling overhead
+build_timeline = BuildTimeline()
+
+def trigger_job(master, job_name, params):
+    url = f"{master.url}/{job_name}/buildWithParameters"
     try:
-        response = requests.post(url, params=params, auth=HTTPBasicAuth(username, password))
+        response = master.client.post(url, params=params)
         if response.status_code == 201:
             print(f"Triggered {job_name}: {response.status_code}")
             location_header = response.headers.get('Location', '')
@@ -25,46 +67,14 @@ def trigger_job(job_name, params):
                 queue_id = location_header.split('/')[-2]
                 return queue_id
         else:
-            print(f"Failed to trigger {job_name}: {response.status_code}")
+            print(f"Failed to trigger {job_name} on {master.url}: {response.status_code}")
+            if response.status_code == 404:
+                master_pool.job_missing(master, job_name)
     except requests.RequestException as e:
         print(f"Exception during triggering {job_name}: {e}")
     return None
 
-def get_build_number_from_queue(queue_id):
-    url = f"{jenkins_url}/queue/item/{queue_id}/api/json"
-    while True:
-        try:
-            response = requests.get(url, auth=HTTPBasicAuth(username, password))
-            if response.status_code == 200:
-                queue_info = response.json()
-                if queue_info.get('executable'):
-                    build_number = queue_info['executable']['number']
-                    return build_number
-                elif queue_info.get('cancelled'):
-                    print(f"Build with queueId {queue_id} was cancelled.")
-                    return None
-                print(f"Waiting for job {queue_id} to start...")
-            else:
-                print(f"Failed to get queue info for {queue_id}: {response.status_code}")
-        except requests.RequestException as e:
-            print(f"Exception during getting queue info for {queue_id}: {e}")
-        time.sleep(poll_interval)
-
-def get_build_status(job_name, build_number):
-    url = f"{jenkins_url}/{job_name}/{build_number}/api/json"
-    try:
-        response = requests.get(url, auth=HTTPBasicAuth(username, password))
-        if response.status_code == 200:
-            build_info = response.json()
-            status = build_info.get('result', 'UNKNOWN')
-            return status
-        else:
-            print(f"Failed to get status for {job_name}: {response.status_code}")
-    except requests.RequestException as e:
-        print(f"Exception during getting build status for {job_name}: {e}")
-    return 'UNKNOWN'
-
-def process_row(row, env_value):
+def parse_row(row, env_value):
     # Unpack row values and strip spaces from headers
     app_name = row[0]
     job_name = row[1].strip()
@@ -92,44 +102,163 @@ def process_row(row, env_value):
     if app_name:
        params['AppName'] = app_name 
 
-    queue_id = trigger_job(job_name, params)
+    # Output columns in the same order as the jobs_status.xlsx header, minus the status
+    output = (app_name, job_name, env_value, change_request, change_task, it_release_version, obc, cbc, branch_name)
+    return job_name, params, output
+
+def trigger_and_record(key, master, job_name, params):
+    # The caller holds a governor slot; it is handed back once the build leaves the queue
+    started = time.monotonic()
+    queue_id = trigger_job(master, job_name, params)
+    build_timeline.triggered(key, time.monotonic() - started)
     if queue_id:
-        build_number = get_build_number_from_queue(queue_id)
-        if build_number:
-            # Polling for build status
-            while True:
-                status = get_build_status(job_name, build_number)
-                if status in ['SUCCESS', 'FAILURE', 'UNSTABLE', 'ABORTED']:
-                    break
-                print(f"Waiting for build {build_number} of {job_name} to complete...")
-                time.sleep(poll_interval)
-
-            return (app_name, job_name, env_value, change_request, change_task, it_release_version, obc, cbc, branch_name, status)
-    return (app_name, job_name, env_value, change_request, change_task, it_release_version, obc, cbc, branch_name, 'UNKNOWN')
+        run_journal.record(key, 'triggered', job_name=job_name, queue_id=queue_id, master=master.url)
+        master.poller.watch_queue(queue_id).add_done_callback(master.governor.release)
+        return master, queue_id
+    master.governor.release()
+    return None
 
-def main():
-    # Load the input workbook and select the active sheet
-    parser = argparse.ArgumentParser(description='Trigger Jenkins jobs based on Excel data')
-    parser.add_argument('env_value', type=str, help='Environment value to pass to the Jenkins job')
-    args = parser.parse_args()
-    input_wb = openpyxl.load_workbook('jobs.xlsx')
-    input_ws = input_wb.active
+def routed_trigger(key, job_name, params):
+    master = master_pool.route(job_name)
+    if master is None:
+        return None
+    master.governor.acquire()
+    return trigger_and_record(key, master, job_name, params)
 
-    # Create the output workbook and sheet
-    output_wb = openpyxl.Workbook()
-    output_ws = output_wb.active
+def share_trigger(key, job_name, trigger):
+    # This row duplicates one that already triggered: follow the same queue item instead
+    if not trigger:
+        return None, None
+    master, queue_id = trigger
+    print(f"{job_name}: same parameters as an earlier row, sharing its queue item {queue_id} on {master.url}")
+    run_journal.record(key, 'triggered', job_name=job_name, queue_id=queue_id, master=master.url, shared=True)
+    return trigger
 
-    # Define the header row
-    headers = ['AppName', 'Job Name', 'ENV', 'ChangeNumberPROD', 'CTaskPROD', 'ITReleaseVersion', 'OBC', 'CBC', 'Branch', 'Build Status']
-    output_ws.append(headers)
+def coalesced_trigger(key, job_name, params):
+    # Returns (master, queue_id), or (None, None) when nothing could be triggered
+    waiter, first = trigger_coalescer.claim(job_name, params)
+    if not first:
+        return share_trigger(key, job_name, waiter.wait())
+    trigger = None
+    try:
+        trigger = routed_trigger(key, job_name, params)
+    finally:
+        waiter.resolve(trigger)
+    return trigger or (None, None)
+
+async def async_coalesced_trigger(key, job_name, params):
+    waiter, first = trigger_coalescer.claim(job_name, params)
+    if not first:
+        return share_trigger(key, job_name, await waiter.wait_async())
+    trigger = None
+    try:
+        # Routing only blocks the first time a job is looked up on each master
+        master = await run_blocking(master_pool.route, job_name)
+        if master is not None:
+            await master.governor.acquire_async()
+            trigger = await run_blocking(trigger_and_record, key, master, job_name, params)
+    finally:
+        waiter.resolve(trigger)
+    return trigger or (None, None)
+
+def record_started(key, build_number):
+    if build_number:
+        run_journal.record(key, 'started', build_number=build_number)
+    return build_number
+
+def record_finished(key, build_number, result):
+    run_journal.record(key, 'finished', build_number=build_number, result=result[-1], output=list(result))
+    return result
+
+def resumed_master(job_name, state):
+    master = master_pool.master_for(state.get('master'))
+    if master is None:
+        print(f"Cannot follow {job_name}: {state['master']} is no longer one of the masters")
+    return master
 
-    # List to hold the rows from the input sheet
-    rows = list(input_ws.iter_rows(min_row=2, values_only=True))
+def resumed_trigger(job_name, state):
+    # A row triggered by an earlier run is followed by its queue id instead of being triggered again
+    if not state.get('queue_id'):
+        return None
+    master = resumed_master(job_name, state)
+    if master is None:
+        return None, None
+    print(f"Re-attaching to {job_name} queue item {state['queue_id']} on {master.url}")
+    return master, state['queue_id']
+
+def row_steps(key, row, env_value):
+    # One row from resume to result for either engine. Every step that waits is yielded as
+    # (blocking call, coroutine function, args); the engine runs it and sends back its result.
+    job_name, params, output = parse_row(row, env_value)
+    state = run_journal.state.get(key, {})
+    if 'result' in state:
+        print(f"Skipping {job_name}: finished with {state['result']} in a previous run")
+        return tuple(state['output'])
+
+    build_number = state.get('build_number')
+    master = resumed_master(job_name, state) if build_number else None
+    queue_id, queue_waiter, build_waiter = state.get('queue_id'), None, None
+    if build_number is None:
+        master, queue_id = resumed_trigger(job_name, state) or (
+            yield coalesced_trigger, async_coalesced_trigger, (key, job_name, params))
+        if queue_id:
+            queue_waiter = master.poller.watch_queue(queue_id)
+            build_number = record_started(key, (yield queue_waiter.wait, queue_waiter.wait_async, ()))
+    status = 'UNKNOWN'
+    if build_number and master:
+        build_waiter = master.poller.watch_build(job_name, build_number)
+        status = yield build_waiter.wait, build_waiter.wait_async, ()
+    build_timeline.finished(key, job_name, master and master.url, queue_id, build_number, queue_waiter, build_waiter, status)
+    return record_finished(key, build_number, output + (status,))
+
+def process_row(key, row, env_value):
+    steps = row_steps(key, row, env_value)
+    try:
+        call, _, args = next(steps)
+        while True:
+            call, _, args = steps.send(call(*args))
+    except StopIteration as done:
+        return done.value
+
+async def run_blocking(func, *args):
+    # Run one short HTTP call on the loop's I/O threads; waiting between calls never holds a thread
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+async def async_process_row(key, row, env_value):
+    steps = row_steps(key, row, env_value)
+    try:
+        _, coroutine, args = next(steps)
+        while True:
+            _, coroutine, args = steps.send(await coroutine(*args))
+    except StopIteration as done:
+        return done.value
+
+async def async_process_rows(rows, env_value, output_ws):
+    # One task per row on a single event loop, so there is no cap on in-flight builds
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(async_io_threads))
+    tasks = []
+    for number, row in rows:
+        tasks.append(asyncio.create_task(async_process_row(row_key(number, row), row, env_value)))
+        # Let the new task send its trigger while the rest of the input is still being parsed
+        await asyncio.sleep(0)
+
+    # Collect results as they complete
+    for next_done in asyncio.as_completed(tasks):
+        try:
+            result = await next_done
+            output_ws.append(result)
+        except Exception as e:
+            print(f"Exception during processing a row: {e}")
+
+def process_rows_with_threads(rows, env_value, output_ws):
+    executor = ThreadPoolExecutor(max_threads)
+    try:
+        # Submit tasks to the thread pool as rows stream in, so builds start before the input is fully read
+        futures = [executor.submit(process_row, row_key(number, row), row, env_value)
+                   for number, row in rows]
 
-    with ThreadPoolExecutor(max_threads) as executor:
-        # Submit tasks to the thread pool
-        futures = [executor.submit(process_row, row, args.env_value) for row in rows]
-        
         # Collect results as they complete
         for future in as_completed(futures):
             try:
@@ -137,9 +266,90 @@ def main():
                 output_ws.append(result)
             except Exception as e:
                 print(f"Exception during processing a row: {e}")
+    finally:
+        # On Ctrl-C don't wait for workers parked on builds that keep running in Jenkins
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Trigger Jenkins jobs based on Excel data')
+    parser.add_argument('env_value', type=str, help='Environment value to pass to the Jenkins job')
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads',
+                        help='threads: one worker per build (capped by max_threads); async: all builds tracked on one event loop')
+    parser.add_argument('--journal', default='jobs_status.journal.jsonl', help='Append-only record of triggers and results')
+    parser.add_argument('--resume', action='store_true',
+                        help='Reuse finished rows from the journal and re-attach to in-flight builds instead of re-triggering')
+    parser.add_argument('--input', default='jobs.xlsx', help='Rows to deploy: .xlsx, .csv or .jsonl')
+    parser.add_argument('--listen', type=int, metavar='PORT',
+                        help='Receive Jenkins notification-plugin/webhook callbacks on this port; polling becomes a slow safety net')
+    parser.add_argument('--listen-host', default='127.0.0.1',
+                        help='Address the --listen port binds to; anything but localhost needs --notify-token')
+    parser.add_argument('--notify-token', default=os.environ.get('JENKINS_NOTIFY_TOKEN'),
+                        help='Shared secret notifications must carry as ?token= or X-Notify-Token')
+    parser.add_argument('--timeline', metavar='PATH', help='Write per-row timings to this .csv or .json file at the end')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT', help='Serve live Prometheus metrics on this port at /metrics')
+    args = parser.parse_args()
+    if args.listen is not None and args.listen_host not in ('127.0.0.1', 'localhost', '::1') and not args.notify_token:
+        parser.error('--listen-host other than localhost requires --notify-token')
+
+    # Create the output workbook and sheet; write-only mode streams rows to disk as they are appended
+    output_wb = openpyxl.Workbook(write_only=True)
+    output_ws = output_wb.create_sheet()
+
+    # Define the header row
+    headers = ['AppName', 'Job Name', 'ENV', 'ChangeNumberPROD', 'CTaskPROD', 'ITReleaseVersion', 'OBC', 'CBC', 'Branch', 'Build Status']
+    output_ws.append(headers)
+
+    # Rows are parsed lazily and handed to the engine one by one
+    rows = read_rows(args.input, INPUT_COLUMNS)
+
+    global run_journal
+    run_journal = RunJournal(args.journal, resume=args.resume)
+
+    listener = None
+    if args.listen is not None:
+        listener = NotificationListener([master.poller for master in master_pool.masters], host=args.listen_host,
+                                        port=args.listen, token=args.notify_token)
+        listener.start()
+        for master in master_pool.masters:
+            master.poller.poll_interval = master.poller.min_interval = safety_net_poll_interval
+
+    if args.metrics_port is not None:
+        build_timeline.serve(args.metrics_port)
+
+    if args.engine == 'threads':
+        # Every outstanding build holds a worker, so the window can never usefully pass max_threads
+        for master in master_pool.masters:
+            master.governor.max_limit = max_threads
+
+    master_pool.start()
+    try:
+        if args.engine == 'async':
+            asyncio.run(async_process_rows(rows, args.env_value, output_ws))
+        else:
+            process_rows_with_threads(rows, args.env_value, output_ws)
+    except KeyboardInterrupt:
+        run_journal.close()
+        print(f"Interrupted; progress is saved in {args.journal}, rerun with --resume to continue")
+        os._exit(130)
+    master_pool.stop()
+    if listener:
+        listener.stop()
+        print(f"Notifications: {listener.summary()}")
+    if len(master_pool.masters) > 1:
+        print(f"Master pool: {master_pool.summary()}")
+    for master in master_pool.masters:
+        print(f"[{master.url}] Status poller: {master.poller.summary()}")
+        print(f"[{master.url}] Jenkins HTTP: {master.client.summary()}")
+        print(f"[{master.url}] Trigger governor: {master.governor.summary()}")
+    print(f"Coalescing: {trigger_coalescer.summary()}")
+    print(f"Timings: {build_timeline.summary()}")
+    if args.timeline:
+        build_timeline.export(args.timeline)
+    build_timeline.stop()
 
     # Save the output workbook
     output_wb.save('jobs_status.xlsx')
+    run_journal.close()
 
 if __name__ == "__main__":
     main()
@@ -1,19 +1,52 @@
+import argparse
 import openpyxl
-import requests
+import os
 import time
+import requests
+from buildpoller import BuildStatusPoller
+from buildtimeline import BuildTimeline
+from httpclient import HttpClient
+from jobinput import read_rows
+from notifylistener import NotificationListener
+from runjournal import RunJournal, row_key
+from triggercoalescer import TriggerCoalescer
+from triggergovernor import TriggerGovernor
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Base URL for Jenkins
-jenkins_url = "http://your-jenkins-url"
+jenkins_url = os.environ.get("JENKINS_URL", "http://your-jenkins-url")  # JENKINS_URL overrides it, e.g. for fakejenkins.py
 username = "your-username"
 api_token = "your-api-token"
 poll_interval = 10  # Time in seconds to wait between status checks
+safety_net_poll_interval = 60  # Status checks only this often when Jenkins pushes notifications to --listen
 max_threads = 15  # Adjust based on your server's capability and system resources
+trigger_rate = float(os.environ.get("JENKINS_TRIGGER_RATE", 5))  # Most new triggers per second sent to the master
+
+# Keep-alive connection pool shared by every call to the master
+jenkins_client = HttpClient(pool_size=max_threads, auth=(username, api_token))
+
+# Triggers wait for a slot while too many builds sit in the queue
+trigger_governor = TriggerGovernor(jenkins_url, max_limit=max_threads, rate=trigger_rate)
+jenkins_client.on_latency = trigger_governor.observe_latency
+
+# One poller resolves queue items and build results for every row in batched sweeps
+status_poller = BuildStatusPoller(jenkins_url, jenkins_client,
+                                  job_url=lambda job_name: f"{jenkins_url}/job/{job_name}",
+                                  poll_interval=poll_interval, governor=trigger_governor)
+
+# Rows sending a job identical parameters share one build
+trigger_coalescer = TriggerCoalescer()
+
+INPUT_COLUMNS = ['AppName', 'JobName', 'Env', 'ChangeRequest', 'ChangeTask', 'ITReleaseVersion', 'OBC', 'CBC', 'BranchName']
+
+run_journal = None  # Opened in main()
+
+build_timeline = BuildTimeline()
 
 def trigger_job(job_name, params):
     url = f"{jenkins_url}/job/{job_name}/buildWithParameters"
     try:
-        response = requests.post(url, params=params, auth=(username, api_token))
+        response = jenkins_client.post(url, params=params)
         if response.status_code == 201:
             print(f"Triggered {job_name}: {response.status_code}")
             location_header = response.headers.get('Location', '')
@@ -26,41 +59,7 @@ def trigger_job(job_name, params):
         print(f"Exception during triggering {job_name}: {e}")
     return None
 
-def get_build_number_from_queue(queue_id):
-    url = f"{jenkins_url}/queue/item/{queue_id}/api/json"
-    while True:
-        try:
-            response = requests.get(url, auth=(username, api_token))
-            if response.status_code == 200:
-                queue_info = response.json()
-                if queue_info.get('executable'):
-                    build_number = queue_info['executable']['number']
-                    return build_number
-                elif queue_info.get('cancelled'):
-                    print(f"Build with queueId {queue_id} was cancelled.")
-                    return None
-                print(f"Waiting for job {queue_id} to start...")
-            else:
-                print(f"Failed to get queue info for {queue_id}: {response.status_code}")
-        except requests.RequestException as e:
-            print(f"Exception during getting queue info for {queue_id}: {e}")
-        time.sleep(poll_interval)
-
-def get_build_status(job_name, build_number):
-    url = f"{jenkins_url}/job/{job_name}/{build_number}/api/json"
-    try:
-        response = requests.get(url, auth=(username, api_token))
-        if response.status_code == 200:
-            build_info = response.json()
-            status = build_info.get('result', 'UNKNOWN')
-            return status
-        else:
-            print(f"Failed to get status for {job_name}: {response.status_code}")
-    except requests.RequestException as e:
-        print(f"Exception during getting build status for {job_name}: {e}")
-    return 'UNKNOWN'
-
-def process_row(row):
+def process_row(key, row):
     # Unpack row values and include BranchName
     app_name, job_name, env, change_request, change_task, it_release_version, obc, cbc, branch_name = row[:9]
 
@@ -91,41 +90,102 @@ def process_row(row):
         'BranchName': branch_name
     }
 
-    queue_id = trigger_job(job_name, params)
-    if queue_id:
-        build_number = get_build_number_from_queue(queue_id)
-        if build_number:
-            # Polling for build status
-            while True:
-                status = get_build_status(job_name, build_number)
-                if status in ['SUCCESS', 'FAILURE', 'UNSTABLE', 'ABORTED']:
-                    break
-                print(f"Waiting for build {build_number} of {job_name} to complete...")
-                time.sleep(poll_interval)
-
-            return (app_name, job_name, env, change_request, change_task, it_release_version, obc, cbc, branch_name, status)
-    return (app_name, job_name, env, change_request, change_task, it_release_version, obc, cbc, branch_name, 'UNKNOWN')
+    state = run_journal.state.get(key, {})
+    if 'result' in state:
+        print(f"Skipping {job_name}: finished with {state['result']} in a previous run")
+        return tuple(state['output'])
+
+    # Rows from an interrupted run pick up from the last recorded step
+    build_number = state.get('build_number')
+    queue_id = state.get('queue_id')
+    queue_waiter = build_waiter = None
+    if build_number is None:
+        if queue_id:
+            print(f"Re-attaching to {job_name} queue item {queue_id}")
+        else:
+            waiter, first = trigger_coalescer.claim(job_name, params)
+            if first:
+                try:
+                    trigger_governor.acquire()
+                    started = time.monotonic()
+                    queue_id = trigger_job(job_name, params)
+                    build_timeline.triggered(key, time.monotonic() - started)
+                    if queue_id:
+                        run_journal.record(key, 'triggered', job_name=job_name, queue_id=queue_id)
+                        # The governor slot is handed back once the build leaves the queue
+                        status_poller.watch_queue(queue_id).add_done_callback(trigger_governor.release)
+                    else:
+                        trigger_governor.release()
+                finally:
+                    waiter.resolve(queue_id)
+            else:
+                queue_id = waiter.wait()
+                if queue_id:
+                    print(f"{job_name}: same parameters as an earlier row, sharing its queue item {queue_id}")
+                    run_journal.record(key, 'triggered', job_name=job_name, queue_id=queue_id, shared=True)
+        if queue_id:
+            queue_waiter = status_poller.watch_queue(queue_id)
+            build_number = queue_waiter.wait()
+            if build_number:
+                run_journal.record(key, 'started', build_number=build_number)
+
+    status = 'UNKNOWN'
+    if build_number:
+        build_waiter = status_poller.watch_build(job_name, build_number)
+        status = build_waiter.wait()
+    build_timeline.finished(key, job_name, jenkins_url, queue_id, build_number, queue_waiter, build_waiter, status)
+    result = (app_name, job_name, env, change_request, change_task, it_release_version, obc, cbc, branch_name, status)
+    run_journal.record(key, 'finished', build_number=build_number, result=status, output=list(result))
+    return result
 
 def main():
-    # Load the input workbook and select the active sheet
-    input_wb = openpyxl.load_workbook('jobs.xlsx')
-    input_ws = input_wb.active
+    global run_journal
+    parser = argparse.ArgumentParser(description='Trigger Jenkins jobs based on Excel data')
+    parser.add_argument('--journal', default='jobs_status.journal.jsonl', help='Append-only record of triggers and results')
+    parser.add_argument('--resume', action='store_true',
+                        help='Reuse finished rows from the journal and re-attach to in-flight builds instead of re-triggering')
+    parser.add_argument('--input', default='jobs.xlsx', help='Rows to deploy: .xlsx, .csv or .jsonl')
+    parser.add_argument('--listen', type=int, metavar='PORT',
+                        help='Receive Jenkins notification-plugin/webhook callbacks on this port; polling becomes a slow safety net')
+    parser.add_argument('--listen-host', default='127.0.0.1',
+                        help='Address the --listen port binds to; anything but localhost needs --notify-token')
+    parser.add_argument('--notify-token', default=os.environ.get('JENKINS_NOTIFY_TOKEN'),
+                        help='Shared secret notifications must carry as ?token= or X-Notify-Token')
+    parser.add_argument('--timeline', metavar='PATH', help='Write per-row timings to this .csv or .json file at the end')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT', help='Serve live Prometheus metrics on this port at /metrics')
+    args = parser.parse_args()
+    if args.listen is not None and args.listen_host not in ('127.0.0.1', 'localhost', '::1') and not args.notify_token:
+        parser.error('--listen-host other than localhost requires --notify-token')
 
     # Create the output workbook and sheet
-    output_wb = openpyxl.Workbook()
-    output_ws = output_wb.active
+    output_wb = openpyxl.Workbook(write_only=True)
+    output_ws = output_wb.create_sheet()
 
     # Define the header row
     headers = ['AppName', 'Job Name', 'Env', 'ChangeRequest', 'ChangeTask', 'ITReleaseVersion', 'OBC', 'CBC', 'BranchName', 'Build Status']
     output_ws.append(headers)
 
-    # List to hold the rows from the input sheet
-    rows = list(input_ws.iter_rows(min_row=2, values_only=True))
+    # Rows are parsed lazily and handed to the thread pool one by one
+    rows = read_rows(args.input, INPUT_COLUMNS)
+
+    run_journal = RunJournal(args.journal, resume=args.resume)
+    listener = None
+    if args.listen is not None:
+        listener = NotificationListener(status_poller, host=args.listen_host,
+                                        port=args.listen, token=args.notify_token)
+        listener.start()
+        status_poller.poll_interval = status_poller.min_interval = safety_net_poll_interval
+
+    if args.metrics_port is not None:
+        build_timeline.serve(args.metrics_port)
 
-    with ThreadPoolExecutor(max_threads) as executor:
+    status_poller.start()
+    executor = ThreadPoolExecutor(max_threads)
+    try:
         # Submit tasks to the thread pool
-        futures = [executor.submit(process_row, row) for row in rows]
-        
+        futures = [executor.submit(process_row, row_key(number, row), row)
+                   for number, row in rows]
+
         # Collect results as they complete
         for future in as_completed(futures):
             try:
@@ -133,9 +193,28 @@ def main():
                 output_ws.append(result)
             except Exception as e:
                 print(f"Exception during processing a row: {e}")
+    except KeyboardInterrupt:
+        run_journal.close()
+        print(f"Interrupted; progress is saved in {args.journal}, rerun with --resume to continue")
+        # Don't wait for workers parked on builds that keep running in Jenkins
+        os._exit(130)
+    executor.shutdown()
+    status_poller.stop()
+    if listener:
+        listener.stop()
+        print(f"Notifications: {listener.summary()}")
+    print(f"Status poller: {status_poller.summary()}")
+    print(f"Jenkins HTTP: {jenkins_client.summary()}")
+    print(f"Trigger governor: {trigger_governor.summary()}")
+    print(f"Coalescing: {trigger_coalescer.summary()}")
+    print(f"Timings: {build_timeline.summary()}")
+    if args.timeline:
+        build_timeline.export(args.timeline)
+    build_timeline.stop()
 
     # Save the output workbook
     output_wb.save('jobs_status.xlsx')
+    run_journal.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,78 @@
+import csv
+import json
+import os
+import openpyxl
+
+'''
+    Row-streaming readers for the deployment input (jobs.xlsx and friends).
+
+    Rows are yielded as they are parsed, so the scripts can start triggering builds before
+    the whole file has been read. Every format produces the same positional tuples that
+    process_row already unpacks:
+        .xlsx/.xlsm  - first sheet, header row skipped, opened read-only
+        .csv         - same columns as the sheet, header row skipped
+        .jsonl       - one row per line, either a JSON array in sheet order or an object
+                       keyed by the script's column names
+'''
+
+
+def _is_blank(values):
+    return all(value is None or (isinstance(value, str) and not value.strip()) for value in values)
+
+
+def _normalize(name):
+    return "".join(str(name).split()).lower()
+
+
+def _read_xlsx(path):
+    # read_only keeps openpyxl from building the whole sheet in memory
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row_number, values in enumerate(workbook.active.iter_rows(min_row=2, values_only=True), start=2):
+            yield row_number, values
+    finally:
+        workbook.close()
+
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Header row
+        for row_number, values in enumerate(reader, start=2):
+            # Empty CSV fields mean the same as empty cells
+            yield row_number, tuple(value if value != "" else None for value in values)
+
+
+def _read_jsonl(path, columns):
+    wanted = [_normalize(column) for column in columns]
+    with open(path, encoding="utf-8") as f:
+        for row_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {row_number} of {path}: {e}")
+                continue
+            if isinstance(record, dict):
+                by_name = {_normalize(key): value for key, value in record.items()}
+                yield row_number, tuple(by_name.get(column) for column in wanted)
+            else:
+                yield row_number, tuple(record)
+
+
+def read_rows(path, columns):
+    """Yield (row_number, values) for every non-blank input row; `columns` names the JSONL object keys."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".xlsx", ".xlsm"):
+        rows = _read_xlsx(path)
+    elif extension == ".csv":
+        rows = _read_csv(path)
+    elif extension in (".jsonl", ".ndjson"):
+        rows = _read_jsonl(path, columns)
+    else:
+        raise ValueError(f"Unsupported input format '{extension}' for {path}; use .xlsx, .csv or .jsonl")
+    for row_number, values in rows:
+        if not _is_blank(values):
+            # Short CSV/JSON rows read as empty cells, like missing cells in the sheet
+            yield row_number, tuple(values) + (None,) * (len(columns) - len(values))
@@ -1,108 +1,128 @@
-import requests
-
-gitlab_base_url = 'https://gitlab.com/api/v4'
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from gitlabpager import GitLabPager, PAGE_WORKERS
+from httpclient import HttpClient
+from projectindex import ProjectIndex
+from branchservice import LatestBranchService
+
+gitlab_base_url = os.environ.get('GITLAB_URL', 'https://gitlab.com/api/v4')
 access_token = 'your_personal_access_token'
 headers = {'Private-Token': access_token}
+GROUP_WORKERS = 4  # Top-level groups indexed at the same time
+BRANCH_WORKERS = 8  # Projects whose branches are looked up at the same time
+# Group listings page PAGE_WORKERS at a time; branch lookups read their pages one by one
+gitlab_client = HttpClient(pool_size=max(GROUP_WORKERS * PAGE_WORKERS, BRANCH_WORKERS), headers=headers)
+gitlab_pages = GitLabPager(gitlab_client)
 
-def fetch_project_id_in_group(group_id, appname):
-    # Construct the search URL within the group
-    search_url = f"{gitlab_base_url}/groups/{group_id}/projects?search={appname}"
-    response = requests.get(search_url, headers=headers)
+# Branch prefixes to search for
+branch_prefixes = ['release', 'Release', 'develop', 'master', 'main']
 
-    if response.status_code == 200:
-        projects = response.json()
+def list_top_level_groups():
+    return gitlab_pages.get_paginated_data(f"{gitlab_base_url}/groups", {"top_level_only": "true"})
 
-        if projects:
-            # Return the project ID if found
-            return projects[0]['id']  # Assuming the first project found is the correct one
-        else:
-            return None
-    else:
-        print(f"Failed to fetch projects for application name '{appname}' in group '{group_id}'. Status code: {response.status_code}")
-        return None
+def list_group_projects(group_id):
+    # Every project below the group in one paginated listing, instead of a search per subgroup
+    return gitlab_pages.get_paginated_data(f"{gitlab_base_url}/groups/{group_id}/projects",
+                                           {"include_subgroups": "true", "simple": "true", "order_by": "id", "sort": "asc"})
 
-def find_project_id_in_groups(parent_group_id, appname):
-    # Try to find the project in the current group
-    project_id = fetch_project_id_in_group(parent_group_id, appname)
-    if project_id:
-        return project_id
-    else:
-        # If not found, recursively search in subgroups
-        subgroups_url = f"{gitlab_base_url}/groups/{parent_group_id}/subgroups"
-        response = requests.get(subgroups_url, headers=headers)
+def crawl_projects():
+    # All projects of all top-level groups, for the service's single index
+    group_ids = [group['id'] for group in list_top_level_groups()]
+    with ThreadPoolExecutor(GROUP_WORKERS) as executor:
+        return [project for projects in executor.map(list_group_projects, group_ids) for project in projects]
 
-        if response.status_code == 200:
-            subgroups = response.json()
+def prefix_families(branch_prefixes):
+    # 'release' and 'Release' are one family: GitLab's branch search ignores case
+    families = {}
+    for prefix in branch_prefixes:
+        families.setdefault(prefix.lower(), []).append(prefix)
+    return families
 
-            # Recursively search in each subgroup
-            for subgroup in subgroups:
-                subgroup_id = subgroup['id']
-                project_id = find_project_id_in_groups(subgroup_id, appname)
-                if project_id:
-                    return project_id
-            else:
-                return None  # If project not found in any subgroup
-        else:
-            print(f"Failed to fetch subgroups for group ID '{parent_group_id}'. Status code: {response.status_code}")
-            return None
+def committed_at(branch):
+    # Offsets differ between commits, so compare times rather than ISO strings
+    return datetime.fromisoformat(branch['commit']['committed_date'].replace('Z', '+00:00'))
 
 def fetch_latest_branch(project_id, branch_prefixes):
+    # One filtered, fully paginated listing per prefix family instead of the first 20 branches.
+    # Its pages are read one at a time: BRANCH_WORKERS projects already run side by side
     latest_branch = None
-
-    # Fetch branches of the project
     branches_url = f"{gitlab_base_url}/projects/{project_id}/repository/branches"
-    response = requests.get(branches_url, headers=headers)
-
-    if response.status_code == 200:
-        branches = response.json()
-
-        # Iterate through branches to find the latest matching branch
-        for branch in branches:
-            branch_name = branch['name']
-            for prefix in branch_prefixes:
-                if branch_name.startswith(prefix):
-                    if latest_branch is None or branch['commit']['committed_date'] > latest_branch['commit']['committed_date']:
-                        latest_branch = branch
-                    break
-    
+    for family, prefixes in prefix_families(branch_prefixes).items():
+        for branch in gitlab_pages.get_paginated_data(branches_url, {"search": f"^{family}"}, workers=1):
+            # The search is case-insensitive; keep the prefixes exactly as asked for
+            if branch['name'].startswith(tuple(prefixes)):
+                if latest_branch is None or committed_at(branch) > committed_at(latest_branch):
+                    latest_branch = branch
     return latest_branch
 
-# Read project names from file
-appnames_file = 'appnames.txt'
-try:
-    with open(appnames_file, 'r') as f:
-        appnames = [line.strip() for line in f.readlines() if line.strip()]
-except FileNotFoundError:
-    print(f"File '{appnames_file}' not found.")
-    exit()
-
-# Branch prefixes to search for
-branch_prefixes = ['release', 'Release', 'develop', 'master', 'main']
-
-# Step 1: Fetch top-level groups
-top_level_groups_url = f"{gitlab_base_url}/groups"
-response = requests.get(top_level_groups_url, headers=headers)
-
-if response.status_code == 200:
-    top_level_groups = response.json()
-
-    # Step 2: Iterate over each top-level group and search for each project
-    for group in top_level_groups:
-        parent_group_id = group['id']
+def serve(args):
+    service = LatestBranchService(crawl_projects, lambda project_id: fetch_latest_branch(project_id, branch_prefixes),
+                                  branch_prefixes, args.state, host=args.host, port=args.serve,
+                                  hook_token=args.hook_token).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        service.stop()
+        print(f"Service: {service.stats()}")
+        print(f"GitLab HTTP: {gitlab_client.summary()}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the latest release/develop branch of every app in appnames.txt")
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help='Run as a service answering GET /latest?app=<name>, kept current by GitLab system hooks')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address the --serve port binds to; anything but localhost needs --hook-token')
+    parser.add_argument('--state', default='latestbranch_state.json', help='Where the service keeps its index between restarts')
+    parser.add_argument('--hook-token', default=os.environ.get('GITLAB_HOOK_TOKEN'),
+                        help='Secret token of the system hook (checked against X-Gitlab-Token)')
+    args = parser.parse_args()
+    if args.serve is not None and args.host not in ('127.0.0.1', 'localhost', '::1') and not args.hook_token:
+        parser.error('--host other than localhost requires --hook-token')
+    if args.serve is not None:
+        serve(args)
+        exit()
+
+    # Read project names from file
+    appnames_file = 'appnames.txt'
+    try:
+        with open(appnames_file, 'r') as f:
+            appnames = [line.strip() for line in f.readlines() if line.strip()]
+    except FileNotFoundError:
+        print(f"File '{appnames_file}' not found.")
+        exit()
+
+    # Step 1: Fetch top-level groups and index every project below them, once
+    top_level_groups = list_top_level_groups()
+    if not top_level_groups:
+        print("Failed to fetch top-level groups.")
+        exit()
+    with ThreadPoolExecutor(GROUP_WORKERS) as executor:
+        indexes = dict(zip([group['id'] for group in top_level_groups],
+                           executor.map(lambda group: ProjectIndex(list_group_projects(group['id'])), top_level_groups)))
+    print(f"Indexed {sum(len(index) for index in indexes.values())} projects in {len(top_level_groups)} top-level groups")
+
+    # Step 2: Answer each app name from the index; a project matched twice is queried once
+    matches = [(group, appname) + indexes[group['id']].lookup(appname) for group in top_level_groups for appname in appnames]
+    project_ids = list(dict.fromkeys(project['id'] for _, _, project, _ in matches if project))
+    with ThreadPoolExecutor(BRANCH_WORKERS) as executor:
+        # project id -> latest matching branch or None
+        latest_branches = dict(zip(project_ids, executor.map(lambda project_id: fetch_latest_branch(project_id, branch_prefixes), project_ids)))
+
+    for group, appname, project, how in matches:
         group_name = group['full_path']
-
-        # Search for each project recursively in the group and its subgroups
-        for appname in appnames:
-            project_id = find_project_id_in_groups(parent_group_id, appname)
-            if project_id:
-                # Fetch the latest branch for the project
-                latest_branch = fetch_latest_branch(project_id, branch_prefixes)
-                if latest_branch:
-                    latest_branch_name = latest_branch['name']
-                    print(f"Latest branch for '{appname}' in group '{group_name}': {latest_branch_name}")
-                else:
-                    print(f"No matching branches found for '{appname}' in group '{group_name}'.")
+        if project:
+            if how != "exact":
+                print(f"'{appname}' matched '{project['path_with_namespace']}' by {how} match")
+            latest_branch = latest_branches[project['id']]
+            if latest_branch:
+                latest_branch_name = latest_branch['name']
+                print(f"Latest branch for '{appname}' in group '{group_name}': {latest_branch_name}")
             else:
-                print(f"No project found with name '{appname}' in group '{group_name}' or its subgroups.")
-else:
-    print(f"Failed to fetch top-level groups. Status code: {response.status_code}")
+                print(f"No matching branches found for '{appname}' in group '{group_name}'.")
+        else:
+            print(f"No project found with name '{appname}' in group '{group_name}' or its subgroups.")
+    print(f"GitLab HTTP: {gitlab_client.summary()}")
@@ -0,0 +1,134 @@
+import threading
+import requests
+from buildpoller import BuildWaiter
+
+'''
+    Load-based routing of builds across several Jenkins masters that mirror the same jobs.
+
+    Every master keeps its own HTTP client, trigger governor and status poller (see
+    JenkinsMaster). A background thread probes each master every probe_interval seconds:
+        - /computer/api/json for busy and total executors
+        - /queue/api/json for the queue length
+    route() then picks the master with the least work per executor. That is its queue plus
+    its busy executors plus the rows routed to it since its last probe, so a burst of rows
+    is spread out instead of all landing on whichever master was idle at the last probe.
+
+    A job that exists only on some masters is routed only among those. Each master is asked
+    once per job ({job}/api/json, 404 means missing) and the answer is cached. With a
+    single master nothing is probed and every row goes to it.
+'''
+
+
+class JenkinsMaster:
+    def __init__(self, url, client, governor, poller):
+        self.url = url
+        self.client = client  # httpclient.HttpClient for this master
+        self.governor = governor  # triggergovernor.TriggerGovernor for this master
+        self.poller = poller  # buildpoller.BuildStatusPoller for this master
+        self.busy_executors = 0
+        self.total_executors = 0
+        self.queue_length = 0
+        self.routed_since_probe = 0
+        self.rows_routed = 0
+
+    def load(self):
+        return (self.queue_length + self.busy_executors + self.routed_since_probe) / max(self.total_executors, 1)
+
+
+class MasterPool:
+    def __init__(self, masters, probe_interval=15):
+        self.masters = masters
+        self.probe_interval = probe_interval
+        self._has_job = {}  # (master url, job name) -> BuildWaiter resolving to True/False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def master_for(self, url):
+        # Journals written before there was a pool have no master: they ran on the first one
+        if url is None:
+            return self.masters[0]
+        return next((master for master in self.masters if master.url == url), None)
+
+    def start(self):
+        for master in self.masters:
+            master.poller.start()
+        if len(self.masters) > 1 and self._thread is None:
+            self.probe_all()  # Route the first rows on real numbers
+            self._thread = threading.Thread(target=self._run, name="master-load-probe", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for master in self.masters:
+            master.poller.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.probe_interval):
+            self.probe_all()
+
+    def probe_all(self):
+        for master in self.masters:
+            try:
+                computer = master.client.get(f"{master.url}/computer/api/json",
+                                             params={"tree": "busyExecutors,totalExecutors"})
+                queue = master.client.get(f"{master.url}/queue/api/json", params={"tree": "items[id]"})
+                if computer.status_code != 200 or queue.status_code != 200:
+                    print(f"Failed to probe load of {master.url}: {computer.status_code}/{queue.status_code}")
+                    continue
+                computer, queue = computer.json(), queue.json()
+            except (requests.RequestException, ValueError) as e:
+                print(f"Exception during probing load of {master.url}: {e}")
+                continue
+            with self._lock:
+                master.busy_executors = computer.get("busyExecutors", 0)
+                master.total_executors = computer.get("totalExecutors", 0)
+                master.queue_length = len(queue.get("items", []))
+                master.routed_since_probe = 0
+            master.governor.observe_queue(master.queue_length)
+
+    def has_job(self, master, job_name):
+        with self._lock:
+            waiter = self._has_job.get((master.url, job_name))
+            first = waiter is None
+            if first:
+                waiter = self._has_job[(master.url, job_name)] = BuildWaiter()
+        if not first:
+            return waiter.wait()
+        exists = True  # When the master can't be asked, let the trigger find out
+        try:
+            response = master.client.get(f"{master.poller.job_url(job_name)}/api/json", params={"tree": "name"})
+            exists = response.status_code != 404
+        except requests.RequestException as e:
+            print(f"Exception during checking {job_name} on {master.url}: {e}")
+        waiter.resolve(exists)
+        return exists
+
+    def job_missing(self, master, job_name):
+        # A trigger got a 404: stop sending this job to that master
+        with self._lock:
+            waiter = self._has_job[(master.url, job_name)] = BuildWaiter()
+        waiter.resolve(False)
+
+    def route(self, job_name):
+        """Pick the least loaded master that has the job; None when no master has it."""
+        candidates = self.masters
+        if len(self.masters) > 1:
+            candidates = [master for master in self.masters if self.has_job(master, job_name)]
+        if not candidates:
+            print(f"{job_name} does not exist on any of the masters")
+            return None
+        with self._lock:
+            master = min(candidates, key=JenkinsMaster.load)
+            master.routed_since_probe += 1
+            master.rows_routed += 1
+        return master
+
+    def summary(self):
+        with self._lock:
+            pinned = {job_name for (_, job_name), waiter in self._has_job.items() if waiter.done() and not waiter.result}
+        routed = ", ".join(f"{master.url} {master.rows_routed}" for master in self.masters)
+        return f"rows routed: {routed}; {len(pinned)} jobs missing on some masters"
@@ -0,0 +1,139 @@
+import hmac
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+'''
+    Embedded HTTP listener for Jenkins build notifications.
+
+    Point the Jenkins Notification plugin (JSON format) or a generic webhook at
+    http://<this host>:<port>/?token=<token> and the listener wakes the matching waiter in the status
+    poller the moment a build starts or completes, instead of at the next poll. Polling
+    keeps running at a slow pace as a safety net for lost callbacks.
+
+    Accepted payloads:
+        Notification plugin: {"name": ..., "build": {"phase": "STARTED|COMPLETED|FINALIZED",
+                              "queue_id": 12, "number": 34, "full_url": ..., "status": "SUCCESS"}}
+        Flat webhook:        {"phase": ..., "queue_id": ..., "build_number": ..., "build_url": ..., "result": ...}
+
+    With one poller per master (a list), a notification goes to the poller whose Jenkins URL
+    prefixes the build's full URL; queue ids are only unique per master, so notifications
+    without a full URL are left to the safety-net polling.
+
+    A notification decides a row's final status, so with a token set anything that doesn't
+    carry it (as ?token= or an X-Notify-Token header) is rejected with 401. The listener binds
+    to localhost unless told otherwise; the scripts refuse another host without a token.
+'''
+
+FINISHED_PHASES = {"COMPLETED", "FINALIZED"}
+NUMBER_FIELDS = ("queue_id", "number", "build_number")
+TEXT_FIELDS = ("phase", "full_url", "build_url", "url", "status", "result")
+
+
+def valid_payload(payload):
+    """True for a JSON object shaped like one of the accepted payloads, whatever it reports."""
+    if not isinstance(payload, dict):
+        return False
+    build = payload.get("build", payload)
+    if not isinstance(build, dict):
+        return False
+    for fields in (build, payload):
+        if any(fields.get(name) is not None and not isinstance(fields[name], str) for name in TEXT_FIELDS):
+            return False
+    # Build numbers and queue ids are whole numbers, sent as JSON numbers or digit strings
+    return all(build.get(name) is None or (not isinstance(build[name], bool) and str(build[name]).isdigit())
+               for name in NUMBER_FIELDS)
+
+
+class _NotificationHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass  # Jenkins posts a lot; keep the deployment output readable
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.server.listener.authorized(self.headers.get("X-Notify-Token"),
+                                               parse_qs(urlparse(self.path).query).get("token", [None])[0]):
+            self.send_response(401)
+            self.end_headers()
+            return
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                # Some webhook setups send the JSON as a form field
+                body = parse_qs(body.decode("utf-8")).get("payload", ["{}"])[0]
+            payload = json.loads(body)
+            if not valid_payload(payload):
+                raise ValueError("not a build notification")
+        except (ValueError, UnicodeDecodeError):
+            self.send_response(400)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.server.listener.handle(payload)
+
+
+class NotificationListener:
+    def __init__(self, poller, host="127.0.0.1", port=8765, token=None):
+        self.pollers = poller if isinstance(poller, (list, tuple)) else [poller]
+        self.host = host
+        self.port = port
+        self.token = token
+        self.events_received = 0
+        self.events_rejected = 0
+        self.waiters_woken = 0
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _NotificationHandler)
+        self._server.daemon_threads = True
+        self._server.listener = self
+        self.port = self._server.server_address[1]  # Resolves port 0 to the one actually bound
+        self._thread = threading.Thread(target=self._server.serve_forever, name="notification-listener", daemon=True)
+        self._thread.start()
+        print(f"Listening for Jenkins build notifications on http://{self.host}:{self.port}/")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def authorized(self, *tokens):
+        if not self.token:
+            return True
+        if any(token and hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8")) for token in tokens):
+            return True
+        with self._lock:
+            self.events_rejected += 1
+        return False
+
+    def handle(self, payload):
+        build = payload.get("build", payload)
+        phase = str(build.get("phase") or payload.get("phase") or "").upper()
+        queue_id = build.get("queue_id")
+        number = build.get("number") or build.get("build_number")
+        build_url = build.get("full_url") or build.get("build_url") or build.get("url")
+        result = build.get("status") or build.get("result")
+
+        woken = 0
+        poller = self._poller_for(build.get("full_url") or build.get("build_url"))
+        if poller is not None and queue_id is not None and number is not None:
+            woken += poller.notify_started(queue_id, number)
+        if poller is not None and phase in FINISHED_PHASES and build_url and result:
+            woken += poller.notify_finished(build_url, result)
+        with self._lock:
+            self.events_received += 1
+            self.waiters_woken += woken
+
+    def _poller_for(self, full_url):
+        if len(self.pollers) == 1:
+            return self.pollers[0]
+        return next((poller for poller in self.pollers
+                     if full_url and full_url.startswith(poller.jenkins_url.rstrip("/") + "/")), None)
+
+    def summary(self):
+        return (f"{self.events_received} notifications received, {self.waiters_woken} waiters woken by push, "
+                f"{self.events_rejected} rejected for a bad token")
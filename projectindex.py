@@ -0,0 +1,98 @@
+import bisect
+import difflib
+import threading
+
+'''
+    In-memory index of GitLab projects by name and path, so app names can be resolved
+    without a ?search= request per group. lookup() tries, in order:
+        exact     - name or path equals the app name
+        prefix    - name or path starts with it
+        substring - name or path contains it (what GitLab's ?search= matched)
+        fuzzy     - the closest name or path by difflib ratio, at least FUZZY_CUTOFF
+    All comparisons ignore case. When several projects match equally, the one nearest the
+    top of the group tree wins, then the oldest, as the old group-by-group search found it.
+'''
+
+FUZZY_CUTOFF = 0.8
+
+
+class ProjectIndex:
+    def __init__(self, projects=()):
+        self._projects = {}  # project id -> project
+        self._ids_by_key = {}  # lowercased name or path -> set of project ids
+        self._sorted_keys = None  # Rebuilt on the first prefix lookup after a change
+        self._lock = threading.Lock()
+        for project in projects:
+            self.add(project)
+
+    def __len__(self):
+        return len(self._projects)
+
+    @staticmethod
+    def _keys(project):
+        return {project["name"].lower(), project["path"].lower()}
+
+    def add(self, project):
+        with self._lock:
+            self._remove(project["id"])
+            self._projects[project["id"]] = project
+            for key in self._keys(project):
+                self._ids_by_key.setdefault(key, set()).add(project["id"])
+            self._sorted_keys = None
+
+    def remove(self, project_id):
+        with self._lock:
+            self._remove(project_id)
+
+    def _remove(self, project_id):
+        project = self._projects.pop(project_id, None)
+        if project is None:
+            return
+        for key in self._keys(project):
+            ids = self._ids_by_key.get(key, set())
+            ids.discard(project_id)
+            if not ids:
+                self._ids_by_key.pop(key, None)
+        self._sorted_keys = None
+
+    def get(self, project_id):
+        return self._projects.get(project_id)
+
+    def projects(self):
+        with self._lock:
+            return list(self._projects.values())
+
+    def _best(self, ids):
+        def depth(project_id):
+            project = self._projects[project_id]
+            return project["path_with_namespace"].count("/"), project_id
+        return self._projects[min(ids, key=depth)]
+
+    def lookup(self, appname):
+        """(project, how it matched) for the best match of appname, or (None, None)."""
+        name = appname.strip().lower()
+        with self._lock:
+            if not name or not self._projects:
+                return None, None
+            if name in self._ids_by_key:
+                return self._best(self._ids_by_key[name]), "exact"
+
+            if self._sorted_keys is None:
+                self._sorted_keys = sorted(self._ids_by_key)
+            start = bisect.bisect_left(self._sorted_keys, name)
+            ids = set()
+            for key in self._sorted_keys[start:]:
+                if not key.startswith(name):
+                    break
+                ids |= self._ids_by_key[key]
+            if ids:
+                return self._best(ids), "prefix"
+
+            ids = {project_id for key, key_ids in self._ids_by_key.items() if name in key for project_id in key_ids}
+            if ids:
+                return self._best(ids), "substring"
+
+            close = difflib.get_close_matches(name, self._sorted_keys, n=1, cutoff=FUZZY_CUTOFF)
+            if close:
+                return self._best(self._ids_by_key[close[0]]), "fuzzy"
+        return None, None
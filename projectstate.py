@@ -0,0 +1,130 @@
+import json
+import sqlite3
+import threading
+import time
+
+'''
+    Persistent per-project state for the nightly gitgroupm.py report.
+
+    One SQLite file keeps, between runs:
+        projects      - every project seen, with its last_activity_at and the last check result
+        root_projects - which projects belong to which root group, and when the root was crawled
+        responses     - ETag, pagination headers and body of GET pages, for If-None-Match requests
+    A rerun lists only the projects active since the previous crawl, answers unchanged pages
+    from the stored body on a 304, and reuses the stored result of every project whose
+    last_activity_at did not move. Deleting the file forces a full run.
+'''
+
+CACHED_HEADERS = ("X-Total-Pages", "X-Next-Page", "X-Total")  # Needed to paginate from a 304
+CHECK_FAILED = "CHECK FAILED"  # Sonar key of a project whose key lookup failed; reported, never stored
+
+
+class ProjectStateStore:
+    def __init__(self, path):
+        self.path = path
+        self.not_modified = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS projects (
+                project_id INTEGER PRIMARY KEY, project TEXT, last_activity_at TEXT,
+                checked_activity_at TEXT, has_main_branch INTEGER, sonar_project_key TEXT);
+            CREATE TABLE IF NOT EXISTS root_projects (
+                root_group_id TEXT, project_id INTEGER, PRIMARY KEY (root_group_id, project_id));
+            CREATE TABLE IF NOT EXISTS roots (
+                root_group_id TEXT PRIMARY KEY, crawled_at TEXT, full_crawl_at REAL);
+            CREATE TABLE IF NOT EXISTS responses (
+                request TEXT PRIMARY KEY, etag TEXT, headers TEXT, body TEXT);
+        """)
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    @staticmethod
+    def _request_key(url, params):
+        return f"{url}?{json.dumps(params or {}, sort_keys=True)}"
+
+    def cached_response(self, url, params):
+        """(etag, headers, body) stored for this GET, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT etag, headers, body FROM responses WHERE request = ?",
+                                   (self._request_key(url, params),)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), json.loads(row[2])
+
+    def cache_response(self, url, params, etag, headers, body):
+        kept = {name: headers[name] for name in CACHED_HEADERS if headers.get(name)}
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                             (self._request_key(url, params), etag, json.dumps(kept), json.dumps(body)))
+            self._db.commit()
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def last_crawl(self, root_group_id):
+        """(crawled_at ISO timestamp, full_crawl_at epoch seconds), or (None, None) for a new root."""
+        with self._lock:
+            row = self._db.execute("SELECT crawled_at, full_crawl_at FROM roots WHERE root_group_id = ?",
+                                   (str(root_group_id),)).fetchone()
+        return row or (None, None)
+
+    def root_projects(self, root_group_id):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT p.project FROM root_projects r JOIN projects p ON p.project_id = r.project_id "
+                "WHERE r.root_group_id = ?", (str(root_group_id),)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def save_crawl(self, root_group_id, projects, crawled_at, full):
+        # A full crawl replaces the root's membership; an incremental one only adds to it
+        with self._lock:
+            if full:
+                self._db.execute("DELETE FROM root_projects WHERE root_group_id = ?", (str(root_group_id),))
+            for project in projects:
+                self._db.execute(
+                    "INSERT INTO projects (project_id, project, last_activity_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(project_id) DO UPDATE SET project = excluded.project, "
+                    "last_activity_at = excluded.last_activity_at",
+                    (project["id"], json.dumps(project), project.get("last_activity_at")))
+                self._db.execute("INSERT OR IGNORE INTO root_projects VALUES (?, ?)", (str(root_group_id), project["id"]))
+            self._db.execute(
+                "INSERT INTO roots VALUES (?, ?, ?) ON CONFLICT(root_group_id) DO UPDATE SET "
+                "crawled_at = excluded.crawled_at, full_crawl_at = COALESCE(?, roots.full_crawl_at)",
+                (str(root_group_id), crawled_at, time.time(), time.time() if full else None))
+            self._db.commit()
+
+    def stored_result(self, project):
+        """(has_main_branch, sonar_project_key) from an earlier run if the project has not changed since."""
+        with self._lock:
+            row = self._db.execute("SELECT checked_activity_at, has_main_branch, sonar_project_key FROM projects "
+                                   "WHERE project_id = ?", (project["id"],)).fetchone()
+        if row is None or row[0] is None or row[0] != project.get("last_activity_at"):
+            return None
+        with self._lock:
+            self.reused += 1
+        return bool(row[1]), json.loads(row[2])
+
+    def known_monorepo(self, project):
+        """True when an earlier run, changed since or not, found several sonar keys in the project."""
+        with self._lock:
+            row = self._db.execute("SELECT sonar_project_key FROM projects WHERE project_id = ?",
+                                   (project["id"],)).fetchone()
+        return bool(row and row[0]) and isinstance(json.loads(row[0]), list)
+
+    def save_result(self, project, has_main_branch, sonar_project_key):
+        if has_main_branch is None or sonar_project_key == CHECK_FAILED:
+            return  # The check failed; try it again next run
+        with self._lock:
+            self._db.execute("UPDATE projects SET checked_activity_at = ?, has_main_branch = ?, sonar_project_key = ? "
+                             "WHERE project_id = ?", (project.get("last_activity_at"), int(has_main_branch),
+                                                      json.dumps(sonar_project_key), project["id"]))
+            self._db.commit()
+
+    def summary(self):
+        return f"{self.reused} projects reused from the last run, {self.not_modified} pages not modified"
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+'''
+    Append-only journal for the Excel-driven Jenkins deployments.
+
+    Every row writes one JSON line per event as it happens:
+        triggered -> queue_id, started -> build_number, finished -> result and the output row
+    so a crash or Ctrl-C loses nothing. With --resume the scripts replay the journal:
+    finished rows are copied to the output, in-flight rows re-attach to their queue item
+    or build instead of triggering a second build, and rows that never got a build are retried.
+'''
+
+
+def row_key(row_number, row):
+    # Sheet position plus content, so an edited sheet does not pick up a stale entry
+    digest = hashlib.sha1(repr(tuple(row)).encode("utf-8")).hexdigest()[:12]
+    return f"{row_number}:{digest}"
+
+
+def load_journal(path):
+    """Fold the journal into the latest known state per row key."""
+    state = {}
+    if not os.path.exists(path):
+        return state
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Torn last line from a crash mid-write
+            key = record.pop("row")
+            event = record.pop("event")
+            record.pop("time", None)
+            if event == "finished" and state.get(key, {}).get("build_number") is None:
+                # Never got a build (trigger failed or cancelled): let the rerun try again
+                state.pop(key, None)
+                continue
+            state.setdefault(key, {}).update(record)
+    return state
+
+
+class RunJournal:
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.state = load_journal(path) if resume else {}
+        if resume:
+            finished = sum(1 for entry in self.state.values() if "result" in entry)
+            print(f"Resuming from {path}: {finished} finished, {len(self.state) - finished} in flight")
+        self._file = open(path, "a" if resume else "w")
+        self._lock = threading.Lock()
+
+    def record(self, key, event, **fields):
+        line = json.dumps(dict(time=time.time(), row=key, event=event, **fields), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,108 @@
+import time
+import pytest
+import requests
+import branchservice
+import latestbranch
+from branchservice import LatestBranchService
+from fakegitlab import FakeGitLab
+
+HOOK_TOKEN = "s3cret"
+
+
+def eventually(check, timeout=5.0):
+    # Hooks are handled after the service has answered them, so give it a moment
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeGitLab(port=0, projects=20, branches=10, hook_token=HOOK_TOKEN).start()
+    monkeypatch.setattr(latestbranch, "gitlab_base_url", fake.url)
+    yield fake
+    fake.stop()
+
+
+def start_service(state_path, crawl_projects=None):
+    return LatestBranchService(crawl_projects or latestbranch.crawl_projects,
+                               lambda project_id: latestbranch.fetch_latest_branch(project_id, latestbranch.branch_prefixes),
+                               latestbranch.branch_prefixes, str(state_path), host="127.0.0.1", port=0,
+                               hook_token=HOOK_TOKEN).start()
+
+
+@pytest.fixture
+def service(fake, tmp_path):
+    service = start_service(tmp_path / "state.json")
+    fake.hook_url = f"http://127.0.0.1:{service.port}/hook"
+    yield service
+    service.stop()
+
+
+def latest(service, app):
+    return requests.get(f"http://127.0.0.1:{service.port}/latest", params={"app": app}).json()
+
+
+def test_answers_match_the_api(fake, service):
+    for project_id in fake.projects:
+        assert latest(service, f"app-{project_id}")["branch"] == fake.latest(project_id, latestbranch.branch_prefixes)
+
+
+def test_push_moves_latest_branch_forward(fake, service):
+    assert latest(service, "app-3")["project_id"] == 3
+    reads = service.stats()["api_reads"]
+    fake.push(3, "release/99.0")
+    assert eventually(lambda: latest(service, "app-3")["branch"] == "release/99.0")
+    assert service.stats()["api_reads"] == reads  # Answered from the event, not the API
+
+
+def test_untracked_push_is_ignored(fake, service):
+    before = latest(service, "app-4")["branch"]
+    fake.push(4, "feature/new")
+    assert eventually(lambda: service.stats()["events_received"] == 1)
+    assert latest(service, "app-4")["branch"] == before
+
+
+def test_deleting_latest_branch_rereads_project(fake, service):
+    current = latest(service, "app-5")["branch"]
+    fake.delete_branch(5, current)
+    expected = fake.latest(5, latestbranch.branch_prefixes)
+    assert expected != current
+    assert eventually(lambda: latest(service, "app-5")["branch"] == expected)
+
+
+def test_created_project_is_indexed(fake, service):
+    project_id = fake.create_project("brand-new-app")
+    assert eventually(lambda: latest(service, "brand-new-app").get("project_id") == project_id)
+    assert latest(service, "brand-new-app")["branch"] == "main"
+
+
+def test_hook_without_valid_token_is_rejected(fake, service):
+    url = f"http://127.0.0.1:{service.port}/hook"
+    payload = {"event_name": "project_destroy", "project_id": 1}
+    assert requests.post(url, json=payload).status_code == 401
+    assert requests.post(url, json=payload, headers={"X-Gitlab-Token": "wrong"}).status_code == 401
+    assert service.stats()["events_received"] == 0
+    assert latest(service, "app-1")["project_id"] == 1
+
+
+def test_maintenance_survives_failed_reindex(fake, tmp_path, monkeypatch):
+    monkeypatch.setattr(branchservice, "SAVE_INTERVAL", 0.05)
+    monkeypatch.setattr(branchservice, "REINDEX_INTERVAL", 0)
+    calls = []
+
+    def flaky_crawl():
+        calls.append(time.monotonic())
+        if len(calls) == 2:
+            raise requests.ConnectionError("GitLab went away")
+        return latestbranch.crawl_projects()
+
+    service = start_service(tmp_path / "state.json", flaky_crawl)
+    try:
+        assert eventually(lambda: len(calls) >= 4)
+        assert service.stats()["maintenance_errors"] == 1
+    finally:
+        service.stop()
@@ -0,0 +1,143 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from deviceallocator import DeviceAllocator, request
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_SIMCTL = f"{sys.executable} {os.path.join(REPO_DIR, 'fakesimctl.py')}"
+IPHONES = 6  # FAKE_SIMCTL_COUNT=8 gives the newest iOS runtime 6 iPhones and 2 iPads
+
+
+@pytest.fixture
+def allocator(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_SIMCTL_DEVICES", str(tmp_path / "devices.json"))
+    monkeypatch.setenv("FAKE_SIMCTL_COUNT", "8")
+    allocator = DeviceAllocator(str(tmp_path / "allocator.sock"), FAKE_SIMCTL, device_set_path=str(tmp_path)).start()
+    yield allocator
+    allocator.stop()
+
+
+def lease(allocator, **message):
+    return request(allocator.socket_path, dict({"op": "lease", "holder": "test"}, **message), timeout=30)
+
+
+def release(allocator, *udids):
+    return request(allocator.socket_path, {"op": "release", "udids": list(udids)})["released"]
+
+
+def test_concurrent_clients_get_exclusive_leases(allocator):
+    held = set()
+    overlaps, granted = [], []
+    lock = threading.Lock()
+
+    def job(number):
+        answer = lease(allocator, holder=f"job-{number}", wait=20)
+        udid = answer["udid"]
+        with lock:
+            if udid in held:
+                overlaps.append(udid)
+            held.add(udid)
+            granted.append(udid)
+        time.sleep(0.05)
+        with lock:
+            held.discard(udid)
+        assert release(allocator, udid)
+
+    threads = [threading.Thread(target=job, args=(number,)) for number in range(3 * IPHONES)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlaps == []
+    assert len(granted) == 3 * IPHONES
+    assert len(set(granted)) == IPHONES
+    assert allocator.status()["leases"] == []
+
+
+def test_lease_without_wait_fails_when_all_are_taken(allocator):
+    udids = [lease(allocator)["udid"] for _ in range(IPHONES)]
+    assert len(set(udids)) == IPHONES
+    assert lease(allocator) == {"error": "no device available"}
+
+
+def test_waiter_is_woken_on_release(allocator):
+    udids = [lease(allocator)["udid"] for _ in range(IPHONES)]
+    answers = []
+    waiter = threading.Thread(target=lambda: answers.append(lease(allocator, wait=20)))
+    waiter.start()
+    time.sleep(0.2)
+    assert allocator.status()["waiting"] == 1
+    started = time.monotonic()
+    assert release(allocator, udids[2])
+    waiter.join(5)
+    assert answers and answers[0]["udid"] == udids[2]
+    assert time.monotonic() - started < 1  # Not the next inventory check, the release itself
+
+
+def test_expired_lease_goes_to_waiter(allocator):
+    short = [lease(allocator, ttl=0.3)["udid"] for _ in range(IPHONES)]
+    answer = lease(allocator, wait=10)
+    assert answer["udid"] in short
+    time.sleep(0.5)  # The rest expire too
+    leases = allocator.status()["leases"]
+    assert [item["udid"] for item in leases] == [answer["udid"]]
+
+
+def test_renew_keeps_lease_past_its_ttl(allocator):
+    udid = lease(allocator, ttl=0.5)["udid"]
+    time.sleep(0.3)
+    assert request(allocator.socket_path, {"op": "renew", "udid": udid, "ttl": 5})["udid"] == udid
+    time.sleep(0.4)
+    assert [item["udid"] for item in allocator.status()["leases"]] == [udid]
+
+
+def test_count_leases_distinct_matching_devices(allocator):
+    answer = lease(allocator, count=3, constraints={"model": "iPhone 15"})
+    assert len({item["udid"] for item in answer["leases"]}) == 3
+    assert all(item["name"].startswith("iPhone 15") for item in answer["leases"])
+    assert lease(allocator, count=IPHONES, constraints={}) == {"error": f"no {IPHONES} matching devices available"}
+    assert release(allocator, *[item["udid"] for item in answer["leases"]])
+
+
+def test_malformed_requests_get_an_error(allocator):
+    for message in ([], "lease", 3, None):
+        assert request(allocator.socket_path, message) == {"error": "bad request"}
+    assert "udid" in lease(allocator)
+
+
+def wait_for_waiters(allocator, count):
+    deadline = time.monotonic() + 5
+    while allocator.status()["waiting"] < count and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert allocator.status()["waiting"] == count
+
+
+def test_waiter_that_can_never_be_met_holds_nothing_back(allocator):
+    threading.Thread(target=lambda: lease(allocator, count=50, wait=2), daemon=True).start()
+    wait_for_waiters(allocator, 1)
+    assert "udid" in lease(allocator, constraints={"family": "iPad"})
+    assert "udid" in lease(allocator)
+
+
+def test_waiter_keeps_its_devices_from_later_requests(allocator):
+    first = lease(allocator)["udid"]
+    answers = []
+    waiter = threading.Thread(target=lambda: answers.append(lease(allocator, count=IPHONES, wait=10)))
+    waiter.start()
+    wait_for_waiters(allocator, 1)
+    assert lease(allocator) == {"error": "no device available"}  # Would starve the waiter
+    assert "udid" in lease(allocator, constraints={"family": "iPad"})  # Not what it waits for
+    assert release(allocator, first)
+    waiter.join(5)
+    assert len(answers[0]["leases"]) == IPHONES
+
+
+def test_release_needs_allocator():
+    env = {key: value for key, value in os.environ.items() if key != "DEVICE_ALLOCATOR"}
+    result = subprocess.run([sys.executable, os.path.join(REPO_DIR, "device.py"), "--release", "ABC"],
+                            env=env, capture_output=True, text=True)
+    assert result.returncode == 2
+    assert "--release needs --allocator" in result.stderr
@@ -0,0 +1,44 @@
+import threading
+from buildpoller import BuildWaiter
+
+'''
+    Duplicate-trigger coalescing for the Excel-driven deployments.
+
+    Rows that would send the same job the same parameters (app aliases, copy-pasted rows)
+    are fingerprinted on (job, normalized params). The first row triggers the build; every
+    later row with the same fingerprint waits for that row's queue id and follows the same
+    build, so all of them get its result without triggering Jenkins again.
+'''
+
+
+def _normalize(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '' if value is None else str(value).strip()
+
+
+class TriggerCoalescer:
+    def __init__(self, ignored_params=()):
+        # Params that don't change what the build does, e.g. a display-only app alias
+        self.ignored_params = set(ignored_params)
+        self.builds_saved = 0
+        self._triggers = {}  # fingerprint -> BuildWaiter resolving to the first row's trigger (None if it failed)
+        self._lock = threading.Lock()
+
+    def fingerprint(self, job_name, params):
+        return job_name.strip(), tuple(sorted((name, _normalize(value)) for name, value in params.items()
+                                              if name not in self.ignored_params))
+
+    def claim(self, job_name, params):
+        """Returns (waiter, first); only the first row for a fingerprint should trigger and resolve the waiter."""
+        fingerprint = self.fingerprint(job_name, params)
+        with self._lock:
+            waiter = self._triggers.get(fingerprint)
+            if waiter is not None:
+                self.builds_saved += 1
+                return waiter, False
+            waiter = self._triggers[fingerprint] = BuildWaiter()
+            return waiter, True
+
+    def summary(self):
+        return f"{self.builds_saved} duplicate rows shared an existing build instead of triggering a new one"
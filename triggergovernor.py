@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+'''
+    Per-master governor for Jenkins triggers.
+
+    Two limits apply before a build is triggered:
+        - a token bucket caps how fast new triggers are sent (rate per second, with a burst)
+        - an AIMD window caps how many triggered builds may sit in the master's queue at once
+    Like TCP congestion control, the window doubles per round of started builds until the
+    master first shows strain, then grows by one per round; it only grows while it is full, so
+    it stays close to what is really outstanding. It is halved (at most once per adjust_interval)
+    when the master's queue gets long or its API slows down. Each master
+    runs at the highest trigger concurrency it can sustain instead of a hand-picked max_threads.
+'''
+
+LATENCY_SMOOTHING = 0.2  # Weight of the newest sample in the latency moving average
+
+
+class TriggerGovernor:
+    def __init__(self, name, initial_limit=20, min_limit=1, max_limit=200, rate=5, burst=10,
+                 max_queue_length=50, max_latency=2.0, adjust_interval=10):
+        self.name = name
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.rate = rate
+        self.burst = burst
+        self.max_queue_length = max_queue_length  # Master queue length considered saturated
+        self.max_latency = max_latency  # Smoothed API latency in seconds considered overloaded
+        self.adjust_interval = adjust_interval
+        self.outstanding = 0
+        self.queue_length = 0
+        self.latency = 0.0
+        self.throttled = 0
+        self.decreases = 0
+        self.peak_limit = initial_limit
+        self._tokens = burst
+        self._refilled_at = time.monotonic()
+        self._adjusted_at = time.monotonic()
+        self._condition = threading.Condition()
+
+    def observe_queue(self, length):
+        with self._condition:
+            self.queue_length = length
+
+    def observe_latency(self, seconds):
+        with self._condition:
+            self.latency += LATENCY_SMOOTHING * (seconds - self.latency)
+
+    def _adjust(self, now):
+        if now - self._adjusted_at < self.adjust_interval:
+            return
+        self._adjusted_at = now
+        if self._congested():
+            # Multiplicative decrease: back off hard as soon as the master shows strain
+            self.limit = max(self.min_limit, int(self.limit) // 2)
+            self.decreases += 1
+            print(f"[{self.name}] queue {self.queue_length}, latency {self.latency:.2f}s: trigger window down to {self.limit}")
+            self._condition.notify_all()
+
+    def _congested(self):
+        return self.queue_length > self.max_queue_length or self.latency > self.max_latency
+
+    def _try_acquire(self):
+        # Returns 0 when a trigger slot was taken, otherwise how long to wait before retrying
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        self._adjust(now)
+        if self.outstanding >= int(self.limit):
+            return self.adjust_interval
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        self._tokens -= 1
+        self.outstanding += 1
+        return 0
+
+    def acquire(self):
+        with self._condition:
+            wait = self._try_acquire()
+            if wait:
+                self.throttled += 1
+            while wait:
+                self._condition.wait(wait)
+                wait = self._try_acquire()
+
+    async def acquire_async(self):
+        with self._condition:
+            wait = self._try_acquire()
+            if wait:
+                self.throttled += 1
+        while wait:
+            await asyncio.sleep(min(wait, 1))
+            with self._condition:
+                wait = self._try_acquire()
+
+    def release(self, *_):
+        # Called when a triggered build leaves the queue (or the trigger failed)
+        with self._condition:
+            window_full = self.outstanding >= int(self.limit)
+            self.outstanding -= 1
+            if window_full and not self._congested():
+                # Only a full window says more would be used. Slow start until the first backoff,
+                # then one extra slot per window of started builds
+                self.limit = min(self.max_limit, self.limit + (1 if not self.decreases else 1 / self.limit))
+                self.peak_limit = max(self.peak_limit, int(self.limit))
+            self._condition.notify_all()
+
+    def summary(self):
+        return (f"trigger window {int(self.limit)} (peak {self.peak_limit}), {self.throttled} throttled triggers, "
+                f"{self.decreases} backoffs, last queue length {self.queue_length}, latency {self.latency:.2f}s")